@@ -0,0 +1,147 @@
+"""
+Measure the cost of moving large multi-canvas requests through the Fabric models:
+validating the request, FastAPI's response path (dump, validate again, serialize)
+versus serializing the models straight to JSON, and repeated decoding of the same
+image source. Run from the src directory:
+
+    python -m benchmarks.bench_fabric_models
+"""
+
+import argparse
+import json
+import timeit
+from base64 import b64encode
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+from pydantic import TypeAdapter
+
+from chat2edit.fabric.fabric_models import FabricCanvas
+from chat2edit.utils.image import data_url_to_pil_image, pil_image_to_data_url
+
+
+BACKGROUND_BYTES = 4 * 1024 * 1024
+OBJECT_BYTES = 200 * 1024
+DECODE_IMAGE_SIZE = (2000, 1500)
+DECODES_PER_TURN = 3
+
+canvases_adapter = TypeAdapter(List[FabricCanvas])
+
+
+def create_src(size: int, rng: np.random.Generator) -> str:
+    # Only the length matters for parsing and serializing, the bytes never decode.
+    payload = b64encode(rng.bytes(size * 3 // 4)).decode("ascii")
+    return "data:image/png;base64," + payload
+
+
+def create_request_canvases(
+    canvas_count: int, object_count: int, rng: np.random.Generator
+) -> List[Dict[str, Any]]:
+    canvases = []
+    for i in range(canvas_count):
+        objects = [
+            {
+                "type": "image",
+                "left": 10 * j,
+                "top": 10 * j,
+                "width": 100,
+                "height": 100,
+                "src": create_src(OBJECT_BYTES, rng),
+                "labelToScore": {"object": 0.5},
+            }
+            for j in range(object_count)
+        ]
+        canvases.append(
+            {
+                "id": f"canvas-{i}",
+                "objects": objects,
+                "backgroundImage": {
+                    "type": "image",
+                    "width": 4000,
+                    "height": 3000,
+                    "src": create_src(BACKGROUND_BYTES, rng),
+                    "filename": f"image-{i}.png",
+                },
+            }
+        )
+
+    return canvases
+
+
+def fastapi_response(canvases: List[FabricCanvas]) -> bytes:
+    dumped = [canvas.model_dump() for canvas in canvases]
+    validated = canvases_adapter.validate_python(dumped)
+    return json.dumps(canvases_adapter.dump_python(validated, mode="json")).encode()
+
+
+def measure_ms(func: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--canvases", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'canvases':>9}{'MB':>7}{'validate':>10}{'src copied':>12}"
+        f"{'fastapi resp':>14}{'direct resp':>13}  (ms)"
+    )
+    for canvas_count in args.canvases:
+        payload = create_request_canvases(canvas_count, args.objects, rng)
+        canvases = canvases_adapter.validate_python(payload)
+        src_copied = canvases[0].backgroundImage.src is not (
+            payload[0]["backgroundImage"]["src"]
+        )
+        size_mb = len(canvases_adapter.dump_json(canvases)) / 1024 / 1024
+        validate_ms = measure_ms(
+            lambda: canvases_adapter.validate_python(payload), args.number
+        )
+        fastapi_ms = measure_ms(lambda: fastapi_response(canvases), args.number)
+        direct_ms = measure_ms(
+            lambda: canvases_adapter.dump_json(canvases), args.number
+        )
+        print(
+            f"{canvas_count:>9}{size_mb:>7.1f}{validate_ms:>10.2f}{str(src_copied):>12}"
+            f"{fastapi_ms:>14.2f}{direct_ms:>13.2f}"
+        )
+
+    pixels = rng.integers(0, 256, (*DECODE_IMAGE_SIZE[::-1], 3), dtype=np.uint8)
+    src = pil_image_to_data_url(Image.fromarray(pixels))
+    canvas = FabricCanvas.model_validate(
+        {
+            "id": "canvas",
+            "objects": [],
+            "backgroundImage": {
+                "type": "image",
+                "width": DECODE_IMAGE_SIZE[0],
+                "height": DECODE_IMAGE_SIZE[1],
+                "src": src,
+                "filename": "image.png",
+            },
+        }
+    )
+
+    def decode_uncached() -> None:
+        for _ in range(DECODES_PER_TURN):
+            data_url_to_pil_image(src).load()
+
+    def decode_cached() -> None:
+        canvas.backgroundImage._decoded_src = None
+        for _ in range(DECODES_PER_TURN):
+            canvas.backgroundImage.get_pil_image().load()
+
+    print(
+        f"{DECODES_PER_TURN} decodes of a {DECODE_IMAGE_SIZE[0]}x{DECODE_IMAGE_SIZE[1]}"
+        f" PNG: uncached {measure_ms(decode_uncached, 1):.1f} ms,"
+        f" cached {measure_ms(decode_cached, 1):.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Throughput of LaMa inpainting with batching. For every image size and batch size
+N, N images are inpainted one call at a time (serial), in one Inpainter.batch
+call (batch), and from N concurrent threads through the Toolkit micro-batcher
+(toolkit), which is the path bulk edits and simultaneous users take. With
+--jitter the images differ in width by up to that many pixels, to see how the
+size buckets hold up. Uses the checkpoint of --config, or a one convolution
+stand-in that only measures our pre and post processing. Run from the src
+directory:
+
+    python -m benchmarks.bench_lama_batching --config config/my_config.yaml \
+        --sizes 512 1024 --batch-sizes 1 2 4 8
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from benchmarks.compare_backends import create_tool
+from benchmarks.suite import StubSegmenter, create_image, create_stub_lama
+from chat2edit.tools.backends import configure_threads
+from chat2edit.tools.base import Inpainter
+from chat2edit.tools.toolkit import Toolkit
+from chat2edit.utils.mask import Mask
+
+
+MAX_WAIT_MS = 20.0
+
+
+def create_inputs(
+    size: int, count: int, jitter: int, rng: np.random.Generator
+) -> Tuple[List[Image.Image], List[Mask]]:
+    images = []
+    masks = []
+    for _ in range(count):
+        image = create_image(size + int(rng.integers(0, jitter + 1)), rng)
+        _, image_masks = StubSegmenter()(image, "object")
+        images.append(image)
+        masks.append(image_masks[0])
+    return images, masks
+
+
+def time_run(func: Callable[[], object], repeat: int) -> float:
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def run_toolkit(
+    toolkit: Toolkit, images: List[Image.Image], masks: List[Mask]
+) -> List[Image.Image]:
+    with ThreadPoolExecutor(max_workers=len(images)) as executor:
+        return list(executor.map(toolkit.inpaint, images, masks))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--config", help="App config with the LaMa checkpoint")
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--jitter", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    inpainter: Inpainter
+    if args.config is None:
+        inpainter = create_stub_lama()
+    else:
+        with open(args.config, "r") as f:
+            config = yaml.safe_load(f)
+        threads_config = config["tools"].get("threads", {})
+        configure_threads(
+            threads_config.get("intra_op"), threads_config.get("inter_op")
+        )
+        inpainter = create_tool(config, "lama", args.backend)
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'size':>6}{'batch':>7}{'mode':>9}{'ms':>10}{'images/s':>10}{'speedup':>9}")
+    for size in args.sizes:
+        for batch_size in args.batch_sizes:
+            images, masks = create_inputs(size, batch_size, args.jitter, rng)
+            toolkit = Toolkit(StubSegmenter(), inpainter, batch_size, MAX_WAIT_MS)
+            runs = {
+                "serial": lambda: [inpainter(*item) for item in zip(images, masks)],
+                "batch": lambda: inpainter.batch(images, masks),
+                "toolkit": lambda: run_toolkit(toolkit, images, masks),
+            }
+            serial_ms = None
+            for mode, run in runs.items():
+                ms = time_run(run, args.repeat)
+                serial_ms = serial_ms or ms
+                print(
+                    f"{size:>6}{batch_size:>7}{mode:>9}{ms:>10.1f}"
+                    f"{batch_size / ms * 1000:>10.2f}{serial_ms / ms:>8.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
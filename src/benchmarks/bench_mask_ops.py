@@ -0,0 +1,91 @@
+"""
+Compare the full-frame mask helpers of chat2edit.utils.image with their
+region-restricted versions. Run from the src directory:
+
+    python -m benchmarks.bench_mask_ops
+"""
+
+import argparse
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from chat2edit.utils.image import (
+    expand_mask,
+    expand_mask_region,
+    image_to_mask,
+    image_to_mask_region,
+    post_process_mask,
+    post_process_mask_region,
+)
+
+
+MEGAPIXELS = (1, 4, 12)
+OBJECT_FRACTION = 0.05
+EXPAND_ITERATIONS = 10
+
+
+def create_mask(megapixels: int) -> np.ndarray:
+    height = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    width = megapixels * 1_000_000 // height
+    mask = np.zeros((height, width), dtype=np.uint8)
+    radius_x = int(width * OBJECT_FRACTION**0.5 / 2)
+    radius_y = int(height * OBJECT_FRACTION**0.5 / 2)
+    yy, xx = np.ogrid[:height, :width]
+    ellipse = ((xx - width // 3) / radius_x) ** 2 + ((yy - height // 2) / radius_y) ** 2
+    mask[ellipse <= 1] = 255
+    return mask
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def run(repeat: int) -> List[Tuple[str, int, float, float]]:
+    results = []
+    for megapixels in MEGAPIXELS:
+        mask = create_mask(megapixels)
+        out = np.empty_like(mask)
+        rgba = np.zeros((*mask.shape, 4), dtype=np.uint8)
+        rgba[..., 3] = mask
+        image = Image.fromarray(rgba, "RGBA")
+
+        cases: Dict[str, Tuple[Callable[[], object], Callable[[], object]]] = {
+            "expand_mask": (
+                lambda: expand_mask(mask, EXPAND_ITERATIONS),
+                lambda: expand_mask_region(mask, EXPAND_ITERATIONS, out),
+            ),
+            "post_process_mask": (
+                lambda: post_process_mask(mask),
+                lambda: post_process_mask_region(mask, out),
+            ),
+            "image_to_mask": (
+                lambda: image_to_mask(image),
+                lambda: image_to_mask_region(image, out),
+            ),
+        }
+        for name, (full, region) in cases.items():
+            results.append(
+                (name, megapixels, measure(full, repeat), measure(region, repeat))
+            )
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'helper':<20}{'MP':>4}{'full (ms)':>12}{'region (ms)':>14}{'speedup':>10}")
+    for name, megapixels, full_ms, region_ms in run(args.repeat):
+        print(
+            f"{name:<20}{megapixels:>4}{full_ms:>12.2f}{region_ms:>14.2f}"
+            f"{full_ms / region_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measure how box suppression in GroundedSAM cuts SAM decodes and duplicate objects.
+Synthetic GroundingDINO outputs are generated with several jittered near-duplicates
+and contained part boxes per ground truth object. Run from the src directory:
+
+    python -m benchmarks.bench_nms
+"""
+
+import argparse
+import timeit
+from typing import Tuple
+
+import numpy as np
+
+from chat2edit.utils.image import iou_matrix, nms
+
+
+IMAGE_SIZE = (4000, 3000)
+OBJECT_COUNTS = (1, 5, 20)
+DUPLICATES_PER_OBJECT = 4
+PARTS_PER_OBJECT = 1
+JITTER = 0.04
+
+
+def create_detections(
+    object_count: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    width, height = IMAGE_SIZE
+    boxes = []
+    scores = []
+    object_ids = []
+    for object_id in range(object_count):
+        w, h = rng.uniform(0.05, 0.25) * width, rng.uniform(0.05, 0.25) * height
+        x, y = rng.uniform(0, width - w), rng.uniform(0, height - h)
+        for _ in range(DUPLICATES_PER_OBJECT):
+            dx, dy = rng.normal(0, JITTER, 2) * (w, h)
+            dw, dh = rng.normal(0, JITTER, 2) * (w, h)
+            boxes.append([x + dx, y + dy, x + w + dx + dw, y + h + dy + dh])
+            scores.append(rng.uniform(0.4, 0.9))
+            object_ids.append(object_id)
+        for _ in range(PARTS_PER_OBJECT):
+            px, py = x + rng.uniform(0.1, 0.4) * w, y + rng.uniform(0.1, 0.4) * h
+            boxes.append([px, py, px + 0.4 * w, py + 0.4 * h])
+            scores.append(rng.uniform(0.36, 0.5))
+            object_ids.append(object_id)
+
+    return np.array(boxes), np.array(scores), np.array(object_ids)
+
+
+def count_duplicates(object_ids: np.ndarray) -> int:
+    return len(object_ids) - len(np.unique(object_ids))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iou-threshold", type=float, default=0.5)
+    parser.add_argument("--containment-threshold", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'objects':>8}{'boxes':>8}{'SAM calls':>11}{'dupes before':>14}"
+        f"{'dupes after':>13}{'nms (ms)':>10}{'missed':>8}"
+    )
+    for object_count in OBJECT_COUNTS:
+        boxes, scores, object_ids = create_detections(object_count, rng)
+        suppress = lambda: nms(
+            boxes, scores, args.iou_threshold, args.containment_threshold
+        )
+        keep = suppress()
+        nms_ms = min(timeit.repeat(suppress, number=10, repeat=3)) / 10 * 1000
+        missed = object_count - len(np.unique(object_ids[keep]))
+        print(
+            f"{object_count:>8}{len(boxes):>8}{len(keep):>11}"
+            f"{count_duplicates(object_ids):>14}{count_duplicates(object_ids[keep]):>13}"
+            f"{nms_ms:>10.3f}{missed:>8}"
+        )
+
+    # Overlap between distinct objects is what bounds the thresholds from below.
+    boxes, _, object_ids = create_detections(OBJECT_COUNTS[-1], rng)
+    overlaps = iou_matrix(boxes)[object_ids[:, None] != object_ids[None, :]]
+    print(f"max iou between distinct objects: {overlaps.max():.2f}")
+
+
+if __name__ == "__main__":
+    main()
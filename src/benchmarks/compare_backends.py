@@ -0,0 +1,158 @@
+"""
+Compare the accuracy and latency of the optimized tool backends against the eager
+baseline: mask IoU for GroundedSAM (groundingdino and sam backends) and PSNR of the
+inpainted image for LaMa. Run from the src directory:
+
+    python -m benchmarks.compare_backends --config config/my_config.yaml \
+        --tool sam --backends quantized torchscript --images photo.jpg --prompt cat
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from PIL import Image
+
+from chat2edit.tools.backends import configure_threads
+from chat2edit.utils.mask import Mask
+
+
+SYNTHETIC_SIZE = (1024, 768)
+
+
+def mask_iou(masks1: List[Mask], masks2: List[Mask]) -> float:
+    union1 = union2 = None
+    for mask in masks1:
+        union1 = mask if union1 is None else union1.union(mask)
+    for mask in masks2:
+        union2 = mask if union2 is None else union2.union(mask)
+
+    if union1 is None and union2 is None:
+        return 1.0
+    if union1 is None or union2 is None:
+        return 0.0
+
+    array1 = union1.to_array() != 0
+    array2 = union2.to_array() != 0
+    return float((array1 & array2).sum() / max((array1 | array2).sum(), 1))
+
+
+def psnr(image1: Image.Image, image2: Image.Image) -> float:
+    array1 = np.asarray(image1.convert("RGB"), dtype=np.float64)
+    array2 = np.asarray(image2.convert("RGB"), dtype=np.float64)
+    mse = np.mean((array1 - array2) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255**2 / mse))
+
+
+def create_center_mask(size: Tuple[int, int]) -> Mask:
+    width, height = size
+    yy, xx = np.ogrid[:height, :width]
+    ellipse = ((xx - width / 2) / (width / 6)) ** 2 + (
+        (yy - height / 2) / (height / 6)
+    ) ** 2
+    return Mask.from_array(ellipse <= 1)
+
+
+def load_images(paths: List[str]) -> List[Image.Image]:
+    if not paths:
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, (*SYNTHETIC_SIZE[::-1], 3), dtype=np.uint8)
+        return [Image.fromarray(pixels)]
+
+    return [Image.open(path).convert("RGB") for path in paths]
+
+
+def time_call(func: Callable[[], object], repeat: int) -> Tuple[object, float]:
+    result = func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / max(repeat, 1) * 1000
+
+
+def create_tool(config: Dict, tool: str, backend: Optional[str]):
+    tools_config = config["tools"]
+    threads_config = tools_config.get("threads", {})
+    if tool == "lama":
+        from chat2edit.tools.lama_inpainter import LaMaInpainter
+
+        return LaMaInpainter(
+            checkpoint=tools_config["lama"]["checkpoint"],
+            device=tools_config["lama"]["device"],
+            backend=backend or "eager",
+        )
+
+    from chat2edit.tools.grounded_sam import GroundedSAM
+
+    return GroundedSAM(
+        gdino_checkpoint=tools_config["groundingdino"]["checkpoint"],
+        gdino_config=tools_config["groundingdino"]["config"],
+        gdino_device=tools_config["groundingdino"]["device"],
+        sam_checkpoint=tools_config["sam"]["checkpoint"],
+        sam_model_type=tools_config["sam"]["model_type"],
+        sam_device=tools_config["sam"]["device"],
+        gdino_backend=(backend if tool == "groundingdino" else None) or "eager",
+        sam_backend=(backend if tool == "sam" else None) or "eager",
+        sam_onnx_path=tools_config["sam"].get("onnx_path"),
+        intra_op_threads=threads_config.get("intra_op"),
+        inter_op_threads=threads_config.get("inter_op"),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", required=True)
+    parser.add_argument(
+        "--tool", choices=["groundingdino", "sam", "lama"], required=True
+    )
+    parser.add_argument("--backends", nargs="+", required=True)
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--prompt", default="object")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    threads_config = config["tools"].get("threads", {})
+    configure_threads(threads_config.get("intra_op"), threads_config.get("inter_op"))
+    images = load_images(args.images)
+
+    if args.tool == "lama":
+        masks = [create_center_mask(image.size) for image in images]
+        run = lambda tool, i: tool(images[i], masks[i])
+        compare, metric = psnr, "PSNR (dB)"
+    else:
+        run = lambda tool, i: tool(images[i], args.prompt)[1]
+        compare, metric = mask_iou, "mask IoU"
+
+    baseline = create_tool(config, args.tool, None)
+    baseline_results = []
+    baseline_ms = []
+    for i in range(len(images)):
+        result, ms = time_call(lambda: run(baseline, i), args.repeat)
+        baseline_results.append(result)
+        baseline_ms.append(ms)
+    del baseline
+
+    print(f"{'backend':<14}{'latency (ms)':>14}{'speedup':>10}{metric:>14}")
+    print(f"{'eager':<14}{np.mean(baseline_ms):>14.1f}{1.0:>9.2f}x{'-':>14}")
+    for backend in args.backends:
+        tool = create_tool(config, args.tool, backend)
+        latencies = []
+        scores = []
+        for i in range(len(images)):
+            result, ms = time_call(lambda: run(tool, i), args.repeat)
+            latencies.append(ms)
+            scores.append(compare(baseline_results[i], result))
+        speedup = np.mean(baseline_ms) / np.mean(latencies)
+        print(
+            f"{backend:<14}{np.mean(latencies):>14.1f}{speedup:>9.2f}x"
+            f"{np.mean(scores):>14.3f}"
+        )
+        del tool
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Replay the turns recorded by the trace log (config trace_log) against the current
+code, chat by chat in recorded order, and compare time per stage and behaviour
+(commands run, final status) with the recording. The LLM answers with the
+recorded responses by default and the tools are the benchmark stand-ins, so the
+comparison covers our own code. Use --llm real and --tools real with a config to
+replay end to end. Run from the src directory:
+
+    python -m benchmarks.replay_traces traces/turns-*.jsonl.gz
+    python -m benchmarks.replay_traces traces/*.jsonl.gz --tools real \
+        --config config/my_config.yaml --output replay.json
+
+Images come from the trace log's image store when it was recorded with
+store_images, otherwise synthetic images of the recorded sizes stand in.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+from benchmarks.suite import StubInpainter, StubSegmenter, create_image
+from chat2edit.chat2edit import Chat2Edit
+from chat2edit.core.chat_state import ChatState
+from chat2edit.core.message import UserMessage
+from chat2edit.core.trace_log import SRC_HASH_PREFIX, iter_trace_records, load_src
+from chat2edit.fabric.fabric_method_provider import FabricMethodProvider
+from chat2edit.fabric.fabric_models import FabricCanvas
+from chat2edit.tools.toolkit import Toolkit
+from chat2edit.utils.image import pil_image_to_data_url
+from chat2edit.utils.metrics import trace
+
+
+class RecordedLLM:
+    """Answers with the responses of the turn being replayed, in order."""
+
+    def __init__(self) -> None:
+        self.responses: List[str] = []
+
+    def start_turn(self, responses: List[str]) -> None:
+        self.responses = list(responses)
+
+    def __call__(self, messages: List[str], *args: Any, **kwargs: Any) -> str:
+        if not self.responses:
+            raise RuntimeError("The recorded turn has no more LLM responses")
+
+        return self.responses.pop(0)
+
+
+class SrcRestorer:
+    def __init__(self, image_directory: Optional[str]) -> None:
+        self.image_directory = image_directory
+        self.synthetic_count = 0
+        self._srcs: Dict[str, str] = {}
+        self._rng = np.random.default_rng(0)
+
+    def __call__(self, value: Any) -> Any:
+        """Copy of a dumped canvas with the src hashes replaced by image srcs."""
+        if isinstance(value, list):
+            return [self(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        restored = {key: self(item) for key, item in value.items()}
+        src = value.get("src")
+        if isinstance(src, str) and src.startswith(SRC_HASH_PREFIX):
+            restored["src"] = self._get_src(src, value)
+        return restored
+
+    def _get_src(self, src_hash: str, image: Dict[str, Any]) -> str:
+        if src_hash not in self._srcs:
+            src = None
+            if self.image_directory is not None:
+                src = load_src(self.image_directory, src_hash)
+            if src is None:
+                src = self._create_synthetic_src(image)
+            self._srcs[src_hash] = src
+
+        return self._srcs[src_hash]
+
+    def _create_synthetic_src(self, image: Dict[str, Any]) -> str:
+        self.synthetic_count += 1
+        width = max(int(image.get("width") or 1), 1)
+        height = max(int(image.get("height") or 1), 1)
+        synthetic = create_image(width, self._rng).resize((width, height))
+        return pil_image_to_data_url(synthetic)
+
+
+def create_toolkit(config: Optional[Dict[str, Any]]) -> Toolkit:
+    if config is None:
+        return Toolkit(StubSegmenter(), StubInpainter())
+
+    from chat2edit.tools.grounded_sam import GroundedSAM
+    from chat2edit.tools.lama_inpainter import LaMaInpainter
+
+    tools_config = config["tools"]
+    threads_config = tools_config.get("threads", {})
+    segmenter = GroundedSAM(
+        gdino_checkpoint=tools_config["groundingdino"]["checkpoint"],
+        gdino_config=tools_config["groundingdino"]["config"],
+        gdino_device=tools_config["groundingdino"]["device"],
+        sam_checkpoint=tools_config["sam"]["checkpoint"],
+        sam_model_type=tools_config["sam"]["model_type"],
+        sam_device=tools_config["sam"]["device"],
+        gdino_backend=tools_config["groundingdino"].get("backend", "eager"),
+        sam_backend=tools_config["sam"].get("backend", "eager"),
+        sam_onnx_path=tools_config["sam"].get("onnx_path"),
+        intra_op_threads=threads_config.get("intra_op"),
+        inter_op_threads=threads_config.get("inter_op"),
+        proxy_max_size=tools_config["sam"].get("proxy_max_size"),
+        embedding_cache_size=tools_config["sam"].get("embedding_cache_size", 4),
+    )
+    inpainter = LaMaInpainter(
+        checkpoint=tools_config["lama"]["checkpoint"],
+        device=tools_config["lama"]["device"],
+        backend=tools_config["lama"].get("backend", "eager"),
+    )
+    return Toolkit(segmenter, inpainter)
+
+
+def sum_stages(spans: List[Dict[str, Any]]) -> Dict[str, float]:
+    stages = {}
+    for span in spans:
+        stages[span["stage"]] = stages.get(span["stage"], 0.0) + span["duration_ms"]
+    return stages
+
+
+def replay_turn(
+    chat2edit: Chat2Edit,
+    chat_state: ChatState,
+    record: Dict[str, Any],
+    restore_srcs: SrcRestorer,
+    recorded_llm: Optional[RecordedLLM],
+) -> Dict[str, Any]:
+    canvases = [
+        FabricCanvas.model_validate(restore_srcs(canvas))
+        for canvas in record["canvases"]
+    ]
+    if recorded_llm is not None:
+        recorded_llm.start_turn(
+            [step["response"] for step in record["steps"] if "response" in step]
+        )
+    message = UserMessage(
+        chat_id=record["chat_id"], text=record["instruction"], attachments=canvases
+    )
+    with trace("replay", chat_id=record["chat_id"]) as curr_trace:
+        start = time.perf_counter()
+        sys_message = chat2edit(chat_state, message)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+    recorded_stages = sum_stages(record.get("spans", []))
+    recorded_ms = record.get("duration_ms", 0.0)
+    stages = sum_stages(curr_trace.spans)
+    if recorded_llm is not None:
+        # Replayed responses take no time, compare without the LLM calls.
+        recorded_ms -= recorded_stages.pop("llm", 0.0)
+        duration_ms -= stages.pop("llm", 0.0)
+
+    recorded_commands = [
+        command for step in record["steps"] for command in step.get("commands", [])
+    ]
+    return {
+        "chat_id": record["chat_id"],
+        "recorded_ms": recorded_ms,
+        "replay_ms": duration_ms,
+        "recorded_stages": recorded_stages,
+        "stages": stages,
+        "diverged": (
+            chat_state.curr_commands != recorded_commands
+            or sys_message.status != record.get("status")
+        ),
+        "status": sys_message.status,
+        "recorded_status": record.get("status"),
+    }
+
+
+def print_summary(turns: List[Dict[str, Any]]) -> None:
+    recorded_ms = sum(turn["recorded_ms"] for turn in turns)
+    replay_ms = sum(turn["replay_ms"] for turn in turns)
+    diverged = sum(turn["diverged"] for turn in turns)
+    print(
+        f"{len(turns)} turns, {diverged} diverged from the recording, "
+        f"recorded {recorded_ms:.0f} ms, replayed {replay_ms:.0f} ms, "
+        f"speedup {recorded_ms / max(replay_ms, 1e-9):.2f}x"
+    )
+
+    recorded_stages: Dict[str, float] = {}
+    stages: Dict[str, float] = {}
+    for turn in turns:
+        for stage, ms in turn["recorded_stages"].items():
+            recorded_stages[stage] = recorded_stages.get(stage, 0.0) + ms
+        for stage, ms in turn["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + ms
+
+    print(f"{'stage':<20}{'recorded ms':>14}{'replay ms':>12}{'speedup':>10}")
+    for stage in sorted(set(recorded_stages) | set(stages)):
+        old_ms, new_ms = recorded_stages.get(stage, 0.0), stages.get(stage, 0.0)
+        speedup = f"{old_ms / new_ms:.2f}x" if old_ms and new_ms else "-"
+        print(f"{stage:<20}{old_ms:>14.1f}{new_ms:>12.1f}{speedup:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("traces", nargs="+", help="turns-*.jsonl.gz files")
+    parser.add_argument("--images", help="Image store, default images/ beside them")
+    parser.add_argument("--llm", choices=["recorded", "real"], default="recorded")
+    parser.add_argument("--tools", choices=["stub", "real"], default="stub")
+    parser.add_argument("--config", help="App config for the real LLM and tools")
+    parser.add_argument("--chat", help="Only replay this chat id")
+    parser.add_argument("--output", help="Write the per turn results as JSON")
+    args = parser.parse_args()
+
+    config = None
+    if args.llm == "real" or args.tools == "real":
+        if args.config is None:
+            parser.error("--config is needed for the real LLM or tools")
+        with open(args.config, "r") as f:
+            config = yaml.safe_load(f)
+
+    image_directory = args.images
+    if image_directory is None:
+        image_directory = os.path.join(os.path.dirname(args.traces[0]), "images")
+    restore_srcs = SrcRestorer(image_directory)
+
+    chats: Dict[str, List[Dict[str, Any]]] = {}
+    for record in iter_trace_records(sorted(args.traces)):
+        if args.chat is None or record["chat_id"] == args.chat:
+            chats.setdefault(record["chat_id"], []).append(record)
+
+    toolkit = create_toolkit(config if args.tools == "real" else None)
+    openai_config = config["openai"] if args.llm == "real" else {}
+    chat2edit = Chat2Edit(
+        FabricMethodProvider(toolkit),
+        api_key=openai_config.get("api_key", "replay"),
+        model=openai_config.get("model", "replay"),
+        prompt_limit=3,
+        base_url=openai_config.get("base_url"),
+    )
+    recorded_llm = None
+    if args.llm == "recorded":
+        recorded_llm = RecordedLLM()
+        chat2edit._llm = recorded_llm
+
+    turns = []
+    for records in chats.values():
+        chat_state = ChatState()
+        for record in sorted(records, key=lambda record: record["time"]):
+            turns.append(
+                replay_turn(chat2edit, chat_state, record, restore_srcs, recorded_llm)
+            )
+
+    if not turns:
+        print("No turns to replay")
+        return
+
+    print_summary(turns)
+    if restore_srcs.synthetic_count:
+        print(f"{restore_srcs.synthetic_count} images were synthetic stand-ins")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(turns, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,711 @@
+"""
+Stage-level micro-benchmarks of the editing pipeline on synthetic images at several
+resolutions: the image and mask helpers, FabricMethodProvider operations, the
+Executor, server-side canvas rendering, Chat2Edit prompt building and full turns,
+chat state pickling, and the CPU side of GroundedSAM and LaMaInpainter. Models and
+the LLM are replaced by tiny stand-ins, so the numbers track our own code rather
+than model inference (use compare_backends for that). Run from the src directory:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --output current.json
+
+With --baseline, cases slower than the baseline median by more than --tolerance
+(and --min-delta-ms) are reported and the exit code is 1. A case that raises fails
+the run as well, with or without a baseline. Baselines only compare runs on the
+same machine, store one per deploy host.
+"""
+
+import argparse
+import json
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from chat2edit.chat2edit import Chat2Edit
+from chat2edit.core.chat_state import ChatState
+from chat2edit.core.exec_limits import ExecLimits
+from chat2edit.core.executor import Executor
+from chat2edit.core.message import UserMessage
+from chat2edit.fabric.fabric_history import CanvasHistory
+from chat2edit.fabric.fabric_method_provider import FabricMethodProvider
+from chat2edit.fabric.fabric_models import FabricCanvas
+from chat2edit.fabric.fabric_renderer import CanvasRenderer
+from chat2edit.tools.base import Inpainter, Segmenter
+from chat2edit.tools.toolkit import Toolkit
+from chat2edit.utils.image import (
+    ImageEncoding,
+    data_url_to_pil_image,
+    pil_image_to_data_url,
+)
+from chat2edit.utils.mask import Mask
+
+
+SIZES = (512, 1024, 2048)
+ASPECT_RATIO = 4 / 3
+OBJECTS_PER_DETECT = 3
+FILTER_OBJECTS = 20
+PROMPT_TURNS = (1, 10, 30)
+PICKLE_TURNS = 3
+COMMAND_TIMEOUT = 60.0
+SAM_PROXY_MAX_SIZE = 1024
+SAM_EMBEDDING_SIZE = 64
+THUMBNAIL_SIZE = 256
+LAMA_BATCH_SIZE = 4
+TOLERANCE = 0.25
+MIN_DELTA_MS = 0.5
+LLM_RESPONSES = (
+    "<thinking>Find the cat first.</thinking>\n"
+    "<action>\nobjects = detect(image0, 'cat')\n</action>",
+    "<thinking>Remove it and answer.</thinking>\n"
+    "<action>\nremove(objects[0], image0)\nresponse('Done', [image0])\n</action>",
+)
+EXEC_COMMANDS = [
+    "objects = detect(image0, 'cat')",
+    "move(image0, objects[0], (10, 10))",
+    "apply_filter(objects[1], 'grayscale')",
+    "response('Done', [image0])",
+]
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+    info: Dict[str, Any] = field(default_factory=dict)
+
+
+class StubSegmenter(Segmenter):
+    """Ellipses in fixed boxes, costs about as much as building the masks."""
+
+    def __call__(
+        self, image: Image.Image, label: str
+    ) -> Tuple[List[float], List[Mask]]:
+        scores = []
+        masks = []
+        for xmin, ymin, xmax, ymax in create_boxes(image.size, OBJECTS_PER_DETECT):
+            ellipse = np.zeros((ymax - ymin, xmax - xmin), np.uint8)
+            center = ((xmax - xmin) // 2, (ymax - ymin) // 2)
+            cv2.ellipse(ellipse, center, center, 0, 0, 360, 1, -1)
+            scores.append(0.5)
+            masks.append(Mask.from_array(ellipse, (xmin, ymin), image.size))
+
+        return scores, masks
+
+
+class StubInpainter(Inpainter):
+    """Fills the mask with the mean color."""
+
+    def __call__(self, image: Image.Image, mask: Mask) -> Image.Image:
+        array = np.array(image.convert("RGB"))
+        selected = mask.to_array() != 0
+        array[selected] = array.mean(axis=(0, 1)).astype(np.uint8)
+        return Image.fromarray(array)
+
+
+class StubLLM:
+    """Answers a turn with LLM_RESPONSES in order, reset before each turn."""
+
+    def __init__(self) -> None:
+        self.index = 0
+
+    def __call__(self, messages: List[str], *args: Any, **kwargs: Any) -> str:
+        response = LLM_RESPONSES[self.index % len(LLM_RESPONSES)]
+        self.index += 1
+        return response
+
+
+class TinySamPredictor:
+    """SamPredictor's interface with a thumbnail as the embedding."""
+
+    def __init__(self) -> None:
+        self.model = SimpleNamespace(mask_threshold=0.0)
+        self.reset_image()
+
+    def set_image(self, image: np.ndarray) -> None:
+        self.features = cv2.resize(
+            image,
+            (SAM_EMBEDDING_SIZE, SAM_EMBEDDING_SIZE),
+            interpolation=cv2.INTER_AREA,
+        )
+        self.original_size = image.shape[:2]
+        self.input_size = image.shape[:2]
+        self.is_image_set = True
+
+    def reset_image(self) -> None:
+        self.features = self.original_size = self.input_size = None
+        self.is_image_set = False
+
+    def predict(
+        self,
+        box: np.ndarray,
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Full frame logits like SAM's, positive inside the box ellipse.
+        height, width = self.original_size
+        xmin, ymin, xmax, ymax = box
+        ys, xs = np.ogrid[:height, :width]
+        center_x, center_y = (xmin + xmax) / 2, (ymin + ymax) / 2
+        radius_x, radius_y = max((xmax - xmin) / 2, 1), max((ymax - ymin) / 2, 1)
+        distance = ((xs - center_x) / radius_x) ** 2 + ((ys - center_y) / radius_y) ** 2
+        logits = (10 * (1 - distance)).astype(np.float32)[None]
+        masks = logits if return_logits else logits > self.model.mask_threshold
+        return masks, np.ones(1, np.float32), logits[:, ::4, ::4]
+
+
+def create_boxes(size: Tuple[int, int], count: int) -> List[Tuple[int, int, int, int]]:
+    width, height = size
+    return [
+        (
+            width * (2 * i + 1) // (3 * count),
+            height // 4,
+            width * (2 * i + 2) // (3 * count),
+            height * 3 // 4,
+        )
+        for i in range(count)
+    ]
+
+
+def create_image(size: int, rng: np.random.Generator) -> Image.Image:
+    # A gradient with noise compresses about like a photo, pure noise would not.
+    width, height = size, int(size / ASPECT_RATIO)
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([xs + 0 * ys, ys + 0 * xs, (xs + ys) / 2], axis=-1)
+    pixels += rng.normal(0, 8, pixels.shape).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    image.format = "PNG"
+    return image
+
+
+def create_canvas(src: str, size: Tuple[int, int]) -> FabricCanvas:
+    return FabricCanvas.model_validate(
+        {
+            "id": "canvas",
+            "objects": [],
+            "backgroundImage": {
+                "type": "image",
+                "width": size[0],
+                "height": size[1],
+                "src": src,
+                "filename": "image.png",
+            },
+        }
+    )
+
+
+def create_provider() -> FabricMethodProvider:
+    return FabricMethodProvider(Toolkit(StubSegmenter(), StubInpainter()))
+
+
+def create_chat2edit(provider: FabricMethodProvider) -> Chat2Edit:
+    chat2edit = Chat2Edit(provider, api_key="stub", model="stub", prompt_limit=3)
+    chat2edit._llm = StubLLM()
+    return chat2edit
+
+
+def image_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    cases = []
+    png = ImageEncoding(format="PNG", compress_level=1)
+    jpeg = ImageEncoding(format="JPEG", quality=90)
+    for size in sizes:
+        image = create_image(size, rng)
+        src = pil_image_to_data_url(image, png)
+        boxes = create_boxes(image.size, 1)
+        xmin, ymin, xmax, ymax = boxes[0]
+        array = np.zeros(image.size[::-1], np.uint8)
+        array[ymin:ymax, xmin:xmax] = 1
+        mask = Mask.from_array(array)
+        cases += [
+            Case(
+                f"image.encode_png/{size}",
+                lambda _, image=image: pil_image_to_data_url(image, png),
+                info={"bytes": len(src)},
+            ),
+            Case(
+                f"image.encode_jpeg/{size}",
+                lambda _, image=image: pil_image_to_data_url(image, jpeg),
+            ),
+            Case(
+                f"image.decode_png/{size}",
+                lambda _, src=src: data_url_to_pil_image(src),
+            ),
+            Case(
+                f"mask.from_array/{size}", lambda _, array=array: Mask.from_array(array)
+            ),
+            Case(f"mask.to_array/{size}", lambda _, mask=mask: mask.to_array()),
+            Case(f"mask.dilate/{size}", lambda _, mask=mask: mask.dilate(10)),
+        ]
+
+    return cases
+
+
+def fabric_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    cases = []
+    provider = create_provider()
+    for size in sizes:
+        image = create_image(size, rng)
+        src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+
+        def setup_canvas(src=src, image_size=image.size) -> FabricCanvas:
+            return create_canvas(src, image_size)
+
+        def setup_detected(src=src, image_size=image.size) -> Tuple[Any, ...]:
+            canvas = create_canvas(src, image_size)
+            objects = provider.detect(canvas, "cat")
+            provider.clear_signal()
+            return canvas, objects
+
+        def setup_removed(src=src, image_size=image.size) -> FabricCanvas:
+            canvas, objects = setup_detected(src, image_size)
+            provider.remove(objects[0], canvas)
+            return canvas
+
+        cases += [
+            Case(
+                f"fabric.detect/{size}",
+                lambda canvas: provider.detect(canvas, "cat"),
+                setup_canvas,
+            ),
+            # Served from the label index of the "cat" detection
+            Case(
+                f"fabric.detect_synonym/{size}",
+                lambda args: provider.detect(args[0], "con mèo"),
+                setup_detected,
+            ),
+            Case(
+                f"fabric.remove/{size}",
+                lambda args: provider.remove(args[1][0], args[0]),
+                setup_detected,
+            ),
+            Case(
+                f"fabric.move/{size}",
+                lambda args: provider.move(args[0], args[1][0], (10, 10)),
+                setup_detected,
+            ),
+            Case(
+                f"fabric.response/{size}",
+                lambda canvas: provider.response("Done", [canvas]),
+                setup_removed,
+            ),
+        ]
+
+    def setup_filter(src=src, image_size=image.size) -> FabricCanvas:
+        canvas = create_canvas(src, image_size)
+        for i in range(FILTER_OBJECTS // OBJECTS_PER_DETECT + 1):
+            provider.detect(canvas, f"object {chr(ord('a') + i)}")
+        provider.clear_signal()
+        return canvas
+
+    cases.append(
+        Case(
+            "fabric.apply_filter",
+            lambda canvas: provider.apply_filter(canvas, "grayscale"),
+            setup_filter,
+        )
+    )
+    return cases
+
+
+def executor_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    # "limited" runs every command under the default command timeout
+    executors = {
+        "": Executor(create_provider()),
+        "limited": Executor(create_provider(), ExecLimits(timeout=COMMAND_TIMEOUT)),
+    }
+    cases = []
+    for suffix, executor in executors.items():
+        suffix = f"_{suffix}" if suffix else ""
+        cases.append(
+            Case(
+                f"executor.exec_overhead{suffix}",
+                lambda _, executor=executor: executor(
+                    [f"x{i} = {i}" for i in range(20)], {}
+                ),
+            )
+        )
+        for size in sizes:
+            image = create_image(size, rng)
+            src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+            cases.append(
+                Case(
+                    f"executor.replay{suffix}/{size}",
+                    lambda context, executor=executor: executor.replay(
+                        EXEC_COMMANDS, context
+                    ),
+                    lambda src=src, image_size=image.size: {
+                        "image0": create_canvas(src, image_size)
+                    },
+                )
+            )
+
+    return cases
+
+
+def render_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    cases = []
+    provider = create_provider()
+    renderer = CanvasRenderer()
+    for size in sizes:
+        image = create_image(size, rng)
+        src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+
+        def setup_edited(src=src, image_size=image.size) -> FabricCanvas:
+            canvas = create_canvas(src, image_size)
+            objects = provider.detect(canvas, "cat")
+            provider.move(canvas, objects[0], (10, 10))
+            provider.rotate(canvas, objects[1], 30, "cw")
+            provider.apply_filter(objects[2], "grayscale")
+            provider.clear_signal()
+            return canvas
+
+        cases += [
+            Case(f"render.full/{size}", renderer.render, setup_edited),
+            Case(
+                f"render.thumbnail/{size}",
+                lambda canvas: renderer.render(canvas, THUMBNAIL_SIZE),
+                setup_edited,
+            ),
+            # The same canvas every run, a cache hit after the first render
+            Case(
+                f"render.cached/{size}",
+                lambda canvas: renderer.render_encoded(canvas, THUMBNAIL_SIZE),
+                lambda canvas=setup_edited(): canvas,
+            ),
+        ]
+
+    return cases
+
+
+def run_turns(
+    chat2edit: Chat2Edit, chat_state: ChatState, canvas: FabricCanvas, turns: int
+) -> ChatState:
+    for _ in range(turns):
+        chat2edit._llm.index = 0
+        message = UserMessage(chat_id="bench", text="Xoá con mèo", attachments=[canvas])
+        sys_message = chat2edit(chat_state, message)
+        canvas = sys_message.attachments[0] if sys_message.attachments else canvas
+
+    return chat_state
+
+
+def prompt_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    chat2edit = create_chat2edit(create_provider())
+    image = create_image(min(sizes), rng)
+    src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+    message = UserMessage(
+        chat_id="bench",
+        text="Xoá con mèo",
+        attachments=[create_canvas(src, image.size)],
+    )
+    cases = [
+        Case(
+            "prompt.extract_commands",
+            lambda _: chat2edit._extract_commands("\n".join(LLM_RESPONSES)),
+        )
+    ]
+    for turns in PROMPT_TURNS:
+        chat_state = run_turns(
+            chat2edit, ChatState(), create_canvas(src, image.size), turns
+        )
+
+        def setup_state(chat_state=chat_state) -> ChatState:
+            return ChatState(
+                context=dict(chat_state.context),
+                curr_prompt=chat_state.curr_prompt,
+            )
+
+        cases.append(
+            Case(
+                f"prompt.user_message/{turns}_turns",
+                lambda state: chat2edit._update_chat_state_from_user_message(
+                    state, message
+                ),
+                setup_state,
+                {"prompt_chars": len(chat_state.curr_prompt)},
+            )
+        )
+
+    for size in sizes:
+        image = create_image(size, rng)
+        src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+        cases.append(
+            Case(
+                f"chat2edit.turn/{size}",
+                lambda canvas: run_turns(chat2edit, ChatState(), canvas, 1),
+                lambda src=src, image_size=image.size: create_canvas(src, image_size),
+            )
+        )
+
+    return cases
+
+
+def chat_state_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    chat2edit = create_chat2edit(create_provider())
+    cases = []
+    for size in sizes:
+        image = create_image(size, rng)
+        src = pil_image_to_data_url(image, ImageEncoding(compress_level=1))
+        canvas = create_canvas(src, image.size)
+        chat_state = ChatState(history=CanvasHistory())
+        for _ in range(PICKLE_TURNS):
+            run_turns(chat2edit, chat_state, canvas, 1)
+            chat_state.history.record([canvas])
+        pickled = pickle.dumps(chat_state)
+        cases += [
+            Case(
+                f"chat_state.pickle/{size}",
+                lambda _, chat_state=chat_state: pickle.dumps(chat_state),
+                info={"bytes": len(pickled)},
+            ),
+            Case(
+                f"chat_state.unpickle/{size}",
+                lambda _, pickled=pickled: pickle.loads(pickled),
+            ),
+        ]
+
+    return cases
+
+
+def grounded_sam_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    from chat2edit.tools.grounded_sam import GroundedSAM
+
+    class StubGroundedSAM(GroundedSAM):
+        # Skips loading the models, the box predictions come from create_boxes.
+        def __init__(self, embedding_cache_size: int) -> None:
+            self.proxy_max_size = SAM_PROXY_MAX_SIZE
+            self.nms_iou_threshold = None
+            self.containment_threshold = None
+            self.embedding_cache_size = embedding_cache_size
+            self._embedding_cache = OrderedDict()
+            self._sam_lock = threading.Lock()
+            self.sam_predictor = TinySamPredictor()
+
+        def _predict_boxes(
+            self, image: Image.Image, label: str
+        ) -> Tuple[List[float], List[Tuple[int, int, int, int]]]:
+            boxes = create_boxes(image.size, OBJECTS_PER_DETECT)
+            return [0.5] * len(boxes), boxes
+
+    # Without the embedding cache every call hashes and sets the image again.
+    segmenter = StubGroundedSAM(embedding_cache_size=0)
+    cases = []
+    for size in sizes:
+        image = create_image(size, rng)
+        cases.append(
+            Case(
+                f"grounded_sam.segment/{size}",
+                lambda _, image=image: segmenter(image, "cat"),
+                info={"proxy": max(image.size) > SAM_PROXY_MAX_SIZE},
+            )
+        )
+
+    return cases
+
+
+def create_stub_lama() -> Inpainter:
+    """LaMaInpainter with iopaint's pre and post processing around one convolution."""
+    import torch
+
+    from chat2edit.tools.lama_inpainter import LaMaInpainter
+
+    class TinyInpaintModel(torch.nn.Module):
+        def __init__(self) -> None:
+            super().__init__()
+            self.conv = torch.nn.Conv2d(4, 3, 3, padding=1)
+
+        def forward(self, image: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+            return torch.sigmoid(self.conv(torch.cat([image, mask], dim=1)))
+
+    class StubLaMaInpainter(LaMaInpainter):
+        def __init__(self) -> None:
+            self.model = TinyInpaintModel().eval()
+            self.device = "cpu"
+            self.backend = "eager"
+
+    return StubLaMaInpainter()
+
+
+def lama_cases(sizes: List[int], rng: np.random.Generator) -> List[Case]:
+    inpainter = create_stub_lama()
+    cases = []
+    for size in sizes:
+        image = create_image(size, rng)
+        _, masks = StubSegmenter()(image, "cat")
+        images = [image] * LAMA_BATCH_SIZE
+        cases += [
+            Case(
+                f"lama.inpaint/{size}",
+                lambda _, image=image, mask=masks[0]: inpainter(image, mask),
+            ),
+            Case(
+                f"lama.batch/{size}",
+                lambda _, images=images, masks=masks: inpainter.batch(
+                    images, masks[:1] * LAMA_BATCH_SIZE
+                ),
+                info={"batch_size": LAMA_BATCH_SIZE},
+            ),
+        ]
+
+    return cases
+
+
+GROUPS: Dict[str, Callable[[List[int], np.random.Generator], List[Case]]] = {
+    "image": image_cases,
+    "fabric": fabric_cases,
+    "executor": executor_cases,
+    "render": render_cases,
+    "prompt": prompt_cases,
+    "chat_state": chat_state_cases,
+    "grounded_sam": grounded_sam_cases,
+    "lama": lama_cases,
+}
+
+
+def measure(case: Case, repeat: int, warmup: int) -> Dict[str, Any]:
+    times = []
+    for i in range(warmup + repeat):
+        arg = case.setup()
+        start = time.perf_counter()
+        case.run(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed * 1000)
+
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "min_ms": round(min(times), 4),
+        "max_ms": round(max(times), 4),
+        "repeat": repeat,
+        **case.info,
+    }
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    baseline: Dict[str, Any],
+    results: Dict[str, Any],
+    tolerance: float,
+    min_delta_ms: float,
+) -> List[str]:
+    regressions = []
+    print(f"\n{'case':<40}{'baseline':>11}{'current':>11}{'change':>9}")
+    for name, result in results["cases"].items():
+        baseline_result = baseline["cases"].get(name)
+        if "error" in result:
+            # A stage that no longer runs is a regression, not a missing number.
+            regressions.append(name)
+            print(f"{name:<40}{'ERROR':>31}")
+            continue
+        if baseline_result is None or "median_ms" not in baseline_result:
+            continue
+
+        old_ms, new_ms = baseline_result["median_ms"], result["median_ms"]
+        change = new_ms / old_ms - 1 if old_ms > 0 else 0.0
+        regressed = change > tolerance and new_ms - old_ms > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<40}{old_ms:>11.3f}{new_ms:>11.3f}{change:>+9.1%}"
+            f"{'  REGRESSED' if regressed else ''}"
+        )
+
+    missing = sorted(set(baseline["cases"]) - set(results["cases"]))
+    if missing:
+        print(f"Not measured in this run: {', '.join(missing)}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--groups", nargs="+", choices=list(GROUPS), default=None)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_MS)
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+        },
+        "cases": {},
+    }
+    rng = np.random.default_rng(args.seed)
+    for group in args.groups or list(GROUPS):
+        try:
+            cases = GROUPS[group](args.sizes, rng)
+        except ImportError as e:
+            # The model groups need the full environment (torch, iopaint, ...)
+            print(f"Skipping {group}: {e}")
+            continue
+
+        for case in cases:
+            try:
+                result = measure(case, args.repeat, args.warmup)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            results["cases"][case.name] = result
+            if "error" in result:
+                print(f"{case.name:<40}{result['error']}")
+            else:
+                print(f"{case.name:<40}{result['median_ms']:>11.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    errors = [name for name, result in results["cases"].items() if "error" in result]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+    if errors:
+        print(f"{len(errors)} failed: {', '.join(errors)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,29 @@
 import inspect
 import re
-from typing import Any, Dict, List
+import sys
+from typing import Any, Iterable, List, Optional, Set
 
 
 from chat2edit.core.chat_state import ChatState
+from chat2edit.core.context_gc import (
+    ContextCollector,
+    ContextGCPolicy,
+    ColdStorage,
+    find_referenced_names,
+    iter_container_items,
+)
+from chat2edit.core.exec_limits import ExecLimits
+from chat2edit.core.llm_cache import LLMCache, LLMCacheMode
 from chat2edit.core.message import ExecMessage, UserMessage
 from chat2edit.core.method_provider import MethodProvider
 from chat2edit.core.self_prompter import SelfPrompter
+from chat2edit.fabric.fabric_models import FabricCanvas, FabricCollection, FabricImage
 from chat2edit.fabric.fabric_prompt import VI_PROMPT_TEMPLATE
 
 
 ACTION_EXTRACT_PATTERN = re.compile(r"<action>(.*?)</action>", re.DOTALL)
 OBSERVATION_PATTERN = "<observation>\n    {observation}\n</observation>\n"
+USER_MESSAGE_OBSERVATION = "user_message("
 
 
 class Chat2Edit(SelfPrompter):
@@ -21,8 +33,32 @@ class Chat2Edit(SelfPrompter):
         api_key: str,
         model: str,
         prompt_limit: int,
+        llm_cache: Optional[LLMCache] = None,
+        llm_cache_mode: LLMCacheMode = "off",
+        context_gc_policy: Optional[ContextGCPolicy] = None,
+        context_cold_storage: Optional[ColdStorage] = None,
+        base_url: Optional[str] = None,
+        exec_limits: Optional[ExecLimits] = None,
     ) -> None:
-        super().__init__(method_provider, api_key, model, prompt_limit)
+        context_collector = None
+        if context_gc_policy:
+            context_collector = ContextCollector(
+                context_gc_policy,
+                context_cold_storage,
+                _iter_context_references,
+                _estimate_context_value_size,
+            )
+        super().__init__(
+            method_provider,
+            api_key,
+            model,
+            prompt_limit,
+            llm_cache,
+            llm_cache_mode,
+            context_collector,
+            base_url,
+            exec_limits,
+        )
         self._base_prompt = self._create_base_prompt(VI_PROMPT_TEMPLATE)
 
     def _create_base_prompt(self, prompt_template: str) -> List[str]:
@@ -41,6 +77,8 @@ class Chat2Edit(SelfPrompter):
             var_count = chat_state.variable_count.get(attachment.get_type(), 0)
             var_name = attachment.get_type() + str(var_count)
             message_context[var_name] = attachment
+            if not _is_same_attachment(chat_state.context.get(var_name), attachment):
+                self._method_provider.on_attachment(message.chat_id, attachment)
 
         if chat_state.curr_prompt == "":
             new_prompt = self._base_prompt
@@ -71,6 +109,26 @@ class Chat2Edit(SelfPrompter):
 
         return chat_state
 
+    def _get_context_roots(
+        self, chat_state: ChatState, message: UserMessage
+    ) -> Set[str]:
+        # The window starts at the user message of the oldest turn it covers.
+        prompt = chat_state.curr_prompt
+        window_start = len(prompt)
+        for _ in range(self._context_collector.policy.window_turns):
+            window_start = prompt.rfind(USER_MESSAGE_OBSERVATION, 0, window_start)
+            if window_start == -1:
+                window_start = 0
+                break
+
+        roots = find_referenced_names(prompt[window_start:], chat_state.context)
+        roots.update(
+            name
+            for name, value in chat_state.context.items()
+            if any(value is attachment for attachment in message.attachments)
+        )
+        return roots
+
     def _extract_commands(self, llm_response: str) -> List[str]:
         matches = re.findall(ACTION_EXTRACT_PATTERN, llm_response)
         commands = []
@@ -79,3 +137,24 @@ class Chat2Edit(SelfPrompter):
 
         commands = [command for command in commands if command != ""]
         return commands
+
+
+def _is_same_attachment(previous: Any, attachment: Any) -> bool:
+    # Every request validates new canvas models, compare the images they show.
+    if isinstance(previous, FabricCanvas) and isinstance(attachment, FabricCanvas):
+        return previous.backgroundImage.src == attachment.backgroundImage.src
+    return previous is attachment
+
+
+def _iter_context_references(value: Any) -> Iterable[Any]:
+    if isinstance(value, FabricCanvas):
+        yield value.backgroundImage
+    if isinstance(value, FabricCollection):
+        yield from value.objects
+    yield from iter_container_items(value)
+
+
+def _estimate_context_value_size(value: Any) -> int:
+    if isinstance(value, FabricImage):
+        return value.estimate_size()
+    return sys.getsizeof(value)
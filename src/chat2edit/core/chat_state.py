@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 
 @dataclass
@@ -8,3 +8,10 @@ class ChatState:
     variable_count: Dict[str, int] = field(default_factory=dict)
     curr_prompt: str = ""
     curr_response: str = ""
+    # Commands of the current turn that ran without an error
+    curr_commands: List[str] = field(default_factory=list)
+    # Variables spilled to cold storage by the context collector: name -> key
+    spilled: Dict[str, str] = field(default_factory=dict)
+    # Per-turn attachment versions kept by the app (e.g. a fabric CanvasHistory),
+    # pickled with the context so both share their image strings.
+    history: Any = None
@@ -0,0 +1,263 @@
+import pickle
+import re
+import sys
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Set
+
+
+ContextGCAction = Literal["evict", "spill"]
+ReferenceFinder = Callable[[Any], Iterable[Any]]
+SizeEstimator = Callable[[Any], int]
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Values whose copies are as good as the originals, sharing one is not sharing
+# an object.
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+class ColdStorage(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+
+class RedisColdStorage(ColdStorage):
+    def __init__(
+        self, client: Any, prefix: str = "context:", ttl: Optional[int] = None
+    ) -> None:
+        self._client = client
+        self._prefix = prefix
+        self._ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self._prefix + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self._client.set(self._prefix + key, value, ex=self._ttl)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self._prefix + key)
+
+
+@dataclass
+class ContextGCPolicy:
+    """
+    args:
+        window_turns: variables referenced in this many of the latest turns of the
+            prompt stay in the context
+        action: spill moves unreachable variables to cold storage and restores
+            them when a command references them again, evict drops them. Older
+            turns stay in the prompt, so after an evict a command reusing one of
+            their names fails with a NameError.
+    """
+
+    window_turns: int = 3
+    action: ContextGCAction = "spill"
+
+
+@dataclass
+class ContextGCStats:
+    collected: List[str] = field(default_factory=list)
+    spilled: List[str] = field(default_factory=list)
+    # Pickled size of the spilled values, estimated size of the evicted ones.
+    # Parts shared with live values (e.g. an image src) are counted too, so this
+    # is an upper bound.
+    reclaimed_bytes: int = 0
+
+
+def iter_container_items(value: Any) -> Iterable[Any]:
+    if isinstance(value, dict):
+        return value.values()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return value
+    return ()
+
+
+def find_referenced_names(text: str, names: Iterable[str]) -> Set[str]:
+    return set(IDENTIFIER_PATTERN.findall(text)).intersection(names)
+
+
+class ContextCollector:
+    """
+    Compacts a chat context after every turn. A variable is live when it is a root
+    (referenced by the recent prompt window or attached to the latest message) or
+    is reachable from one through `get_references`, e.g. an object inside a live
+    canvas. Everything else is evicted or spilled to cold storage.
+
+    A spilled value comes back as a copy, so values that reach a live object (a
+    list of objects on a live canvas) are never spilled, and values sharing
+    objects (a canvas and one of its objects) are spilled and restored together,
+    which keeps them pointing at each other.
+    """
+
+    def __init__(
+        self,
+        policy: ContextGCPolicy,
+        cold_storage: Optional[ColdStorage] = None,
+        get_references: ReferenceFinder = iter_container_items,
+        get_size: SizeEstimator = sys.getsizeof,
+    ) -> None:
+        if policy.action == "spill" and cold_storage is None:
+            raise ValueError("Spilling the context needs a cold storage")
+
+        self.policy = policy
+        self._cold_storage = cold_storage
+        self._get_references = get_references
+        self._get_size = get_size
+        self._lock = threading.Lock()
+        self._totals = {
+            "turns": 0,
+            "collected": 0,
+            "spilled": 0,
+            "restored": 0,
+            "reclaimed_bytes": 0,
+        }
+
+    def get_totals(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._totals)
+
+    def collect(
+        self,
+        chat_id: str,
+        context: Dict[str, Any],
+        spilled: Dict[str, str],
+        roots: Set[str],
+    ) -> ContextGCStats:
+        stats = ContextGCStats()
+        # A name assigned again since it was spilled shadows the cold copy.
+        for name in [name for name in spilled if name in context]:
+            key = spilled.pop(name)
+            if key not in spilled.values():
+                self._cold_storage.delete(key)
+
+        live_ids = self._find_reachable_ids(
+            context[name] for name in roots if name in context
+        )
+        unreachable = [
+            name
+            for name in context
+            if name not in roots
+            and not name.startswith("__")
+            and id(context[name]) not in live_ids
+        ]
+        if self.policy.action == "evict":
+            for name in unreachable:
+                stats.collected.append(name)
+                # Estimated, pickling only to count bytes would serialize (and
+                # encode pending images of) every evicted value.
+                stats.reclaimed_bytes += self._estimate_size(context.pop(name))
+            self._add_to_totals(stats)
+            return stats
+
+        for group in self._group_by_shared_objects(context, unreachable, live_ids):
+            values = {name: context[name] for name in group}
+            try:
+                payload = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+
+            key = f"{chat_id}:{group[0]}"
+            self._cold_storage.set(key, payload)
+            for name in group:
+                del context[name]
+                spilled[name] = key
+            stats.collected.extend(group)
+            stats.spilled.extend(group)
+            stats.reclaimed_bytes += len(payload)
+
+        self._add_to_totals(stats)
+        return stats
+
+    def restore(
+        self,
+        context: Dict[str, Any],
+        spilled: Dict[str, str],
+        names: Iterable[str],
+    ) -> List[str]:
+        """Restore the named variables along with those spilled together with them."""
+        restored = []
+        for name in names:
+            key = spilled.get(name)
+            if key is None:
+                continue
+
+            payload = self._cold_storage.get(key)
+            self._cold_storage.delete(key)
+            values = pickle.loads(payload) if payload is not None else {}
+            for group_name in [n for n, n_key in spilled.items() if n_key == key]:
+                del spilled[group_name]
+                if group_name in values:
+                    context[group_name] = values[group_name]
+                    restored.append(group_name)
+
+        with self._lock:
+            self._totals["restored"] += len(restored)
+        return restored
+
+    def _group_by_shared_objects(
+        self, context: Dict[str, Any], names: List[str], live_ids: Set[int]
+    ) -> List[List[str]]:
+        # Names whose values share an object end up in one group, values that
+        # reach a live object in none.
+        groups: List[List[str]] = []
+        group_ids: List[Set[int]] = []
+        for name in names:
+            value_ids = self._find_reachable_ids([context[name]])
+            if not value_ids.isdisjoint(live_ids):
+                continue
+
+            group, ids = [name], value_ids
+            for i in reversed(range(len(groups))):
+                if not ids.isdisjoint(group_ids[i]):
+                    group = groups.pop(i) + group
+                    ids |= group_ids.pop(i)
+            groups.append(group)
+            group_ids.append(ids)
+
+        return groups
+
+    def _find_reachable_ids(self, roots: Iterable[Any]) -> Set[int]:
+        reachable_ids = set()
+        stack = list(roots)
+        while stack:
+            value = stack.pop()
+            if isinstance(value, IMMUTABLE_TYPES) or id(value) in reachable_ids:
+                continue
+
+            reachable_ids.add(id(value))
+            stack.extend(self._get_references(value))
+
+        return reachable_ids
+
+    def _estimate_size(self, value: Any) -> int:
+        seen = set()
+        size = 0
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if id(value) in seen:
+                continue
+
+            seen.add(id(value))
+            size += self._get_size(value)
+            stack.extend(self._get_references(value))
+
+        return size
+
+    def _add_to_totals(self, stats: ContextGCStats) -> None:
+        with self._lock:
+            self._totals["turns"] += 1
+            self._totals["collected"] += len(stats.collected)
+            self._totals["spilled"] += len(stats.spilled)
+            self._totals["reclaimed_bytes"] += stats.reclaimed_bytes
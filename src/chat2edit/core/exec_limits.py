@@ -0,0 +1,236 @@
+import ctypes
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import wraps
+from typing import Callable, Iterator, Optional, Set
+
+
+STATM_PATH = "/proc/self/statm"
+# Seconds between two RSS reads of the watchdog
+MEMORY_CHECK_INTERVAL = 0.1
+
+
+class ExecLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class ExecLimits:
+    """
+    args:
+        timeout: seconds one command may run
+        max_memory_mb: how much the process RSS may grow while one command runs.
+            The RSS is the whole process, so concurrent requests or a model
+            loading meanwhile count against the command too, only use it when
+            one command runs at a time.
+        memory_check_interval: seconds between two RSS reads
+    """
+
+    timeout: Optional[float] = None
+    max_memory_mb: Optional[float] = None
+    memory_check_interval: float = MEMORY_CHECK_INTERVAL
+
+    def is_enabled(self) -> bool:
+        return self.timeout is not None or self.max_memory_mb is not None
+
+
+def get_rss_bytes() -> Optional[int]:
+    """Resident set size of this process, None where /proc is not available."""
+    try:
+        with open(STATM_PATH, "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _CommandGuard:
+    # The limits of one running command, shared by its thread and the watchdog.
+    # The lock orders the watchdog's stop against methods starting and
+    # finishing, so the exception is only ever sent while no guarded method runs.
+
+    def __init__(self, limits: ExecLimits) -> None:
+        self.limits = limits
+        self.thread_id = threading.get_ident()
+        self.lock = threading.Lock()
+        self.finished = False
+        self.method_depth = 0
+        self.reason: Optional[str] = None
+
+        now = time.monotonic()
+        self.deadline = None
+        if limits.timeout is not None:
+            self.deadline = now + limits.timeout
+        self.baseline_rss = self.max_growth = self.next_memory_check = None
+        if limits.max_memory_mb is not None:
+            self.baseline_rss = get_rss_bytes()
+            if self.baseline_rss is not None:
+                self.max_growth = limits.max_memory_mb * 1024 * 1024
+                self.next_memory_check = now + limits.memory_check_interval
+
+    def poll(self, now: float) -> Optional[float]:
+        """Stop the command if it overran, else return when to check it next."""
+        if self.finished:
+            return None
+
+        if self.deadline is not None and now >= self.deadline:
+            self.stop(
+                f"The command ran for more than {self.limits.timeout:g} seconds and "
+                "was stopped"
+            )
+            return None
+
+        if self.next_memory_check is not None and now >= self.next_memory_check:
+            rss = get_rss_bytes()
+            if rss is not None and rss - self.baseline_rss > self.max_growth:
+                self.stop(
+                    f"The command used more than {self.limits.max_memory_mb:g} MB of "
+                    "memory and was stopped"
+                )
+                return None
+            self.next_memory_check = now + self.limits.memory_check_interval
+
+        return min(
+            check_at
+            for check_at in (self.deadline, self.next_memory_check)
+            if check_at is not None
+        )
+
+    def stop(self, reason: str) -> None:
+        with self.lock:
+            if self.finished:
+                return
+
+            self.reason = reason
+            if self.method_depth == 0:
+                _set_async_exc(self.thread_id, ExecLimitExceeded)
+
+    def enter_method(self) -> None:
+        with self.lock:
+            if self.reason is not None:
+                # Stopped between the command's last bytecode and this call, the
+                # exception raised here replaces the one still pending.
+                _set_async_exc(self.thread_id, None)
+                raise ExecLimitExceeded(self.reason)
+            self.method_depth += 1
+
+    def exit_method(self) -> None:
+        with self.lock:
+            self.method_depth -= 1
+
+    def check(self) -> None:
+        if self.reason is not None:
+            raise ExecLimitExceeded(self.reason)
+
+    def finish(self) -> None:
+        with self.lock:
+            self.finished = True
+            # A stop that raced the end of the command must not hit later code.
+            _set_async_exc(self.thread_id, None)
+
+
+class _Watchdog:
+    # One thread checking the limits of every running command, so a command
+    # costs a lock and a notify rather than a thread.
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._guards: Set[_CommandGuard] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, guard: _CommandGuard) -> None:
+        with self._condition:
+            self._guards.add(guard)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="exec-limits", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def unwatch(self, guard: _CommandGuard) -> None:
+        with self._condition:
+            self._guards.discard(guard)
+
+    def _run(self) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wake_at = None
+                for guard in list(self._guards):
+                    check_at = guard.poll(now)
+                    if check_at is None:
+                        self._guards.discard(guard)
+                    elif wake_at is None or check_at < wake_at:
+                        wake_at = check_at
+                self._condition.wait(None if wake_at is None else wake_at - now)
+
+
+_local = threading.local()
+_watchdog = _Watchdog()
+
+
+def guard_method(method: Callable) -> Callable:
+    """
+    Wrap a method the commands call so that a command stopped while the method
+    runs is only stopped once it returns, never leaving a canvas half edited.
+    """
+
+    @wraps(method)
+    def guarded(*args, **kwargs):
+        guard: Optional[_CommandGuard] = getattr(_local, "guard", None)
+        if guard is None:
+            return method(*args, **kwargs)
+
+        guard.enter_method()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            guard.exit_method()
+        guard.check()
+        return result
+
+    return guarded
+
+
+@contextmanager
+def limit_command(limits: Optional[ExecLimits]) -> Iterator[None]:
+    """
+    Stop the command exec'd inside the block on this thread with ExecLimitExceeded
+    once it overruns the limits. A watchdog thread keeps the time and reads the
+    memory, the command itself runs untraced at full speed. The exception is raised in
+    this thread from the watchdog, so loops in the command code stop too, while
+    methods wrapped with guard_method (e.g. a model call) always finish and the
+    command stops right after. Code in C (a single huge allocation, sum over a
+    huge range) is not interrupted, and a command that swallows the exception
+    with a bare except keeps running.
+    """
+    if limits is None or not limits.is_enabled():
+        yield
+        return
+
+    guard = _CommandGuard(limits)
+    previous_guard = getattr(_local, "guard", None)
+    _local.guard = guard
+    try:
+        _watchdog.watch(guard)
+        yield
+    except ExecLimitExceeded:
+        if guard.reason is None:
+            raise
+        # Sent as a bare class by the watchdog, give it the reason
+        raise ExecLimitExceeded(guard.reason) from None
+    finally:
+        guard.finish()
+        _watchdog.unwatch(guard)
+        _local.guard = previous_guard
+
+
+def _set_async_exc(thread_id: int, exc_type: Optional[type]) -> None:
+    # Raised in the thread at its next bytecode boundary, None clears a pending one
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        ctypes.py_object(exc_type) if exc_type is not None else None,
+    )
@@ -1,27 +1,38 @@
 import inspect
 from typing import Any, Callable, Dict, Iterable, List, Optional
 
+from chat2edit.core.exec_limits import ExecLimits, guard_method, limit_command
 from chat2edit.core.exec_signal import ExecSignal
 from chat2edit.core.message import Attachment, ExecMessage, SysMessage
 from chat2edit.core.method_provider import MethodProvider
 
 
 class Executor:
-    def __init__(self, method_provider: MethodProvider) -> None:
+    def __init__(
+        self, method_provider: MethodProvider, limits: Optional[ExecLimits] = None
+    ) -> None:
         self._method_provider = method_provider
+        self._limits = limits
         self._exec_context = method_provider.get_bound_methods_dict()
+        # Commands call the guarded methods, a stopped command lets them finish.
+        self._guarded_context = {
+            name: guard_method(method) for name, method in self._exec_context.items()
+        }
 
     def get_methods(self) -> List[Callable]:
         return [obj for _, obj in self._exec_context.items() if inspect.ismethod(obj)]
 
     def __call__(self, commands: Iterable[str], context: Dict[str, Any]) -> ExecMessage:
-        curr_context = self._exec_context.copy()
+        curr_context = self._guarded_context.copy()
         curr_context.update(context)
         curr_signal = curr_command = None
+        executed_commands = []
         for command in commands:
             curr_command = command
             try:
-                exec(curr_command, locals(), curr_context)
+                with limit_command(self._limits):
+                    exec(curr_command, locals(), curr_context)
+                executed_commands.append(curr_command)
                 curr_signal = self._method_provider.get_signal()
                 if curr_signal.status != "info":
                     break
@@ -40,6 +51,21 @@ class Executor:
             command=curr_command,
             context=curr_context,
             sys_message=curr_signal.sys_message,
+            commands=executed_commands,
         )
         self._method_provider.clear_signal()
         return exec_message
+
+    def replay(self, commands: Iterable[str], context: Dict[str, Any]) -> ExecMessage:
+        """
+        Run commands recorded from an earlier run one at a time. Unlike a planning
+        step, warnings do not stop the run, only an error or a sys message does.
+        """
+        exec_message = None
+        for command in commands:
+            exec_message = self([command], context)
+            if exec_message.status == "error" or exec_message.sys_message:
+                break
+            context = exec_message.context
+
+        return exec_message
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Literal, Optional
+
+
+LLMCacheMode = Literal["off", "record", "replay"]
+
+
+class LLMCacheMiss(KeyError):
+    pass
+
+
+class LLMCache(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, response: str) -> None:
+        pass
+
+
+class FileLLMCache(LLMCache):
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+
+    def set(self, key: str, response: str) -> None:
+        path = self._get_path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"response": response}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+
+class RedisLLMCache(LLMCache):
+    def __init__(self, client: Any, prefix: str = "llm_cache:") -> None:
+        self._client = client
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        response = self._client.get(self._prefix + key)
+        if response is None:
+            return None
+
+        return response.decode("utf-8")
+
+    def set(self, key: str, response: str) -> None:
+        self._client.set(self._prefix + key, response.encode("utf-8"))
+
+
+def create_llm_cache_key(
+    model: str, messages: List[Dict[str, str]], stop_word: Optional[str] = None
+) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "stop": stop_word},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -30,3 +30,5 @@ class ExecMessage:
     command: str
     context: Dict[str, Any]
     sys_message: Optional[SysMessage] = None
+    # Commands that ran without an error, in order
+    commands: List[str] = field(default_factory=list)
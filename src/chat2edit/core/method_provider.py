@@ -4,7 +4,7 @@ import inspect
 from typing import Callable, Dict, Literal, Optional
 
 from chat2edit.core.exec_signal import ExecSignal
-from chat2edit.core.message import SysMessage
+from chat2edit.core.message import Attachment, SysMessage
 
 
 class MethodProvider(ABC):
@@ -15,6 +15,10 @@ class MethodProvider(ABC):
         method._provide = True
         return method
 
+    def on_attachment(self, chat_id: str, attachment: Attachment) -> None:
+        """Called when a message attaches a new value to the chat context."""
+        pass
+
     def get_signal(self) -> ExecSignal:
         return self._exec_signal
 
@@ -2,11 +2,31 @@ from typing import Optional, Sequence
 
 from openai import OpenAI
 
+from chat2edit.core.llm_cache import (
+    LLMCache,
+    LLMCacheMiss,
+    LLMCacheMode,
+    create_llm_cache_key,
+)
+from chat2edit.utils.metrics import increment, span
+
 
 class OpenAILLM:
-    def __init__(self, api_key: str, model: str) -> None:
-        self.client = OpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        cache: Optional[LLMCache] = None,
+        cache_mode: LLMCacheMode = "off",
+        base_url: Optional[str] = None,
+    ) -> None:
+        if cache_mode != "off" and cache is None:
+            raise ValueError(f"Cache mode '{cache_mode}' requires a cache")
+
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model = model
+        self.cache = cache
+        self.cache_mode = cache_mode
 
     def __call__(
         self,
@@ -24,7 +44,33 @@ class OpenAILLM:
             formated_messages.append({"role": "user", "content": user_message})
             formated_messages.append({"role": "assistant", "content": llm_message})
         formated_messages.append({"role": "user", "content": messages[-1]})
-        response = self.client.chat.completions.create(
-            model=self.model, messages=formated_messages, stop=stop_word
-        )
+
+        if self.cache_mode == "off":
+            return self._create_completion(formated_messages, stop_word)
+
+        cache_key = create_llm_cache_key(self.model, formated_messages, stop_word)
+        if self.cache_mode == "replay":
+            response = self.cache.get(cache_key)
+            if response is None:
+                raise LLMCacheMiss(f"No recorded response for key '{cache_key}'")
+            return response
+
+        response = self._create_completion(formated_messages, stop_word)
+        self.cache.set(cache_key, response)
+        return response
+
+    def _create_completion(
+        self, messages: Sequence[dict], stop_word: Optional[str]
+    ) -> str:
+        with span("llm", model=self.model) as attrs:
+            response = self.client.chat.completions.create(
+                model=self.model, messages=messages, stop=stop_word
+            )
+            if response.usage is not None:
+                attrs["prompt_tokens"] = response.usage.prompt_tokens
+                attrs["completion_tokens"] = response.usage.completion_tokens
+                increment("llm_tokens", response.usage.prompt_tokens, kind="prompt")
+                increment(
+                    "llm_tokens", response.usage.completion_tokens, kind="completion"
+                )
         return response.choices[0].message.content
@@ -1,15 +1,23 @@
+import logging
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional, Set
 
 from chat2edit.core.chat_state import ChatState
+from chat2edit.core.context_gc import ContextCollector, find_referenced_names
+from chat2edit.core.exec_limits import ExecLimits
 from chat2edit.core.executor import Executor
+from chat2edit.core.llm_cache import LLMCache, LLMCacheMode
 from chat2edit.core.message import ExecMessage, SysMessage, UserMessage
 from chat2edit.core.method_provider import MethodProvider
 from chat2edit.core.open_ai_llm import OpenAILLM
+from chat2edit.core.trace_log import record_step
+from chat2edit.utils.metrics import increment, span
 
 
 SYS_FAIL_MESSAGE = SysMessage(status="fail")
 
+logger = logging.getLogger(__name__)
+
 
 class SelfPrompter(ABC):
     def __init__(
@@ -18,10 +26,17 @@ class SelfPrompter(ABC):
         api_key: str,
         model: str,
         prompt_limit: int,
+        llm_cache: Optional[LLMCache] = None,
+        llm_cache_mode: LLMCacheMode = "off",
+        context_collector: Optional[ContextCollector] = None,
+        base_url: Optional[str] = None,
+        exec_limits: Optional[ExecLimits] = None,
     ) -> None:
-        self._executor = Executor(method_provider)
-        self._llm = OpenAILLM(api_key, model)
+        self._method_provider = method_provider
+        self._executor = Executor(method_provider, exec_limits)
+        self._llm = OpenAILLM(api_key, model, llm_cache, llm_cache_mode, base_url)
         self._prompt_limit = prompt_limit
+        self._context_collector = context_collector
 
     @abstractmethod
     def _extract_commands(self, text: str) -> List[str]:
@@ -39,40 +54,78 @@ class SelfPrompter(ABC):
     ) -> ChatState:
         pass
 
+    @abstractmethod
+    def _get_context_roots(
+        self, chat_state: ChatState, message: UserMessage
+    ) -> Set[str]:
+        pass
+
     def __call__(self, chat_state: ChatState, message: UserMessage) -> SysMessage:
-        chat_state = self._update_chat_state_from_user_message(chat_state, message)
+        sys_message = self._prompt(chat_state, message)
+        if self._context_collector:
+            with span("context_gc") as attrs:
+                stats = self._context_collector.collect(
+                    message.chat_id,
+                    chat_state.context,
+                    chat_state.spilled,
+                    self._get_context_roots(chat_state, message),
+                )
+                attrs["collected"] = len(stats.collected)
+                attrs["spilled"] = len(stats.spilled)
+                attrs["reclaimed_bytes"] = stats.reclaimed_bytes
+            increment("context_reclaimed_bytes", stats.reclaimed_bytes)
+
+        return sys_message
+
+    def _prompt(self, chat_state: ChatState, message: UserMessage) -> SysMessage:
+        with span("prompt_build"):
+            chat_state = self._update_chat_state_from_user_message(chat_state, message)
+        chat_state.curr_commands = []
         prompt_count = 0
         response = None
         while prompt_count < self._prompt_limit:
+            prompt = chat_state.curr_prompt
             try:
-                response = self._llm([chat_state.curr_prompt])
-                print(
-                    "-----------------------------------------------------------------------------------------------------------------"
-                )
-                print("### Prompt:")
-                print(chat_state.curr_prompt)
-                print()
-                print("### Response:")
-                print(response)
-                print(
-                    "-----------------------------------------------------------------------------------------------------------------"
-                )
-
+                response = self._llm([prompt])
+                logger.debug("Prompt:\n%s\nResponse:\n%s", prompt, response)
                 prompt_count += 1
             except Exception as e:
+                logger.exception("The LLM call failed")
+                record_step(prompt, error=f"{type(e).__name__}: {e}")
                 chat_state.curr_prompt = ""
                 return SYS_FAIL_MESSAGE
 
-            commands = self._extract_commands(response)
+            with span("command_parse"):
+                commands = self._extract_commands(response)
             if not commands:
+                record_step(prompt, response=response, commands=[])
                 chat_state.curr_prompt = ""
                 return SYS_FAIL_MESSAGE
 
-            exec_message = self._executor(commands, chat_state.context)
-            chat_state.curr_response = response
-            chat_state = self._update_chat_state_from_exec_message(
-                chat_state, exec_message
+            if self._context_collector and chat_state.spilled:
+                self._context_collector.restore(
+                    chat_state.context,
+                    chat_state.spilled,
+                    find_referenced_names("\n".join(commands), chat_state.spilled),
+                )
+
+            with span("command_exec", commands=len(commands)) as attrs:
+                exec_message = self._executor(commands, chat_state.context)
+                attrs["status"] = exec_message.status
+            chat_state.curr_commands.extend(exec_message.commands)
+            record_step(
+                prompt,
+                response=response,
+                commands=exec_message.commands,
+                command=exec_message.command,
+                status=exec_message.status,
+                text=exec_message.text,
             )
+            chat_state.curr_response = response
+            with span("prompt_build"):
+                chat_state = self._update_chat_state_from_exec_message(
+                    chat_state, exec_message
+                )
 
             if exec_message.sys_message:
                 return exec_message.sys_message
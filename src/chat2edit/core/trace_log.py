@@ -0,0 +1,202 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+SRC_HASH_PREFIX = "blake2b:"
+FLUSH_RECORDS = 50
+ROTATE_FORMAT = "%Y%m%d%H"
+
+
+def hash_src(src: str) -> str:
+    return SRC_HASH_PREFIX + hashlib.blake2b(src.encode(), digest_size=16).hexdigest()
+
+
+def replace_srcs(value: Any, on_src: Any) -> Any:
+    """Copy of dumped models with every non-empty `src` replaced by on_src(src)."""
+    if isinstance(value, dict):
+        return {
+            key: (
+                on_src(item)
+                if key == "src" and isinstance(item, str) and item
+                else replace_srcs(item, on_src)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [replace_srcs(item, on_src) for item in value]
+    return value
+
+
+class TraceLog:
+    """
+    Append-only log of chat turns as gzip compressed JSON lines, for reproducing
+    production issues and replaying real traffic (benchmarks/replay_traces.py).
+    Records are buffered and written `flush_records` at a time as one gzip member,
+    files rotate every hour and are per process. Image srcs are logged as content
+    hashes, with `store_images` the srcs themselves are kept once per hash under
+    `directory/images/` so turns can be replayed on the original images.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        store_images: bool = False,
+        flush_records: int = FLUSH_RECORDS,
+    ) -> None:
+        self.directory = directory
+        self.store_images = store_images
+        self.flush_records = flush_records
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        os.makedirs(self.get_image_directory(), exist_ok=True)
+        atexit.register(self.flush)
+
+    def get_image_directory(self) -> str:
+        return os.path.join(self.directory, "images")
+
+    def dump_canvases(self, canvases: Iterable[Any]) -> List[Dict[str, Any]]:
+        on_src = self._store_src if self.store_images else hash_src
+        return [replace_srcs(canvas.model_dump(), on_src) for canvas in canvases]
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.flush_records:
+                return
+            lines, self._buffer = self._buffer, []
+
+        self._write(lines)
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines: List[str]) -> None:
+        hour = datetime.now(timezone.utc).strftime(ROTATE_FORMAT)
+        path = os.path.join(self.directory, f"turns-{hour}-{os.getpid()}.jsonl.gz")
+        payload = gzip.compress("".join(lines).encode())
+        with self._lock, open(path, "ab") as f:
+            f.write(payload)
+
+    def _store_src(self, src: str) -> str:
+        src_hash = hash_src(src)
+        path = os.path.join(
+            self.get_image_directory(), src_hash[len(SRC_HASH_PREFIX) :]
+        )
+        if not os.path.exists(path):
+            # Written aside and renamed, concurrent turns may store the same image.
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temp_path, "w") as f:
+                f.write(src)
+            os.replace(temp_path, path)
+        return src_hash
+
+
+def load_src(image_directory: str, src_hash: str) -> Optional[str]:
+    path = os.path.join(image_directory, src_hash[len(SRC_HASH_PREFIX) :])
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        return f.read()
+
+
+def iter_trace_records(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class TurnRecord:
+    """Collects what one turn did, see record_turn."""
+
+    def __init__(self, chat_id: str, instruction: str, prompt: str) -> None:
+        self.chat_id = chat_id
+        self.instruction = instruction
+        self.steps: List[Dict[str, Any]] = []
+        self.data: Dict[str, Any] = {}
+        self._last_prompt = prompt
+        self._start = time.perf_counter()
+
+    def stop_timer(self) -> None:
+        """Set the turn duration, once, before recording what took no turn time."""
+        if "duration_ms" not in self.data:
+            elapsed = time.perf_counter() - self._start
+            self.data["duration_ms"] = round(elapsed * 1000, 3)
+
+    def add_step(self, prompt: str, **fields: Any) -> None:
+        self.steps.append({**self.get_prompt_delta(prompt), **fields})
+
+    def get_prompt_delta(self, prompt: str) -> Dict[str, Any]:
+        """
+        Each prompt extends the previous one (without its trailing "..."), starting
+        from the chat's prompt before the turn. Only the new part is kept, the
+        prompt is `previous[:prompt_base] + prompt`.
+        """
+        prefix = self._last_prompt[:-3]
+        base = len(prefix) if prompt.startswith(prefix) else 0
+        self._last_prompt = prompt
+        return {"prompt_base": base, "prompt": prompt[base:]}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "chat_id": self.chat_id,
+            "instruction": self.instruction,
+            **self.data,
+            "steps": self.steps,
+        }
+
+
+_current_record: ContextVar[Optional[TurnRecord]] = ContextVar(
+    "chat2edit_turn_record", default=None
+)
+
+
+@contextmanager
+def record_turn(
+    trace_log: Optional[TraceLog],
+    chat_id: str,
+    instruction: str,
+    canvases: List[Any],
+    prompt: str,
+) -> Iterator[Optional[TurnRecord]]:
+    """
+    Record the turn run inside the block into the trace log, the steps come from
+    record_step calls. Yields None and records nothing without a log.
+    """
+    if trace_log is None:
+        yield None
+        return
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    dumped_canvases = trace_log.dump_canvases(canvases)
+    record = TurnRecord(chat_id, instruction, prompt)
+    record.data["time"] = started_at
+    record.data["canvases"] = dumped_canvases
+    token = _current_record.set(record)
+    try:
+        yield record
+    finally:
+        record.stop_timer()
+        _current_record.reset(token)
+        trace_log.append(record.to_dict())
+
+
+def record_step(prompt: str, **fields: Any) -> None:
+    """Add an LLM step (prompt, response, commands, signal) to the current turn."""
+    record = _current_record.get()
+    if record is not None:
+        record.add_step(prompt, **fields)
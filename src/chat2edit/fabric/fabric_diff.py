@@ -0,0 +1,87 @@
+from typing import Any, Dict, List
+
+from chat2edit.fabric.fabric_models import FabricCanvas
+
+
+def snapshot_canvas(canvas: FabricCanvas) -> Dict[str, Any]:
+    # model_dump copies the containers but shares the (immutable) src strings,
+    # so a snapshot is cheap even for canvases holding large images.
+    return canvas.model_dump()
+
+
+def diff_canvas(old: Dict[str, Any], new: FabricCanvas) -> List[Dict[str, Any]]:
+    """
+    Compute JSON-patch-style operations that turn the `old` canvas snapshot into `new`.
+    Objects are addressed by id rather than list index ("/objects/<id>/left"), and a
+    "/objectOrder" replacement is emitted whenever the stacking order changes.
+    """
+    patches = []
+    new = snapshot_canvas(new)
+    diff_fields(
+        old["backgroundImage"], new["backgroundImage"], "/backgroundImage", patches
+    )
+    _diff_objects(old["objects"], new["objects"], "", patches)
+    return patches
+
+
+def _diff_objects(
+    old_objects: List[Dict[str, Any]],
+    new_objects: List[Dict[str, Any]],
+    path: str,
+    patches: List[Dict[str, Any]],
+) -> None:
+    old_id_to_object = {obj["id"]: obj for obj in old_objects}
+    new_id_to_object = {obj["id"]: obj for obj in new_objects}
+
+    for obj_id in old_id_to_object:
+        if obj_id not in new_id_to_object:
+            patches.append({"op": "remove", "path": f"{path}/objects/{obj_id}"})
+
+    for obj_id, new_obj in new_id_to_object.items():
+        obj_path = f"{path}/objects/{obj_id}"
+        old_obj = old_id_to_object.get(obj_id)
+        if old_obj is None:
+            patches.append({"op": "add", "path": obj_path, "value": new_obj})
+            continue
+
+        diff_fields(old_obj, new_obj, obj_path, patches)
+        if "objects" in new_obj:
+            _diff_objects(
+                old_obj.get("objects", []), new_obj["objects"], obj_path, patches
+            )
+
+    old_order = [obj["id"] for obj in old_objects]
+    new_order = [obj["id"] for obj in new_objects]
+    if [obj_id for obj_id in old_order if obj_id in new_id_to_object] != [
+        obj_id for obj_id in new_order if obj_id in old_id_to_object
+    ]:
+        patches.append(
+            {"op": "replace", "path": f"{path}/objectOrder", "value": new_order}
+        )
+
+
+def diff_fields(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    path: str,
+    patches: List[Dict[str, Any]],
+) -> None:
+    for key, new_value in new.items():
+        if key == "objects":
+            continue
+
+        if key not in old:
+            patches.append({"op": "add", "path": f"{path}/{key}", "value": new_value})
+            continue
+
+        old_value = old[key]
+        # Identity check first so unchanged image payloads are never compared
+        # character by character.
+        if old_value is not new_value and old_value != new_value:
+            patches.append(
+                {"op": "replace", "path": f"{path}/{key}", "value": new_value}
+            )
+
+    for key in old:
+        if key not in new:
+            patches.append({"op": "remove", "path": f"{path}/{key}"})
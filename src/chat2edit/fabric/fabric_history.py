@@ -0,0 +1,219 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from chat2edit.fabric.fabric_diff import diff_fields
+from chat2edit.fabric.fabric_models import (
+    FabricCanvas,
+    FabricCollection,
+    FabricImage,
+    FabricImageObject,
+    FabricObject,
+)
+from chat2edit.utils.image import is_same_src
+
+
+Version = Dict[str, FabricCanvas]
+
+
+class CanvasHistory:
+    """
+    Per-turn versions of the chat canvases. A version holds frozen copies that are
+    never mutated, and every object (and background image) that did not change
+    since the previous version is the very same copy. Image strings are shared as
+    well, so a turn costs about as much as what it changed, and pickling the
+    history along with the chat state stores each snapshot once.
+    """
+
+    def __init__(self, max_versions: Optional[int] = None) -> None:
+        self.max_versions = max_versions
+        self.versions: List[Version] = []
+        self.first_turn = 0
+
+    def get_turns(self) -> List[int]:
+        return list(range(self.first_turn, self.first_turn + len(self.versions)))
+
+    def record(self, canvases: Iterable[FabricCanvas]) -> int:
+        """Snapshot the canvases, canvases not given carry over from the last turn."""
+        prev_version = self.versions[-1] if self.versions else {}
+        version = dict(prev_version)
+        for canvas in canvases:
+            version[canvas.id] = _snapshot(canvas, prev_version.get(canvas.id))
+
+        self.versions.append(version)
+        if self.max_versions and len(self.versions) > self.max_versions:
+            del self.versions[0]
+            self.first_turn += 1
+
+        return self.first_turn + len(self.versions) - 1
+
+    def record_baseline(self, canvases: Iterable[FabricCanvas]) -> None:
+        """
+        Record the canvases as sent, before the first turn edits them in place, so
+        the chat's original canvases can be restored. No-op once a turn is recorded.
+        """
+        if not self.versions and self.first_turn == 0:
+            self.record(canvases)
+
+    def get_version(self, turn: int) -> Version:
+        index = turn - self.first_turn
+        if index < 0 or index >= len(self.versions):
+            raise KeyError(f"Turn {turn} is not in the history")
+
+        return self.versions[index]
+
+    def restore(self, turn: int) -> List[FabricCanvas]:
+        """Mutable copies of the canvases of a turn, safe to edit further."""
+        return [_copy(canvas) for canvas in self.get_version(turn).values()]
+
+    def diff(self, from_turn: int, to_turn: int) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Patches (as in fabric_diff) per canvas id from one turn to another. Shared
+        snapshots are skipped by identity, only changed objects are compared.
+        """
+        old_version = self.get_version(from_turn)
+        new_version = self.get_version(to_turn)
+        patches = {}
+        for canvas_id, new_canvas in new_version.items():
+            old_canvas = old_version.get(canvas_id)
+            if old_canvas is new_canvas:
+                continue
+
+            canvas_patches = []
+            if old_canvas is None:
+                canvas_patches.append(
+                    {"op": "add", "path": "", "value": new_canvas.model_dump()}
+                )
+            else:
+                if old_canvas.backgroundImage is not new_canvas.backgroundImage:
+                    diff_fields(
+                        old_canvas.backgroundImage.model_dump(),
+                        new_canvas.backgroundImage.model_dump(),
+                        "/backgroundImage",
+                        canvas_patches,
+                    )
+                _diff_objects(old_canvas, new_canvas, "", canvas_patches)
+            patches[canvas_id] = canvas_patches
+
+        for canvas_id in old_version:
+            if canvas_id not in new_version:
+                patches[canvas_id] = [{"op": "remove", "path": ""}]
+
+        return patches
+
+
+def _snapshot(obj: FabricObject, prev: Optional[FabricObject]) -> FabricObject:
+    if isinstance(obj, FabricImage) and not (
+        isinstance(obj, FabricImageObject) and obj.is_cut_out_pending()
+    ):
+        # Encode now so the snapshot and the live model share one src string
+        # instead of each encoding the same pending pixels when pickled.
+        obj.encode_pending_image()
+
+    fields = {}
+    if isinstance(obj, FabricCanvas):
+        prev_background = prev.backgroundImage if prev is not None else None
+        fields["backgroundImage"] = _snapshot(obj.backgroundImage, prev_background)
+
+    if isinstance(obj, FabricCollection):
+        prev_objects = {}
+        if isinstance(prev, FabricCollection):
+            prev_objects = {prev_obj.id: prev_obj for prev_obj in prev.objects}
+        fields["objects"] = [
+            _snapshot(child, prev_objects.get(child.id)) for child in obj.objects
+        ]
+
+    if prev is not None and _is_unchanged(prev, obj, fields):
+        return prev
+
+    return _copy(obj, fields)
+
+
+def _is_unchanged(
+    prev: FabricObject, obj: FabricObject, snapshot_fields: Dict[str, Any]
+) -> bool:
+    if type(prev) is not type(obj):
+        return False
+
+    for name, value in obj.__dict__.items():
+        if name in snapshot_fields:
+            prev_value = prev.__dict__[name]
+            new_value = snapshot_fields[name]
+            if isinstance(new_value, list):
+                unchanged = len(prev_value) == len(new_value) and all(
+                    prev_child is child
+                    for prev_child, child in zip(prev_value, new_value)
+                )
+            else:
+                unchanged = prev_value is new_value
+        elif name == "src":
+            # Request objects are fresh models with fresh (equal) src strings.
+            unchanged = is_same_src(prev.__dict__[name], value)
+        else:
+            prev_value = prev.__dict__.get(name)
+            unchanged = prev_value is value or prev_value == value
+        if not unchanged:
+            return False
+
+    return True
+
+
+def _copy(obj: FabricObject, fields: Optional[Dict[str, Any]] = None) -> FabricObject:
+    """Shallow copy that owns its mutable containers, strings stay shared."""
+    if fields is None:
+        fields = {}
+        if isinstance(obj, FabricCanvas):
+            fields["backgroundImage"] = _copy(obj.backgroundImage)
+        if isinstance(obj, FabricCollection):
+            fields["objects"] = [_copy(child) for child in obj.objects]
+
+    if isinstance(obj, FabricImage):
+        fields["filters"] = list(obj.filters)
+    if isinstance(obj, FabricImageObject):
+        fields["labelToScore"] = dict(obj.labelToScore)
+
+    copy = obj.model_copy(update=fields)
+    if isinstance(copy, FabricCollection):
+        # The index was copied along with the private attributes, rebuild it
+        # from the copied object list on first use.
+        copy._indexed_objects = None
+    return copy
+
+
+def _diff_objects(
+    old: FabricCollection,
+    new: FabricCollection,
+    path: str,
+    patches: List[Dict[str, Any]],
+) -> None:
+    old_id_to_object = {obj.id: obj for obj in old.objects}
+    new_id_to_object = {obj.id: obj for obj in new.objects}
+
+    for obj_id in old_id_to_object:
+        if obj_id not in new_id_to_object:
+            patches.append({"op": "remove", "path": f"{path}/objects/{obj_id}"})
+
+    for obj_id, new_obj in new_id_to_object.items():
+        obj_path = f"{path}/objects/{obj_id}"
+        old_obj = old_id_to_object.get(obj_id)
+        if old_obj is new_obj:
+            continue
+
+        if old_obj is None:
+            patches.append(
+                {"op": "add", "path": obj_path, "value": new_obj.model_dump()}
+            )
+            continue
+
+        old_fields = old_obj.model_dump(exclude={"objects"})
+        new_fields = new_obj.model_dump(exclude={"objects"})
+        diff_fields(old_fields, new_fields, obj_path, patches)
+        if isinstance(new_obj, FabricCollection):
+            _diff_objects(old_obj, new_obj, obj_path, patches)
+
+    old_order = [obj.id for obj in old.objects]
+    new_order = [obj.id for obj in new.objects]
+    if [obj_id for obj_id in old_order if obj_id in new_id_to_object] != [
+        obj_id for obj_id in new_order if obj_id in old_id_to_object
+    ]:
+        patches.append(
+            {"op": "replace", "path": f"{path}/objectOrder", "value": new_order}
+        )
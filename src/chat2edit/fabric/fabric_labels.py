@@ -0,0 +1,305 @@
+import re
+import unicodedata
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, List, Optional, Set
+
+
+LABEL_CACHE_SIZE = 4096
+# Articles, Vietnamese classifiers ("con mèo", "cái ghế") and plural markers, they
+# never tell two objects apart. Vietnamese words keep their diacritics, like the
+# keys of the tables below: without them many different words collide ("chó"
+# dog, "cho" for, "lợn" pig, "lớn" big).
+LABEL_STOPWORDS = {
+    "a",
+    "an",
+    "the",
+    "some",
+    "con",
+    "cái",
+    "chiếc",
+    "quả",
+    "trái",
+    "bức",
+    "tấm",
+    "những",
+    "các",
+    "mấy",
+}
+# Dropped before matching filter names, so "black and white" reads "black white"
+FILTER_STOPWORDS = {"and", "và"}
+# Case-folded word or two word phrase -> canonical English label
+LABEL_SYNONYMS = {
+    # Vietnamese
+    "mèo": "cat",
+    "chó": "dog",
+    "cún": "dog",
+    "gà": "chicken",
+    "vịt": "duck",
+    "chim": "bird",
+    "cá": "fish",
+    "ngựa": "horse",
+    "bò": "cow",
+    "heo": "pig",
+    "lợn": "pig",
+    "cừu": "sheep",
+    "dê": "goat",
+    "chuột": "mouse",
+    "thỏ": "rabbit",
+    "voi": "elephant",
+    "gấu": "bear",
+    "người": "person",
+    "đàn ông": "man",
+    "phụ nữ": "woman",
+    "con trai": "boy",
+    "con gái": "girl",
+    "cô gái": "girl",
+    "trẻ em": "child",
+    "đứa trẻ": "child",
+    "em bé": "baby",
+    "xe hơi": "car",
+    "ô tô": "car",
+    "ôtô": "car",
+    "xe máy": "motorbike",
+    "xe đạp": "bicycle",
+    "xe buýt": "bus",
+    "máy bay": "airplane",
+    "thuyền": "boat",
+    "cây": "tree",
+    "hoa": "flower",
+    "cỏ": "grass",
+    "nhà": "house",
+    "ghế": "chair",
+    "bàn": "table",
+    "giường": "bed",
+    "tivi": "tv",
+    "điện thoại": "phone",
+    "máy tính": "computer",
+    "sách": "book",
+    "cốc": "cup",
+    "ly": "cup",
+    "chai": "bottle",
+    "mũ": "hat",
+    "nón": "hat",
+    "kính": "glasses",
+    "áo": "shirt",
+    "túi": "bag",
+    "ô": "umbrella",
+    "bầu trời": "sky",
+    "trời": "sky",
+    "mặt trời": "sun",
+    "núi": "mountain",
+    "biển": "sea",
+    "sông": "river",
+    "cát": "sand",
+    "đường": "road",
+    "bánh": "cake",
+    "táo": "apple",
+    "đen": "black",
+    "trắng": "white",
+    "đỏ": "red",
+    "xanh": "blue",
+    "vàng": "yellow",
+    # English
+    "kitten": "cat",
+    "kitty": "cat",
+    "puppy": "dog",
+    "human": "person",
+    "people": "person",
+    "men": "man",
+    "women": "woman",
+    "children": "child",
+    "kid": "child",
+    "automobile": "car",
+    "plane": "airplane",
+    "aeroplane": "airplane",
+    "bike": "bicycle",
+    "motorcycle": "motorbike",
+    "television": "tv",
+    "cellphone": "phone",
+    "mobile phone": "phone",
+    "mug": "cup",
+    "sofa": "couch",
+    "grey": "gray",
+}
+# Case-folded filter name (one or two words) -> fabric.js filter type
+FILTER_NAMES = {
+    "grayscale": "grayscale",
+    "greyscale": "grayscale",
+    "gray": "grayscale",
+    "black white": "grayscale",
+    "đen trắng": "grayscale",
+    "xám": "grayscale",
+    "invert": "invert",
+    "negative": "invert",
+    "âm bản": "invert",
+    "đảo màu": "invert",
+    "brightness": "brightness",
+    "bright": "brightness",
+    "brighten": "brightness",
+    "sáng": "brightness",
+    "độ sáng": "brightness",
+    "blur": "blur",
+    "blurry": "blur",
+    "mờ": "blur",
+    "làm mờ": "blur",
+    "contrast": "contrast",
+    "tương phản": "contrast",
+    "noise": "noise",
+    "nhiễu": "noise",
+    "pixelate": "pixelate",
+    "pixel": "pixelate",
+    "pixelated": "pixelate",
+}
+# Word stems of inflected filter names ("blurred", "inverted", "brighter", "noisy",
+# "pixelation"), for words that are no filter name as written
+FILTER_STEMS = {
+    "gray": "grayscale",
+    "grey": "grayscale",
+    "invert": "invert",
+    "negativ": "invert",
+    "bright": "brightness",
+    "blur": "blur",
+    "contrast": "contrast",
+    "nois": "noise",
+    "pixel": "pixelate",
+}
+# Plurals the suffix rules of singularize get wrong
+IRREGULAR_PLURALS = {
+    "buses": "bus",
+    "knives": "knife",
+    "wives": "wife",
+    "leaves": "leaf",
+    "shelves": "shelf",
+    "wolves": "wolf",
+    "halves": "half",
+    "mice": "mouse",
+    "geese": "goose",
+    "teeth": "tooth",
+    "feet": "foot",
+    "tomatoes": "tomato",
+    "potatoes": "potato",
+}
+# Words ending in s that are already singular, their own plural, or only used
+# in plural (detectors return "glasses", not "glass")
+SINGULAR_WORDS = {
+    "series",
+    "species",
+    "news",
+    "lens",
+    "glasses",
+    "sunglasses",
+    "eyeglasses",
+    "scissors",
+    "pants",
+    "trousers",
+    "jeans",
+    "shorts",
+}
+# Singular nouns ending in s ("bus", "analysis", "canvas", "dress")
+SINGULAR_ENDINGS = ("ss", "us", "is", "as")
+# Labels longer than this are found by their subsets of at most this many words
+LABEL_SUBSET_MAX_WORDS = 3
+FILTER_TYPES = set(FILTER_NAMES.values())
+PHRASE_MAX_WORDS = 2
+POSSESSIVE_PATTERN = re.compile(r"['’]s\b")
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+
+def strip_diacritics(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d"))
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def singularize(word: str) -> str:
+    """Rough English singular, enough for object labels ("cats", "boxes")."""
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word in SINGULAR_WORDS:
+        return word
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(SINGULAR_ENDINGS):
+        return word[:-1]
+    return word
+
+
+def split_words(text: str) -> List[str]:
+    """Case-folded words in NFC, diacritics kept, without punctuation."""
+    text = POSSESSIVE_PATTERN.sub("", unicodedata.normalize("NFC", text.casefold()))
+    return NON_WORD_PATTERN.sub(" ", text).split()
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def normalize_label(label: str) -> str:
+    """
+    Index key of a label or detect prompt: case-folded words without punctuation,
+    stopwords dropped, plurals and synonyms (Vietnamese included) mapped to one
+    English label. "Con mèo", "cats" and "kitten" all give "cat". Words are
+    looked up with their diacritics, which are only stripped from the key. The
+    key's words are sorted, so word order does not matter: Vietnamese puts the
+    modifier last, "mèo đen" and "black cat" both give "black cat".
+    """
+    words = _replace_phrases(split_words(label), LABEL_SYNONYMS, LABEL_STOPWORDS)
+    kept_words = [word for word in words if word not in LABEL_STOPWORDS]
+    key_words = {strip_diacritics(word) for word in kept_words or words}
+    return " ".join(sorted(key_words))
+
+
+def get_label_subsets(key: str) -> List[str]:
+    """The keys a label is also found by: those of its fewer words."""
+    words = key.split()
+    max_words = min(len(words) - 1, LABEL_SUBSET_MAX_WORDS)
+    return [
+        " ".join(subset)
+        for length in range(1, max_words + 1)
+        for subset in combinations(words, length)
+    ]
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def get_filter_type(filter_name: str) -> Optional[str]:
+    """
+    fabric.js filter type named in an English or Vietnamese phrase ("blur filter",
+    "tăng độ sáng"), None if it names no filter or several.
+    """
+    words = [word for word in split_words(filter_name) if word not in FILTER_STOPWORDS]
+    words = _replace_phrases(words, FILTER_NAMES, set())
+    filter_types = {
+        word if word in FILTER_TYPES else _get_stem_filter_type(word) for word in words
+    }
+    filter_types.discard(None)
+    return filter_types.pop() if len(filter_types) == 1 else None
+
+
+def _get_stem_filter_type(word: str) -> Optional[str]:
+    for stem, filter_type in FILTER_STEMS.items():
+        if word.startswith(stem):
+            return filter_type
+    return None
+
+
+def _replace_phrases(
+    words: List[str], table: Dict[str, str], phrases: Set[str]
+) -> List[str]:
+    # Longest phrase first, left to right, so "xe máy" is a motorbike rather
+    # than "xe" and "máy". Phrases in `phrases` are kept as one word, single
+    # words are looked up as written and in singular.
+    replaced = []
+    i = 0
+    while i < len(words):
+        for length in range(min(PHRASE_MAX_WORDS, len(words) - i), 1, -1):
+            phrase = " ".join(words[i : i + length])
+            if phrase in table or phrase in phrases:
+                replaced.append(table.get(phrase, phrase))
+                i += length
+                break
+        else:
+            word = words[i]
+            if word not in table:
+                word = singularize(word)
+            replaced.append(table.get(word, word))
+            i += 1
+    return replaced
@@ -1,10 +1,14 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple, TypeVar, Union
 from PIL import Image as ImageModule
 import numpy as np
 
 from chat2edit.core.exec_signal import ExecSignal
-from chat2edit.core.message import SysMessage
+from chat2edit.core.message import Attachment, SysMessage
 from chat2edit.core.method_provider import MethodProvider
+from chat2edit.fabric.fabric_labels import get_filter_type
 from chat2edit.fabric.fabric_models import (
     FabricCanvas,
     FabricCollection,
@@ -14,24 +18,70 @@ from chat2edit.fabric.fabric_models import (
     FabricObject,
     FabricTextbox,
 )
+from chat2edit.tools.precompute import Precomputer
 from chat2edit.tools.toolkit import Toolkit
-from chat2edit.utils.image import data_url_to_pil_image, pil_image_to_data_url
+from chat2edit.utils.image import (
+    ImageEncoding,
+    data_url_to_pil_image,
+    decode_data_url_cached,
+    pil_image_to_data_url,
+)
+from chat2edit.utils.mask import Mask
+from chat2edit.utils.metrics import submit_in_context
 
 
 Image = TypeVar("Image", FabricCollection, None)
 Object = TypeVar("Object", FabricImageObject, None)
 Text = TypeVar("Text", FabricTextbox, None)
 
+DEFAULT_ENCODING_POLICY = {
+    "background": ImageEncoding(format="PNG", compress_level=1),
+    "object": ImageEncoding(format="PNG", compress_level=1),
+}
+ENCODING_WORKERS = 4
+
 
 class FabricMethodProvider(MethodProvider):
-    def __init__(self, toolkit: Toolkit) -> None:
+    def __init__(
+        self,
+        toolkit: Toolkit,
+        encoding_policy: Optional[Dict[str, ImageEncoding]] = None,
+        encoding_workers: int = ENCODING_WORKERS,
+        precomputer: Optional[Precomputer] = None,
+    ) -> None:
         super().__init__()
         self._toolkit = toolkit
+        self._precomputer = precomputer
+        self._encoding_policy = {**DEFAULT_ENCODING_POLICY, **(encoding_policy or {})}
+        if not self._encoding_policy["object"].supports_alpha():
+            raise ValueError("Object images need an encoding format with alpha")
+        self._encoding_executor = ThreadPoolExecutor(
+            max_workers=encoding_workers, thread_name_prefix="image-encoding"
+        )
+
+    def fork(self) -> "FabricMethodProvider":
+        """
+        Provider with its own signal sharing the toolkit and the encoding pool, for
+        running commands on another thread.
+        """
+        provider = copy.copy(self)
+        provider.clear_signal()
+        return provider
+
+    def on_attachment(self, chat_id: str, attachment: Attachment) -> None:
+        if self._precomputer is None or not isinstance(attachment, FabricCanvas):
+            return
+
+        # Decode from the src string on the worker, the model's own decoded image
+        # is not safe to load from two threads.
+        src = attachment.backgroundImage.get_src()
+        self._precomputer.submit(chat_id, partial(decode_data_url_cached, src))
 
     @MethodProvider.provide
     def response(self, text: str, images: Optional[List[Image]] = None) -> None:
         if images is None:
             images = []
+        self._encode_pending_images(images)
         self._set_signal(
             status="info",
             text="",
@@ -46,14 +96,14 @@ class FabricMethodProvider(MethodProvider):
         position: Tuple[int, int],
     ) -> None:
         if not isinstance(image, FabricCanvas):
-            self._signal(
+            self._set_signal(
                 status="error",
                 text="The 'image' argument in the 'move' method must be an instance of 'Image'",
             )
             return
 
         if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
-            self._signal(
+            self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'move' method must be an instance of 'Image', 'Object', or 'Text'",
             )
@@ -64,31 +114,32 @@ class FabricMethodProvider(MethodProvider):
             or len(position) != 2
             or not all(isinstance(coord, int) for coord in position)
         ):
-            self._signal(
+            self._set_signal(
                 status="error",
                 text="The 'position' argument in the 'insert' method must be a tuple with two integer elements.",
             )
             return
 
         if not image.contains(target):
-            self._signal(status="error", text="The target is not within the image.")
+            self._set_signal(status="error", text="The target is not within the image.")
             return
 
         if (
             position[0] > image.backgroundImage.width
             or position[1] > image.backgroundImage.width
         ):
-            self._signal(
+            self._set_signal(
                 status="warning",
                 text="The specified position exceeds the size of the image.",
             )
 
-        target.left = position[0]
-        target.top = position[1]
-
+        # Inpaint the region the object leaves before it moves away from it.
         if isinstance(target, FabricImageObject) and not target.inpainted:
             self._inpaint(image, target)
 
+        target.left = position[0]
+        target.top = position[1]
+
     @MethodProvider.provide
     def rotate(
         self,
@@ -98,21 +149,21 @@ class FabricMethodProvider(MethodProvider):
         direction: Literal["cw", "ccw"],
     ) -> None:
         if not isinstance(image, FabricCanvas):
-            self._signal(
+            self._set_signal(
                 status="error",
                 text="The 'image' argument in the 'rotate' method must be an instance of 'Image'",
             )
             return
 
-        if not isinstance(target, FabricImageObject, FabricGroup, FabricTextbox):
-            self._signal(
+        if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
+            self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'rotate' method must be an instance of 'Image', 'Object', or 'Text'",
             )
             return
 
-        if not isinstance(target, float, int):
-            self._signal(
+        if not isinstance(angle, (float, int)):
+            self._set_signal(
                 status="error",
                 text="The 'angle' argument in the 'rotate' method must be a number",
             )
@@ -148,7 +199,7 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        if not isinstance(target, FabricImageObject, FabricGroup, FabricTextbox):
+        if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
             self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'flip' method must be an instance of 'Image', 'Object', or 'Text'",
@@ -174,9 +225,6 @@ class FabricMethodProvider(MethodProvider):
         else:
             target.flipY = not target.flipY
 
-        if isinstance(target, FabricImageObject) and not target.inpainted:
-            self._inpaint(image, target)
-
     @MethodProvider.provide
     def scale(
         self,
@@ -192,7 +240,7 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        if not isinstance(target, FabricImageObject, FabricGroup, FabricTextbox):
+        if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
             self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'scale' method must be an instance of 'Image', 'Object', or 'Text'",
@@ -242,7 +290,7 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        if not isinstance(target, FabricImageObject, FabricGroup, FabricTextbox):
+        if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
             self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'insert' method must be an instance of 'Image', 'Object', or 'Text'",
@@ -284,7 +332,7 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        if not isinstance(target, FabricImageObject, FabricGroup, FabricTextbox):
+        if not isinstance(target, (FabricImageObject, FabricGroup, FabricTextbox)):
             self._set_signal(
                 status="error",
                 text="The 'target' argument in the 'remove' method must be an instance of 'Image', 'Object', or 'Text'",
@@ -316,26 +364,26 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        filt = None
-        if self._compare_filter_names(filter_name, ["grayscale"]):
+        filter_type = get_filter_type(filter_name)
+        if filter_type == "grayscale":
             filt = {"type": "grayscale"}
-        elif self._compare_filter_names(filter_name, ["invert", "negative"]):
+        elif filter_type == "invert":
             filt = {"type": "invert"}
-        elif self._compare_filter_names(filter_name, ["brightness"]):
+        elif filter_type == "brightness":
             filt = {"type": "brightness", "brightness": filter_value}
-        elif self._compare_filter_names(filter_name, ["blur"]):
+        elif filter_type == "blur":
             filt = {"type": "blur", "blur": filter_value}
-        elif self._compare_filter_names(filter_name, ["contrast"]):
+        elif filter_type == "contrast":
             filt = {"type": "contrast", "contrast": filter_value}
-        elif self._compare_filter_names(filter_name, ["noise"]):
+        elif filter_type == "noise":
             filt = {"type": "noise", "noise": filter_value}
-        elif self._compare_filter_names(filter_name, ["pixelate"]):
+        elif filter_type == "pixelate":
             filt = {"type": "pixelate", "blocksize": filter_value * 10}
-        # elif self._compare_filter_names(filter_name, ["temperature", "warmth"]):
+        # elif filter_type == "temperature":
         #     filt = Filter(name="temperature", value=filter_value)
-        # elif self._compare_filter_names(filter_name, ["saturation"]):
+        # elif filter_type == "saturation":
         #     filt = Filter(name="saturation", value=filter_value)
-        # elif self._compare_filter_names(filter_name, ["opacity", "transparent"]):
+        # elif filter_type == "opacity":
         #     filt = Filter(name="opacity", value=filter_value)
         else:
             self._set_signal(
@@ -365,37 +413,29 @@ class FabricMethodProvider(MethodProvider):
             )
             return
 
-        detected_objects = [
-            obj
-            for obj in image.objects
-            if self._compare_object_labels(prompt, list(obj.labelToScore.keys()))
-        ]
+        detected_objects = image.get_objects_by_label(prompt)
         if len(detected_objects) != 0:
             return detected_objects
 
-        parent_pil_image = image.backgroundImage.get_pil_image()
+        background_image = image.backgroundImage
+        parent_pil_image = background_image.get_pil_image()
+        # Edited pixels have no src yet, those cut-outs are built before pickling.
+        parent_src = (
+            None if background_image.has_pending_image() else background_image.src
+        )
         scores, masks = self._toolkit.segment(parent_pil_image, prompt)
         for score, mask in zip(scores, masks):
-            xmin, ymin, xmax, ymax = obj_box = ImageModule.fromarray(mask).getbbox()
-            obj_width, obj_height = obj_size = xmax - xmin, ymax - ymin
-            obj_pil_image = ImageModule.new("RGBA", obj_size)
-            obj_pil_image.format = "PNG"
-            obj_pil_image.paste(
-                parent_pil_image.crop(obj_box),
-                mask=ImageModule.fromarray(mask).crop(obj_box),
-            )
-            obj_data_url = pil_image_to_data_url(obj_pil_image)
-            obj = FabricImageObject(
-                parentId=image.id,
-                type="image",
-                left=xmin,
-                top=ymin,
-                width=obj_width,
-                height=obj_height,
-                labelToScore={prompt: score},
-                src=obj_data_url,
+            if mask.is_empty():
+                continue
+
+            obj = FabricImageObject.from_mask(
+                parent_pil_image,
+                parent_src,
+                mask,
+                {prompt: score},
+                encoding=self._encoding_policy["object"],
             )
-            image.objects.append(obj)
+            image.add(obj)
             detected_objects.append(obj)
 
         self._set_signal(
@@ -437,35 +477,53 @@ class FabricMethodProvider(MethodProvider):
         elif isinstance(parent, FabricGroup):
             base_image = parent.objects[0].get_pil_image()
 
-        width, height = base_image.size
-        obj_image = obj.get_pil_image()
-        obj_fit_mask = np.array(obj_image.convert("L"))
-        obj_mask = np.zeros((height, width), dtype=np.uint8)
-        xmin, ymin, xmax, ymax = obj.get_box()
-        obj_mask[ymin:ymax, xmin:xmax] = np.where(obj_fit_mask != 0, 255, 0)
+        obj_mask = obj.get_mask()
+        if obj_mask is None or obj_mask.size != base_image.size:
+            obj_image = obj.get_pil_image()
+            if "A" in obj_image.getbands():
+                obj_fit_mask = np.asarray(obj_image.getchannel("A"))
+            else:
+                obj_fit_mask = np.asarray(obj_image.convert("L"))
+            xmin, ymin, _, _ = obj.get_box()
+            obj_mask = Mask.from_array(
+                obj_fit_mask, offset=(int(xmin), int(ymin)), size=base_image.size
+            )
         inpainted_image = self._toolkit.inpaint(base_image, obj_mask)
 
+        # Encoding is deferred, so repeated edits of the same image within a turn
+        # only pay for encoding the final result.
+        background_encoding = self._encoding_policy["background"]
         if isinstance(parent, FabricCanvas):
-            parent.backgroundImage.src = pil_image_to_data_url(inpainted_image)
+            parent.backgroundImage.set_pil_image(inpainted_image, background_encoding)
         elif isinstance(parent, FabricGroup):
-            parent.objects[0].src = pil_image_to_data_url(inpainted_image)
-
-    def _compare_filter_names(
-        self, filter_name: str, check_filter_names: Iterable[str]
-    ) -> bool:
-        for check_name in check_filter_names:
-            name1 = filter_name.lower()
-            name2 = check_name.lower()
-            if name1 in name2 or name2 in name1:
-                return True
-
-        return False
-
-    def _compare_object_labels(self, label: str, check_labels: List[str]) -> bool:
-        for check_label in check_labels:
-            label1 = label.lower()
-            label2 = check_label.lower()
-            if label1 in label2 or label2 in label1:
-                return True
-
-        return False
+            parent.objects[0].set_pil_image(inpainted_image, background_encoding)
+        obj.inpainted = True
+
+    def _encode_pending_images(self, targets: Iterable[Any]) -> None:
+        pending_images = []
+        for target in targets:
+            images = []
+            if isinstance(target, FabricImage):
+                images.append(target)
+            if isinstance(target, FabricCollection):
+                images.extend(self._iter_images(target))
+            pending_images.extend(
+                image for image in images if image.has_pending_image()
+            )
+
+        futures = [
+            submit_in_context(self._encoding_executor, image.encode_pending_image)
+            for image in pending_images
+        ]
+        for future in futures:
+            future.result()
+
+    def _iter_images(self, collection: FabricCollection) -> Iterable[FabricImage]:
+        if isinstance(collection, FabricCanvas):
+            yield collection.backgroundImage
+
+        for obj in collection.objects:
+            if isinstance(obj, FabricImage):
+                yield obj
+            if isinstance(obj, FabricCollection):
+                yield from self._iter_images(obj)
@@ -1,10 +1,17 @@
-from typing import Dict, List, Tuple, Union, Optional
+from typing import Any, Dict, List, Tuple, Union, Optional
 from uuid import uuid4
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_serializer
 from PIL import Image
 
 from chat2edit.core.message import Attachment
-from chat2edit.utils.image import data_url_to_pil_image
+from chat2edit.fabric.fabric_labels import get_label_subsets, normalize_label
+from chat2edit.utils.image import (
+    ImageEncoding,
+    data_url_to_pil_image,
+    decode_data_url_cached,
+    pil_image_to_data_url,
+)
+from chat2edit.utils.mask import Mask
 
 
 def create_id() -> str:
@@ -33,17 +40,143 @@ class FabricObject(BaseModel):
         return hash(self.id)
 
 
+class FabricObjectList(list):
+    """
+    The objects of a collection, a list that counts its changes so the indexes of
+    the collection notice every mutation, also those made behind its back
+    (objects[i] = other, insert, sort, ...).
+    """
+
+    version = 0
+
+
+def _count_changes(name: str) -> Any:
+    method = getattr(list, name)
+
+    def changing_method(self: FabricObjectList, *args: Any, **kwargs: Any) -> Any:
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    changing_method.__name__ = name
+    return changing_method
+
+
+for _name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(FabricObjectList, _name, _count_changes(_name))
+
+
 class FabricCollection(BaseModel):
     objects: List[Union["FabricGroup", "FabricUploadedImage", "FabricImageObject"]]
 
+    # Indexes over `objects`, rebuilt lazily whenever the list was replaced or
+    # changed behind the collection's back. Objects are indexed by id with their
+    # position, labels by their normalized key (see fabric_labels) and by the
+    # subsets of that key's words.
+    _id_to_position: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _label_to_objects: Dict[str, Dict[str, FabricObject]] = PrivateAttr(
+        default_factory=dict
+    )
+    _subset_to_objects: Dict[str, Dict[str, FabricObject]] = PrivateAttr(
+        default_factory=dict
+    )
+    _indexed_objects: Optional[FabricObjectList] = PrivateAttr(default=None)
+    _indexed_version: int = PrivateAttr(default=0)
+
+    @field_validator("objects")
+    @classmethod
+    def _track_objects(cls, objects: List[FabricObject]) -> FabricObjectList:
+        return FabricObjectList(objects)
+
     def contains(self, obj: FabricObject) -> bool:
-        return obj in self.objects
+        return obj.id in self._get_id_to_position()
 
     def add(self, obj: FabricObject) -> None:
+        id_to_position = self._get_id_to_position()
         self.objects.append(obj)
+        id_to_position[obj.id] = len(self.objects) - 1
+        self._index_labels(obj)
+        self._indexed_version = self.objects.version
 
     def remove(self, obj: FabricObject) -> None:
-        self.objects.remove(obj)
+        id_to_position = self._get_id_to_position()
+        position = id_to_position.pop(obj.id, None)
+        if position is None:
+            raise ValueError(f"Object '{obj.id}' is not in the collection")
+
+        indexed_obj = self.objects[position]
+        for label in getattr(indexed_obj, "labelToScore", {}):
+            key = normalize_label(label)
+            self._label_to_objects.get(key, {}).pop(obj.id, None)
+            for subset in get_label_subsets(key):
+                self._subset_to_objects.get(subset, {}).pop(obj.id, None)
+        # The list shifts the objects stacked above down, only those are
+        # renumbered. Removing the topmost object renumbers none.
+        del self.objects[position]
+        for i in range(position, len(self.objects)):
+            id_to_position[self.objects[i].id] = i
+        self._indexed_version = self.objects.version
+
+    def get_object(self, obj_id: str) -> Optional[FabricObject]:
+        position = self._get_id_to_position().get(obj_id)
+        return None if position is None else self.objects[position]
+
+    def get_objects_by_label(self, label: str) -> List[FabricObject]:
+        """
+        Objects detected with the same label once normalized ("con mèo" finds
+        "cat" detections), else those whose label has all its words ("mèo" finds
+        "mèo đen" and "black cat").
+        """
+        self._get_id_to_position()
+        key = normalize_label(label)
+        label_objects = self._label_to_objects.get(key)
+        if not label_objects:
+            label_objects = self._subset_to_objects.get(key, {})
+        return list(label_objects.values())
+
+    def _get_id_to_position(self) -> Dict[str, int]:
+        if not isinstance(self.objects, FabricObjectList):
+            # Assigned, or constructed without validation
+            self.objects = FabricObjectList(self.objects)
+        if (
+            self._indexed_objects is not self.objects
+            or self._indexed_version != self.objects.version
+        ):
+            self._rebuild_index()
+        return self._id_to_position
+
+    def _rebuild_index(self) -> None:
+        self._id_to_position = {obj.id: i for i, obj in enumerate(self.objects)}
+        self._label_to_objects = {}
+        self._subset_to_objects = {}
+        for obj in self.objects:
+            self._index_labels(obj)
+        self._indexed_objects = self.objects
+        self._indexed_version = self.objects.version
+
+    def _index_labels(self, obj: FabricObject) -> None:
+        for label in getattr(obj, "labelToScore", {}):
+            key = normalize_label(label)
+            self._label_to_objects.setdefault(key, {})[obj.id] = obj
+            for subset in get_label_subsets(key):
+                self._subset_to_objects.setdefault(subset, {})[obj.id] = obj
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        super().__setstate__(state)
+        # Indexes pickled by an older version may use other label keys.
+        self._indexed_objects = None
 
 
 class FabricImage(FabricObject):
@@ -52,8 +185,78 @@ class FabricImage(FabricObject):
     filters: List[Dict] = Field(default_factory=list)
     src: str
 
+    # Edited pixels whose encoding into `src` is deferred until the image is
+    # serialized or pickled, so intermediate results are never encoded.
+    _pending_image: Optional[Image.Image] = PrivateAttr(default=None)
+    _pending_encoding: Optional[ImageEncoding] = PrivateAttr(default=None)
+    # Decoded `src`, reused for as long as `src` is the same string object.
+    _decoded_src: Optional[str] = PrivateAttr(default=None)
+    _decoded_image: Optional[Image.Image] = PrivateAttr(default=None)
+
     def get_pil_image(self) -> Image.Image:
-        return data_url_to_pil_image(self.src)
+        if self._pending_image is not None:
+            return self._pending_image
+
+        if self._decoded_src is not self.src:
+            self._decoded_image = data_url_to_pil_image(self.src)
+            self._decoded_src = self.src
+
+        return self._decoded_image
+
+    def get_src(self) -> str:
+        self.encode_pending_image()
+        return self.src
+
+    def set_pil_image(
+        self, image: Image.Image, encoding: Optional[ImageEncoding] = None
+    ) -> None:
+        self._pending_image = image
+        self._pending_encoding = encoding
+
+    def has_pending_image(self) -> bool:
+        return self._pending_image is not None
+
+    def estimate_size(self) -> int:
+        """Bytes the image takes, without encoding the pending pixels."""
+        size = len(self.src)
+        if self._pending_image is not None:
+            image = self._pending_image
+            size += image.width * image.height * len(image.getbands())
+        return size
+
+    def encode_pending_image(self) -> None:
+        if self._pending_image is None:
+            return
+
+        encoding = self._pending_encoding
+        self.src = pil_image_to_data_url(self._pending_image, encoding)
+        if encoding is not None and encoding.is_lossless():
+            # Decoding the new src would give back exactly these pixels.
+            self._decoded_src = self.src
+            self._decoded_image = self._pending_image
+        self._pending_image = None
+        self._pending_encoding = None
+
+    # No return annotation, pydantic would take it as the serialization schema
+    # and the OpenAPI responses would lose every field.
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler: Any):
+        self.encode_pending_image()
+        return handler(self)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        self.encode_pending_image()
+        return self._get_pickle_state()
+
+    def _get_pickle_state(self) -> Dict[str, Any]:
+        # Decoded pixels are rebuilt from src on demand, never pickle them.
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {
+            **state["__pydantic_private__"],
+            "_decoded_src": None,
+            "_decoded_image": None,
+        }
+        return state
 
 
 class FabricUploadedImage(FabricImage):
@@ -64,9 +267,112 @@ class FabricImageObject(FabricImage):
     labelToScore: Dict[str, float]
     inpainted: bool = False
 
+    # A detected object only references the pixels it was cut out of, the RGBA
+    # cut-out is built when the object is read, serialized or has to be pickled.
+    _source_image: Optional[Image.Image] = PrivateAttr(default=None)
+    _source_src: Optional[str] = PrivateAttr(default=None)
+    _source_encoding: Optional[ImageEncoding] = PrivateAttr(default=None)
+    # Mask in the frame of the parent image, kept after the cut-out is built.
+    _mask: Optional[Mask] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_mask(
+        cls,
+        source_image: Image.Image,
+        source_src: Optional[str],
+        mask: Mask,
+        label_to_score: Dict[str, float],
+        encoding: Optional[ImageEncoding] = None,
+    ) -> "FabricImageObject":
+        """
+        args:
+            source_image: decoded pixels of the parent image
+            source_src: data URL of exactly those pixels, None if it is not encoded
+            mask: object mask in the frame of the parent image
+        """
+        xmin, ymin, xmax, ymax = mask.get_box()
+        obj = cls(
+            type="image",
+            left=xmin,
+            top=ymin,
+            width=xmax - xmin,
+            height=ymax - ymin,
+            labelToScore=label_to_score,
+            src="",
+        )
+        obj._source_image = source_image
+        obj._source_src = source_src
+        obj._source_encoding = encoding
+        obj._mask = mask
+        return obj
+
     def get_box(self) -> Tuple[int, int, int, int]:
         return self.left, self.top, self.left + self.width, self.top + self.height
 
+    def get_mask(self) -> Optional[Mask]:
+        """The detection mask, as long as the object was not moved away from it."""
+        if self._mask is None or (self.left, self.top) != self._mask.get_box()[:2]:
+            return None
+
+        return self._mask
+
+    def is_cut_out_pending(self) -> bool:
+        return self._source_image is not None or self._source_src is not None
+
+    def get_pil_image(self) -> Image.Image:
+        self._build_cut_out()
+        return super().get_pil_image()
+
+    def set_pil_image(
+        self, image: Image.Image, encoding: Optional[ImageEncoding] = None
+    ) -> None:
+        self._clear_source()
+        super().set_pil_image(image, encoding)
+
+    def has_pending_image(self) -> bool:
+        return self.is_cut_out_pending() or super().has_pending_image()
+
+    def estimate_size(self) -> int:
+        if self.is_cut_out_pending():
+            # The RGBA cut-out it would become, the source pixels are shared
+            return int(self.width * self.height) * 4
+        return super().estimate_size()
+
+    def encode_pending_image(self) -> None:
+        self._build_cut_out()
+        super().encode_pending_image()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        if self._source_src is None:
+            return super().__getstate__()
+
+        # The source src is usually the parent's src as well, so pickle shares it
+        # and the object costs no more than its packed mask.
+        state = self._get_pickle_state()
+        state["__pydantic_private__"]["_source_image"] = None
+        return state
+
+    def _build_cut_out(self) -> None:
+        if not self.is_cut_out_pending():
+            return
+
+        source_image = self._source_image
+        if source_image is None:
+            source_image = decode_data_url_cached(self._source_src)
+
+        cut_out = Image.new("RGBA", self._mask.get_box_size())
+        cut_out.paste(
+            source_image.crop(self._mask.get_box()), mask=self._mask.to_pil_image()
+        )
+        self._pending_image = cut_out
+        self._pending_encoding = self._source_encoding
+        self._clear_source()
+
+    def _clear_source(self) -> None:
+        self._source_image = None
+        self._source_src = None
+        self._source_encoding = None
+
 
 class FabricTextbox(FabricObject):
     fontFamily: str
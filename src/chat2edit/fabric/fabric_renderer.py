@@ -0,0 +1,327 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from chat2edit.core.trace_log import hash_src, replace_srcs
+from chat2edit.fabric.fabric_models import (
+    FabricCanvas,
+    FabricCollection,
+    FabricGroup,
+    FabricImage,
+    FabricObject,
+)
+from chat2edit.utils.image import ImageEncoding
+from chat2edit.utils.metrics import span
+
+
+RENDER_CACHE_SIZE = 64
+# Gaussian sigma per unit of the fabric.js blur value, relative to the larger
+# image side, close to how the browser blurs.
+BLUR_SIGMA_SCALE = 0.02
+MAX_CONTRAST = 254.0
+NOISE_SEED = 0
+# Alpha that still rounds to 255
+OPAQUE_ALPHA = 1.0 - 0.5 / 255.0
+
+
+def get_object_matrix(obj: FabricObject) -> np.ndarray:
+    """
+    3x3 matrix from the object's pixels to its parent's coordinates, like fabric.js
+    with the default left/top origin: flip inside the object's box, scale, rotate
+    clockwise around the origin and move the origin to left/top.
+    """
+    flip = np.eye(3)
+    if obj.flipX:
+        flip[0] = [-1.0, 0.0, obj.width]
+    if obj.flipY:
+        flip[1] = [0.0, -1.0, obj.height]
+
+    radians = math.radians(obj.angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    transform = np.array(
+        [
+            [cos * obj.scaleX, -sin * obj.scaleY, obj.left],
+            [sin * obj.scaleX, cos * obj.scaleY, obj.top],
+            [0.0, 0.0, 1.0],
+        ]
+    )
+    return transform @ flip
+
+
+def get_canvas_size(canvas: FabricCanvas) -> Tuple[int, int]:
+    background = canvas.backgroundImage
+    width = round(background.width * abs(background.scaleX))
+    height = round(background.height * abs(background.scaleY))
+    return max(width, 1), max(height, 1)
+
+
+def get_canvas_key(canvas: FabricCanvas) -> str:
+    """Content hash of everything that affects how the canvas renders."""
+    state = replace_srcs(canvas.model_dump(), hash_src)
+    state_json = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.blake2b(state_json.encode(), digest_size=16).hexdigest()
+
+
+def apply_filters(
+    pixels: np.ndarray,
+    filters: List[Dict[str, Any]],
+    scale: float,
+    rng: np.random.Generator,
+) -> None:
+    """
+    Apply fabric.js filter dicts in place to straight RGBA float pixels (0-255).
+    scale is how much the pixels were downscaled, for the filters with sizes in
+    pixels. Unknown filter types are ignored, like the browser does.
+    """
+    rgb = pixels[..., :3]
+    height, width = pixels.shape[:2]
+    for filt in filters:
+        filter_type = filt.get("type")
+        if filter_type == "grayscale":
+            rgb[...] = rgb.mean(axis=-1, keepdims=True)
+        elif filter_type == "invert":
+            np.subtract(255.0, rgb, out=rgb)
+        elif filter_type == "brightness":
+            rgb += float(filt.get("brightness", 0.0)) * 255.0
+        elif filter_type == "contrast":
+            contrast = float(filt.get("contrast", 0.0)) * 255.0
+            contrast = min(max(contrast, -MAX_CONTRAST), MAX_CONTRAST)
+            factor = 259.0 * (contrast + 255.0) / (255.0 * (259.0 - contrast))
+            rgb -= 128.0
+            rgb *= factor
+            rgb += 128.0
+        elif filter_type == "blur":
+            sigma = float(filt.get("blur", 0.0)) * BLUR_SIGMA_SCALE
+            sigma *= max(height, width)
+            if sigma > 0:
+                _blur(pixels, sigma)
+        elif filter_type == "noise":
+            noise = float(filt.get("noise", 0.0))
+            rgb += (rng.random((height, width, 1), dtype=np.float32) - 0.5) * noise
+        elif filter_type == "pixelate":
+            block = max(round(float(filt.get("blocksize", 1.0)) * scale), 1)
+            if block > 1:
+                # Every block takes the color of its top left pixel.
+                blocks = pixels[::block, ::block]
+                pixels[...] = np.repeat(np.repeat(blocks, block, 0), block, 1)[
+                    :height, :width
+                ]
+        np.clip(rgb, 0.0, 255.0, out=rgb)
+
+
+def _blur(pixels: np.ndarray, sigma: float) -> None:
+    # Blurred premultiplied, so transparent pixels do not darken the edges.
+    alpha = pixels[..., 3:] / 255.0
+    pixels[..., :3] *= alpha
+    pixels[...] = cv2.GaussianBlur(pixels, (0, 0), sigma)
+    alpha = pixels[..., 3:] / 255.0
+    np.divide(pixels[..., :3], alpha, out=pixels[..., :3], where=alpha > 0)
+
+
+class CanvasRenderer:
+    """
+    Flattens a canvas into one image on the server: the background image and the
+    image objects (groups included) with their position, scale, rotation, flip,
+    opacity and filters, composited back to front. Textboxes are not drawn, they
+    need the fonts of the client. With max_size the canvas renders directly at
+    thumbnail size, every object is downscaled once before its filters and its
+    transform, never rendered in full first. Encoded renders are cached by the
+    content of the canvas, so previews of unchanged canvases cost a hash.
+    """
+
+    def __init__(self, cache_size: int = RENDER_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(
+        self, canvas: FabricCanvas, max_size: Optional[int] = None
+    ) -> Image.Image:
+        width, height = get_canvas_size(canvas)
+        scale = 1.0
+        if max_size is not None and max(width, height) > max_size:
+            scale = max_size / max(width, height)
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+
+        with span("render", width=size[0], height=size[1]):
+            # Premultiplied RGBA in 0-1, transparent where nothing is drawn
+            target = np.zeros((size[1], size[0], 4), dtype=np.float32)
+            rng = np.random.default_rng(NOISE_SEED)
+            base_matrix = np.diag([scale, scale, 1.0])
+            self._draw_object(target, canvas.backgroundImage, base_matrix, 1.0, rng)
+            self._draw_objects(target, canvas, base_matrix, 1.0, rng)
+            return _to_pil_image(target)
+
+    def render_encoded(
+        self,
+        canvas: FabricCanvas,
+        max_size: Optional[int] = None,
+        encoding: Optional[ImageEncoding] = None,
+    ) -> bytes:
+        encoding = encoding or ImageEncoding()
+        key = (get_canvas_key(canvas), max_size, encoding)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+
+        image = self.render(canvas, max_size)
+        if not encoding.supports_alpha():
+            image = image.convert("RGB")
+        image_bytes = BytesIO()
+        with span("image_encode", width=image.width, height=image.height):
+            image.save(image_bytes, encoding.format, **encoding.get_save_params())
+        encoded = image_bytes.getvalue()
+        self._set_cached(key, encoded)
+        return encoded
+
+    def _get_cached(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            encoded = self._cache.get(key)
+            if encoded is not None:
+                self._cache.move_to_end(key)
+            return encoded
+
+    def _set_cached(self, key: Hashable, encoded: bytes) -> None:
+        with self._lock:
+            self._cache[key] = encoded
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _draw_objects(
+        self,
+        target: np.ndarray,
+        collection: FabricCollection,
+        matrix: np.ndarray,
+        opacity: float,
+        rng: np.random.Generator,
+    ) -> None:
+        for obj in collection.objects:
+            self._draw_object(target, obj, matrix, opacity, rng)
+
+    def _draw_object(
+        self,
+        target: np.ndarray,
+        obj: FabricObject,
+        parent_matrix: np.ndarray,
+        parent_opacity: float,
+        rng: np.random.Generator,
+    ) -> None:
+        matrix = parent_matrix @ get_object_matrix(obj)
+        opacity = parent_opacity * obj.opacity
+        if isinstance(obj, FabricGroup):
+            # Children are positioned relative to the center of the group.
+            center = np.array(
+                [[1.0, 0.0, obj.width / 2], [0.0, 1.0, obj.height / 2], [0, 0, 1]]
+            )
+            self._draw_objects(target, obj, matrix @ center, opacity, rng)
+        elif isinstance(obj, FabricImage) and opacity > 0:
+            self._draw_image(target, obj, matrix, opacity, rng)
+
+    def _draw_image(
+        self,
+        target: np.ndarray,
+        image: FabricImage,
+        matrix: np.ndarray,
+        opacity: float,
+        rng: np.random.Generator,
+    ) -> None:
+        crop_x, crop_y = image.cropX or 0, image.cropY or 0
+        source = image.get_pil_image()
+        box = (
+            crop_x,
+            crop_y,
+            min(crop_x + round(image.width), source.width),
+            min(crop_y + round(image.height), source.height),
+        )
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return
+
+        if box != (0, 0, source.width, source.height):
+            source = source.crop(box)
+        if source.mode != "RGBA":
+            source = source.convert("RGBA")
+        pixels = np.asarray(source, dtype=np.float32)
+
+        # Objects drawn smaller than their pixels (thumbnails, scaled down
+        # objects) are downscaled once with area averaging, which warpAffine
+        # alone would alias.
+        scale_x = float(np.hypot(*matrix[:2, 0]))
+        scale_y = float(np.hypot(*matrix[:2, 1]))
+        filter_scale = 1.0
+        if scale_x < 1.0 or scale_y < 1.0:
+            height, width = pixels.shape[:2]
+            new_width = max(round(width * min(scale_x, 1.0)), 1)
+            new_height = max(round(height * min(scale_y, 1.0)), 1)
+            if (new_width, new_height) != (width, height):
+                pixels = cv2.resize(
+                    pixels, (new_width, new_height), interpolation=cv2.INTER_AREA
+                )
+                matrix = matrix @ np.diag([width / new_width, height / new_height, 1])
+                filter_scale = new_width / width
+
+        if image.filters:
+            apply_filters(pixels, image.filters, filter_scale, rng)
+
+        # Straight 0-255 to premultiplied 0-1 with the opacity folded in
+        pixels *= 1.0 / 255.0
+        if opacity < 1.0:
+            pixels[..., 3] *= opacity
+        pixels[..., :3] *= pixels[..., 3:]
+        _composite(target, pixels, matrix)
+
+
+def _composite(target: np.ndarray, pixels: np.ndarray, matrix: np.ndarray) -> None:
+    """Draw premultiplied pixels over target through matrix, in their bounds only."""
+    height, width = pixels.shape[:2]
+    corners = matrix @ np.array(
+        [[0, width, width, 0], [0, 0, height, height], [1, 1, 1, 1]], dtype=float
+    )
+    x0 = max(math.floor(corners[0].min()), 0)
+    y0 = max(math.floor(corners[1].min()), 0)
+    x1 = min(math.ceil(corners[0].max()), target.shape[1])
+    y1 = min(math.ceil(corners[1].max()), target.shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    offset_x, offset_y = round(matrix[0, 2]), round(matrix[1, 2])
+    if np.allclose(matrix[:2], [[1, 0, offset_x], [0, 1, offset_y]]):
+        # Moved by whole pixels only (the background, unscaled objects), no
+        # resampling needed.
+        warped = pixels[y0 - offset_y : y1 - offset_y, x0 - offset_x : x1 - offset_x]
+    else:
+        # The matrix maps pixel corners, warpAffine pixel centers: move to corners
+        # before it and back after, along with the shift into the bounds.
+        to_corner = np.array([[1.0, 0.0, 0.5], [0.0, 1.0, 0.5], [0.0, 0.0, 1.0]])
+        to_center = np.array(
+            [[1.0, 0.0, -0.5 - x0], [0.0, 1.0, -0.5 - y0], [0.0, 0.0, 1.0]]
+        )
+        warped = cv2.warpAffine(
+            pixels,
+            (to_center @ matrix @ to_corner)[:2],
+            (x1 - x0, y1 - y0),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
+        )
+    region = target[y0:y1, x0:x1]
+    region *= 1.0 - warped[..., 3:]
+    region += warped
+
+
+def _to_pil_image(target: np.ndarray) -> Image.Image:
+    alpha = target[..., 3:]
+    if alpha.min() >= OPAQUE_ALPHA:
+        # Opaque, premultiplied colors are the colors
+        rgb = cv2.cvtColor(target, cv2.COLOR_RGBA2RGB)
+        return Image.fromarray(cv2.convertScaleAbs(rgb, alpha=255.0), "RGB")
+
+    np.divide(target[..., :3], alpha, out=target[..., :3], where=alpha > 0)
+    return Image.fromarray(cv2.convertScaleAbs(target, alpha=255.0), "RGBA")
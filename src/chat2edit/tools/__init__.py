@@ -1,2 +1,17 @@
-from chat2edit.tools.grounded_sam import GroundedSAM
-from chat2edit.tools.lama_inpainter import LaMaInpainter
+from typing import Any
+
+
+# The model wrappers pull in torch, GroundingDINO, SAM and iopaint, import them on
+# first access so the lightweight parts of the package load without them.
+def __getattr__(name: str) -> Any:
+    if name == "GroundedSAM":
+        from chat2edit.tools.grounded_sam import GroundedSAM
+
+        return GroundedSAM
+
+    if name == "LaMaInpainter":
+        from chat2edit.tools.lama_inpainter import LaMaInpainter
+
+        return LaMaInpainter
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,107 @@
+import os
+from typing import Literal, Optional, Sequence, Tuple
+
+import torch
+
+
+Backend = Literal["eager", "quantized", "torchscript", "onnx"]
+
+ONNX_OPSET_VERSION = 17
+
+
+def configure_threads(
+    intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None
+) -> None:
+    """
+    Set the PyTorch CPU thread pools. The inter-op pool can only be sized before the
+    first parallel work runs, so call this before any model is built.
+    """
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            pass
+
+
+def check_backend(
+    tool: str, backend: str, supported: Sequence[str], device: str
+) -> None:
+    if backend not in supported:
+        raise ValueError(
+            f"Backend '{backend}' is not supported for {tool}, use one of {list(supported)}"
+        )
+
+    if backend in ("quantized", "onnx") and device != "cpu":
+        raise ValueError(f"Backend '{backend}' for {tool} only runs on the cpu device")
+
+
+def quantize_dynamic(module: torch.nn.Module) -> torch.nn.Module:
+    """int8 weights for every Linear layer, activations are quantized on the fly."""
+    return torch.ao.quantization.quantize_dynamic(
+        module.eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def freeze_torchscript(
+    module: torch.nn.Module, example_inputs: Optional[Tuple[torch.Tensor, ...]] = None
+) -> torch.jit.ScriptModule:
+    """Trace (unless already scripted), freeze and fold the graph for inference."""
+    if not isinstance(module, torch.jit.ScriptModule):
+        with torch.no_grad():
+            module = torch.jit.trace(module.eval(), example_inputs, check_trace=False)
+
+    frozen = torch.jit.freeze(module.eval())
+    return torch.jit.optimize_for_inference(frozen)
+
+
+class OnnxModule(torch.nn.Module):
+    """
+    Runs a module exported to ONNX with ONNX Runtime behind the nn.Module call
+    interface. The graph is exported to `path` once and reused afterwards.
+    """
+
+    def __init__(
+        self,
+        module: torch.nn.Module,
+        example_inputs: Tuple[torch.Tensor, ...],
+        path: str,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+    ) -> None:
+        super().__init__()
+        import onnxruntime
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            input_names = [f"input_{i}" for i in range(len(example_inputs))]
+            with torch.no_grad():
+                torch.onnx.export(
+                    module.eval(),
+                    example_inputs,
+                    path,
+                    input_names=input_names,
+                    output_names=["output"],
+                    opset_version=ONNX_OPSET_VERSION,
+                )
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self._session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [value.name for value in self._session.get_inputs()]
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        feeds = {
+            name: tensor.detach().cpu().numpy()
+            for name, tensor in zip(self._input_names, inputs)
+        }
+        return torch.from_numpy(self._session.run(None, feeds)[0])
@@ -1,18 +1,39 @@
 from abc import ABC, abstractmethod
 from PIL import Image
-import numpy as np
 from typing import List, Tuple
 
+from chat2edit.utils.mask import Mask
+
 
 class Inpainter(ABC):
+    # Whether batch runs the images in fewer forward passes than a call each,
+    # only then are concurrent calls worth batching.
+    batched: bool = False
+
     @abstractmethod
-    def __call__(self, image: Image.Image, mask: np.ndarray) -> Image.Image:
+    def __call__(self, image: Image.Image, mask: Mask) -> Image.Image:
         pass
 
+    def batch(self, images: List[Image.Image], masks: List[Mask]) -> List[Image.Image]:
+        return [self(image, mask) for image, mask in zip(images, masks)]
+
 
 class Segmenter(ABC):
+    # Whether batch runs the images in fewer forward passes than a call each,
+    # only then are concurrent calls worth batching.
+    batched: bool = False
+
     @abstractmethod
     def __call__(
         self, image: Image.Image, label: str
-    ) -> Tuple[List[float], List[np.ndarray]]:
+    ) -> Tuple[List[float], List[Mask]]:
+        pass
+
+    def batch(
+        self, images: List[Image.Image], labels: List[str]
+    ) -> List[Tuple[List[float], List[Mask]]]:
+        return [self(image, label) for image, label in zip(images, labels)]
+
+    def precompute(self, image: Image.Image) -> None:
+        """Prepare whatever a later call on this image can reuse, if anything."""
         pass
@@ -0,0 +1,84 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+from chat2edit.utils.metrics import Trace, get_current_trace, share_spans
+
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+class MicroBatcher(Generic[Item, Result]):
+    """
+    Groups calls made concurrently from several threads into one batch call. The
+    first waiting item starts a batch that collects more items for at most
+    `max_wait_ms` or until it holds `max_batch_size` of them. Batches run one at a
+    time on the batcher's own thread, so the model behind it never runs
+    concurrently. The spans of a batch are added to the trace of every request
+    with an item in it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_func: Callable[[List[Item]], List[Result]],
+        max_batch_size: int,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ) -> None:
+        self.name = name
+        self._batch_func = batch_func
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[Item, Future, Optional[Trace]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, item: Item) -> Result:
+        return self.submit(item).result()
+
+    def submit(self, item: Item) -> "Future[Result]":
+        self._start()
+        future = Future()
+        self._queue.put((item, future, get_current_trace()))
+        return future
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(
+                target=self._run, name=f"batch-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _, _ in batch]
+            traces = [curr_trace for _, _, curr_trace in batch]
+            try:
+                with share_spans(traces, batch_size=len(batch)):
+                    results = self._batch_func(items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -1,6 +1,10 @@
 from ast import List
-from typing import Tuple
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
 from PIL import Image
+import cv2
 import numpy as np
 import torch
 import groundingdino.datasets.transforms as T
@@ -9,13 +13,32 @@ from typing import List, Tuple
 from torchvision.ops import box_convert
 from segment_anything import sam_model_registry, SamPredictor
 
+from chat2edit.tools.backends import (
+    OnnxModule,
+    check_backend,
+    freeze_torchscript,
+    quantize_dynamic,
+)
 from chat2edit.tools.base import Segmenter
-from chat2edit.utils.image import expand_box
+from chat2edit.utils.image import expand_box, nms, refine_mask_boundary
+from chat2edit.utils.mask import Mask
+from chat2edit.utils.metrics import span
 
 
 BOX_THRESHOLD = 0.35
 TEXT_THRESHOLD = 0.25
 BOX_EXPAND_FACTOR = 0.1
+NMS_IOU_THRESHOLD = 0.5
+CONTAINMENT_THRESHOLD = 0.9
+# Extra proxy pixels kept around a coarse mask before upsampling it, so the
+# interpolation has context at the boundary.
+REFINE_MARGIN = 2
+# Proxy pixels on either side of an upsampled boundary that are refined on the
+# full resolution pixels, and the guided filter regularization there.
+REFINE_BAND = 2
+REFINE_EPS = 1e-3
+# SAM image embeddings kept by content hash, vit_b takes 4 MB per image
+EMBEDDING_CACHE_SIZE = 4
 TRANSFORM = T.Compose(
     [
         T.RandomResize([800], max_size=1333),
@@ -23,6 +46,19 @@ TRANSFORM = T.Compose(
         T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
     ]
 )
+GDINO_BACKENDS = ("eager", "quantized")
+SAM_BACKENDS = ("eager", "quantized", "torchscript", "onnx")
+
+
+class SamImageEncoder(torch.nn.Module):
+    # SamPredictor reads img_size from the encoder, keep it on optimized encoders.
+    def __init__(self, module: torch.nn.Module, img_size: int) -> None:
+        super().__init__()
+        self.module = module
+        self.img_size = img_size
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        return self.module(image)
 
 
 class GroundedSAM(Segmenter):
@@ -34,44 +70,249 @@ class GroundedSAM(Segmenter):
         sam_checkpoint: str,
         sam_model_type: str,
         sam_device: str,
+        gdino_backend: str = "eager",
+        sam_backend: str = "eager",
+        sam_onnx_path: Optional[str] = None,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        proxy_max_size: Optional[int] = None,
+        nms_iou_threshold: Optional[float] = NMS_IOU_THRESHOLD,
+        containment_threshold: Optional[float] = CONTAINMENT_THRESHOLD,
+        embedding_cache_size: int = EMBEDDING_CACHE_SIZE,
     ) -> None:
+        check_backend("GroundingDINO", gdino_backend, GDINO_BACKENDS, gdino_device)
+        check_backend("SAM", sam_backend, SAM_BACKENDS, sam_device)
+        if sam_backend == "onnx" and sam_onnx_path is None:
+            raise ValueError("The onnx SAM backend needs a path for the exported graph")
+
         self.gdino_checkpoint = gdino_checkpoint
         self.gdino_config = gdino_config
         self.gdino_device = gdino_device
         self.sam_checkpoint = sam_checkpoint
         self.sam_model_type = sam_model_type
         self.sam_device = sam_device
+        self.gdino_backend = gdino_backend
+        self.sam_backend = sam_backend
+        self.proxy_max_size = proxy_max_size
+        self.nms_iou_threshold = nms_iou_threshold
+        self.containment_threshold = containment_threshold
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = OrderedDict()
+        # The predictor holds the current image embedding, precompute runs on
+        # another thread than detect.
+        self._sam_lock = threading.Lock()
         self.gdino_predictor = load_model(gdino_config, gdino_checkpoint, gdino_device)
+        if gdino_backend == "quantized":
+            self.gdino_predictor = quantize_dynamic(self.gdino_predictor)
         sam = sam_model_registry[sam_model_type](sam_checkpoint)
         sam.to(sam_device)
+        sam.image_encoder = self._create_sam_image_encoder(
+            sam.image_encoder, sam_onnx_path, intra_op_threads, inter_op_threads
+        )
         self.sam_predictor = SamPredictor(sam)
 
+    def _create_sam_image_encoder(
+        self,
+        image_encoder: torch.nn.Module,
+        onnx_path: Optional[str],
+        intra_op_threads: Optional[int],
+        inter_op_threads: Optional[int],
+    ) -> torch.nn.Module:
+        # The image encoder is where nearly all of SAM's compute goes, the prompt
+        # encoder and mask decoder stay eager.
+        img_size = image_encoder.img_size
+        example_inputs = (
+            torch.zeros(1, 3, img_size, img_size, device=self.sam_device),
+        )
+        if self.sam_backend == "quantized":
+            encoder = quantize_dynamic(image_encoder)
+        elif self.sam_backend == "torchscript":
+            encoder = freeze_torchscript(image_encoder, example_inputs)
+        elif self.sam_backend == "onnx":
+            encoder = OnnxModule(
+                image_encoder,
+                example_inputs,
+                onnx_path,
+                intra_op_threads,
+                inter_op_threads,
+            )
+        else:
+            return image_encoder
+
+        return SamImageEncoder(encoder, img_size)
+
     def __call__(
         self, image: Image.Image, label: str
-    ) -> Tuple[List[float], List[np.ndarray]]:
-        h, w, _ = np.asarray(image).shape
-        caption = label + " ."
-        boxes, logits, _ = predict(
-            model=self.gdino_predictor,
-            image=TRANSFORM(image.convert("RGB"), None)[0],
-            caption=caption,
-            box_threshold=BOX_THRESHOLD,
-            text_threshold=TEXT_THRESHOLD,
-            device=self.gdino_device,
+    ) -> Tuple[List[float], List[Mask]]:
+        if self._use_proxy(image):
+            return self._segment_coarse_to_fine(image, label)
+
+        return self._segment(image, label)
+
+    def precompute(self, image: Image.Image) -> None:
+        """Compute and cache the SAM embedding the next call on this image needs."""
+        sam_image = self._create_proxy(image) if self._use_proxy(image) else image
+        sam_image = np.asarray(sam_image.convert("RGB"))
+        with self._sam_lock:
+            self._set_sam_image(sam_image)
+
+    def _use_proxy(self, image: Image.Image) -> bool:
+        return self.proxy_max_size is not None and max(image.size) > self.proxy_max_size
+
+    def _segment(
+        self, image: Image.Image, label: str
+    ) -> Tuple[List[float], List[Mask]]:
+        rgb_image = image.convert("RGB")
+        scores, boxes = self._predict_boxes(rgb_image, label)
+        masks = []
+        with self._sam_lock:
+            self._set_sam_image(np.asarray(rgb_image))
+            with span("sam_decode", objects=len(boxes)):
+                for box in boxes:
+                    expanded_box = expand_box(box, image.size, BOX_EXPAND_FACTOR)
+                    curr_masks, _, _ = self.sam_predictor.predict(
+                        box=np.array(expanded_box), multimask_output=False
+                    )
+                    masks.append(Mask.from_array(curr_masks[0]))
+
+        return scores, masks
+
+    def _segment_coarse_to_fine(
+        self, image: Image.Image, label: str
+    ) -> Tuple[List[float], List[Mask]]:
+        """
+        Detect and decode coarse masks on a proxy whose longest side is
+        proxy_max_size, then upsample each mask's logits to full resolution only
+        inside the mask's own box and refine the boundary on the full resolution
+        pixels. Apart from the decoded upload itself, memory and compute scale with
+        the proxy and the object sizes.
+        """
+        proxy = self._create_proxy(image).convert("RGB")
+        scores, boxes = self._predict_boxes(proxy, label)
+        masks = []
+        with self._sam_lock:
+            self._set_sam_image(np.asarray(proxy))
+            with span("sam_decode", objects=len(boxes), proxy=True):
+                for box in boxes:
+                    expanded_box = expand_box(box, proxy.size, BOX_EXPAND_FACTOR)
+                    logits, _, _ = self.sam_predictor.predict(
+                        box=np.array(expanded_box),
+                        multimask_output=False,
+                        return_logits=True,
+                    )
+                    masks.append(self._upsample_mask_logits(logits[0], image))
+
+        return scores, masks
+
+    def _create_proxy(self, image: Image.Image) -> Image.Image:
+        width, height = image.size
+        scale = self.proxy_max_size / max(width, height)
+        proxy_size = max(1, round(width * scale)), max(1, round(height * scale))
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGB")
+        return image.resize(proxy_size, Image.BILINEAR, reducing_gap=2.0)
+
+    def _set_sam_image(self, image: np.ndarray) -> None:
+        """set_image, reusing the embedding of identical pixels. Hold the SAM lock."""
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(str(image.shape).encode())
+        key = digest.hexdigest()
+        predictor = self.sam_predictor
+        embedding = self._embedding_cache.get(key)
+        if embedding is not None:
+            self._embedding_cache.move_to_end(key)
+            predictor.reset_image()
+            predictor.features, predictor.original_size, predictor.input_size = (
+                embedding
+            )
+            predictor.is_image_set = True
+            return
+
+        with span("sam_encode", width=image.shape[1], height=image.shape[0]):
+            predictor.set_image(image)
+        if self.embedding_cache_size > 0:
+            self._embedding_cache[key] = (
+                predictor.features,
+                predictor.original_size,
+                predictor.input_size,
+            )
+            while len(self._embedding_cache) > self.embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+
+    def _upsample_mask_logits(self, logits: np.ndarray, image: Image.Image) -> Mask:
+        """
+        Bilinearly upsample proxy logits inside the mask box, then snap the band
+        of REFINE_BAND proxy pixels around the boundary to the edges of the full
+        resolution image with a guided filter.
+        """
+        size = image.size
+        coarse_box = Mask.from_array(logits > self.sam_predictor.model.mask_threshold)
+        if coarse_box.is_empty():
+            return Mask.empty(size)
+
+        width, height = size
+        proxy_height, proxy_width = logits.shape
+        scale_x, scale_y = proxy_width / width, proxy_height / height
+        xmin, ymin, xmax, ymax = coarse_box.get_box()
+        xmin = max(0, int((xmin - REFINE_MARGIN) / scale_x))
+        ymin = max(0, int((ymin - REFINE_MARGIN) / scale_y))
+        xmax = min(width, int(np.ceil((xmax + REFINE_MARGIN) / scale_x)))
+        ymax = min(height, int(np.ceil((ymax + REFINE_MARGIN) / scale_y)))
+
+        # Upsample probabilities as uint8 rather than float logits, so the full
+        # resolution buffer takes one byte per pixel of the object box.
+        probabilities = (255 / (1 + np.exp(-np.clip(logits, -20, 20)))).astype(np.uint8)
+        # Map every full resolution pixel center in the box back to the proxy.
+        transform = np.array(
+            [
+                [scale_x, 0, (xmin + 0.5) * scale_x - 0.5],
+                [0, scale_y, (ymin + 0.5) * scale_y - 0.5],
+            ],
+            dtype=np.float64,
+        )
+        region = cv2.warpAffine(
+            probabilities,
+            transform,
+            (xmax - xmin, ymax - ymin),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE,
         )
+        guide = image.crop((xmin, ymin, xmax, ymax)).convert("L")
+        band_radius = max(1, int(np.ceil(REFINE_BAND / min(scale_x, scale_y))))
+        with span("sam_refine", width=xmax - xmin, height=ymax - ymin):
+            region = refine_mask_boundary(
+                region, np.asarray(guide), band_radius, REFINE_EPS
+            )
+        return Mask.from_array(region, offset=(xmin, ymin), size=size)
+
+    def _predict_boxes(
+        self, image: Image.Image, label: str
+    ) -> Tuple[List[float], List[Tuple[int, int, int, int]]]:
+        w, h = image.size
+        caption = label + " ."
+        with span("groundingdino") as attrs:
+            boxes, logits, _ = predict(
+                model=self.gdino_predictor,
+                image=TRANSFORM(image, None)[0],
+                caption=caption,
+                box_threshold=BOX_THRESHOLD,
+                text_threshold=TEXT_THRESHOLD,
+                device=self.gdino_device,
+            )
+            attrs["boxes"] = len(boxes)
         boxes = box_convert(
             boxes=boxes * torch.Tensor([w, h, w, h]), in_fmt="cxcywh", out_fmt="xyxy"
         )
-        scores = list(map(float, logits))
-        boxes = list(map(tuple, boxes.numpy().astype(int)))
-        masks = []
-        self.sam_predictor.set_image(np.array(image.convert("RGB")))
-        for box in boxes:
-            expanded_box = expand_box(box, image.size, BOX_EXPAND_FACTOR)
-            curr_masks, _, _ = self.sam_predictor.predict(
-                box=np.array(expanded_box), multimask_output=False
+        boxes = boxes.numpy()
+        scores = logits.numpy()
+        # GroundingDINO often returns near duplicates of one object, drop them
+        # before each of them costs a SAM decode and becomes its own object.
+        if self.nms_iou_threshold is not None:
+            keep = nms(
+                boxes, scores, self.nms_iou_threshold, self.containment_threshold
             )
-            mask = curr_masks[0].astype(np.uint8) * 255
-            masks.append(mask)
-
-        return scores, masks
+            boxes = boxes[keep]
+            scores = scores[keep]
+        scores = list(map(float, scores))
+        boxes = list(map(tuple, boxes.astype(int)))
+        return scores, boxes
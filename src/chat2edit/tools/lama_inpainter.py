@@ -1,26 +1,151 @@
+from typing import Dict, List, Tuple
+
 import cv2
 import torch
 import numpy as np
 from PIL import Image
+from iopaint.helper import ceil_modulo, resize_max_size
 from iopaint.model import LaMa
 from iopaint.schema import InpaintRequest
 
+from chat2edit.tools.backends import check_backend, freeze_torchscript
 from chat2edit.tools.base import Inpainter
-from chat2edit.utils.image import expand_mask
+from chat2edit.utils.mask import Mask
+from chat2edit.utils.metrics import span
 
 
 MASK_EXPANDING_ITERATIONS = 10
+# The checkpoint is already TorchScript, "torchscript" freezes and folds it. LaMa is
+# made of (Fourier) convolutions, which dynamic int8 quantization does not cover
+# and the ONNX exporter can not translate.
+LAMA_BACKENDS = ("eager", "torchscript")
+# Batched inputs are padded up to a multiple of this, so images of close sizes
+# share a forward pass.
+BATCH_BUCKET_SIZE = 64
+# Pixels in one batched forward pass, bounds its memory (four images at the
+# resize limit)
+MAX_BATCH_PIXELS = 4 * 1280 * 1280
 
 
 class LaMaInpainter(LaMa, Inpainter):
-    def __init__(self, checkpoint: str, device: str) -> None:
+    batched = True
+
+    def __init__(self, checkpoint: str, device: str, backend: str = "eager") -> None:
+        check_backend("LaMa", backend, LAMA_BACKENDS, device)
         self.model = torch.jit.load(checkpoint, "cpu").eval().to(device)
+        if backend == "torchscript":
+            self.model = freeze_torchscript(self.model)
         self.device = device
+        self.backend = backend
 
-    def __call__(self, image: Image.Image, mask: np.ndarray) -> Image.Image:
-        image = np.array(image)
-        image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-        expanded_mask = expand_mask(mask, self.MASK_EXPANDING_ITERATIONS)
+    def __call__(self, image: Image.Image, mask: Mask) -> Image.Image:
+        image, expanded_mask = self._prepare(image, mask)
         config = InpaintRequest(hd_strategy="Resize")
-        inpainted_image = super().__call__(image, expanded_mask, config)
+        with span("lama", width=image.shape[1], height=image.shape[0]):
+            inpainted_image = super().__call__(image, expanded_mask, config)
         return Image.fromarray(inpainted_image.astype(np.uint8))
+
+    def batch(self, images: List[Image.Image], masks: List[Mask]) -> List[Image.Image]:
+        """
+        Same results as one call per image (up to the wider padding), in as few
+        forward passes as possible. The images are resized like a single call does,
+        padded up to a multiple of BATCH_BUCKET_SIZE and those of the same padded
+        size run as one tensor batch, whose results are cropped back. An image
+        alone in its bucket runs as a single call.
+        """
+        config = InpaintRequest(hd_strategy="Resize")
+        inputs = [self._prepare(image, mask) for image, mask in zip(images, masks)]
+        forward_inputs = [
+            (
+                resize_max_size(image, config.hd_strategy_resize_limit),
+                resize_max_size(mask, config.hd_strategy_resize_limit),
+            )
+            for image, mask in inputs
+        ]
+
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for i, (image, _) in enumerate(forward_inputs):
+            height, width = image.shape[:2]
+            bucket = (
+                ceil_modulo(height, BATCH_BUCKET_SIZE),
+                ceil_modulo(width, BATCH_BUCKET_SIZE),
+            )
+            buckets.setdefault(bucket, []).append(i)
+
+        results = [None] * len(inputs)
+        for size, indices in buckets.items():
+            chunk_size = max(MAX_BATCH_PIXELS // (size[0] * size[1]), 1)
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start : start + chunk_size]
+                if len(chunk) == 1:
+                    image, mask = inputs[chunk[0]]
+                    with span("lama", width=image.shape[1], height=image.shape[0]):
+                        results[chunk[0]] = super().__call__(image, mask, config)
+                    continue
+
+                with span(
+                    "lama_batch", images=len(chunk), width=size[1], height=size[0]
+                ):
+                    outputs = self._forward_batch(
+                        [forward_inputs[i] for i in chunk], size
+                    )
+                for i, output in zip(chunk, outputs):
+                    results[i] = self._finish(inputs[i], forward_inputs[i], output)
+
+        return [Image.fromarray(result.astype(np.uint8)) for result in results]
+
+    def _prepare(self, image: Image.Image, mask: Mask) -> Tuple[np.ndarray, np.ndarray]:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        image = np.array(image)
+        # iopaint returns BGR, feeding it the channels swapped gives back RGB.
+        code = cv2.COLOR_BGRA2RGB if image.shape[2] == 4 else cv2.COLOR_BGR2RGB
+        image = cv2.cvtColor(image, code)
+        return image, mask.dilate(MASK_EXPANDING_ITERATIONS).to_array()
+
+    @torch.no_grad()
+    def _forward_batch(
+        self, inputs: List[Tuple[np.ndarray, np.ndarray]], size: Tuple[int, int]
+    ) -> List[np.ndarray]:
+        """LaMa.forward on several inputs padded to size, results cropped back."""
+        height, width = size
+        images = []
+        masks = []
+        for image, mask in inputs:
+            padding = ((0, height - image.shape[0]), (0, width - image.shape[1]))
+            images.append(np.pad(image, (*padding, (0, 0)), mode="symmetric"))
+            masks.append(np.pad(mask, padding, mode="symmetric"))
+
+        image_batch = torch.from_numpy(np.stack(images)).to(self.device)
+        image_batch = image_batch.permute(0, 3, 1, 2).float() / 255
+        mask_batch = torch.from_numpy(np.stack(masks) > 0).to(self.device)
+        mask_batch = mask_batch[:, None].float()
+        output_batch = self.model(image_batch, mask_batch)
+        output_batch = (output_batch.permute(0, 2, 3, 1) * 255).clamp(0, 255)
+        output_batch = output_batch.to(torch.uint8).cpu().numpy()
+
+        return [
+            cv2.cvtColor(output[: image.shape[0], : image.shape[1]], cv2.COLOR_RGB2BGR)
+            for output, (image, _) in zip(output_batch, inputs)
+        ]
+
+    def _finish(
+        self,
+        original: Tuple[np.ndarray, np.ndarray],
+        forward_input: Tuple[np.ndarray, np.ndarray],
+        output: np.ndarray,
+    ) -> np.ndarray:
+        """The post processing of iopaint's resize strategy on a forward output."""
+        image, mask = forward_input
+        weight = mask[:, :, np.newaxis] / 255
+        result = output * weight + image[:, :, ::-1] * (1 - weight)
+        if image is original[0]:
+            return result
+
+        image, mask = original
+        result = cv2.resize(
+            result, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_CUBIC
+        )
+        unmasked = mask < 127
+        result[unmasked] = image[:, :, ::-1][unmasked]
+        return result
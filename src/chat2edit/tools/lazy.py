@@ -0,0 +1,149 @@
+import threading
+import traceback
+from typing import Callable, Dict, Generic, List, Literal, Optional, Tuple, TypeVar
+
+import numpy as np
+from PIL import Image
+
+from chat2edit.tools.base import Inpainter, Segmenter
+from chat2edit.utils.mask import Mask
+
+
+ModelState = Literal["pending", "loading", "warming_up", "ready", "failed"]
+Model = TypeVar("Model")
+
+WARMUP_LABEL = "object"
+
+
+class LazyModel(Generic[Model]):
+    """
+    Loads a model on a background thread so the server can start serving requests
+    that do not need it. Callers of `get` block until the model is ready.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Model],
+        warmup: Optional[Callable[[Model], None]] = None,
+        load_timeout: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self._factory = factory
+        self._warmup = warmup
+        self._load_timeout = load_timeout
+        self._model: Optional[Model] = None
+        self._state: ModelState = "pending"
+        self._error: Optional[str] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._state != "pending":
+                return
+            self._state = "loading"
+
+        thread = threading.Thread(
+            target=self._load, name=f"load-{self.name}", daemon=True
+        )
+        thread.start()
+
+    def get_state(self) -> ModelState:
+        return self._state
+
+    def get_error(self) -> Optional[str]:
+        return self._error
+
+    def is_ready(self) -> bool:
+        return self._state == "ready"
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def get(self) -> Model:
+        self.start()
+        if not self.wait(self._load_timeout):
+            raise RuntimeError(f"The '{self.name}' model is still loading")
+
+        if self._state == "failed":
+            raise RuntimeError(f"The '{self.name}' model failed to load: {self._error}")
+
+        return self._model
+
+    def _load(self) -> None:
+        try:
+            model = self._factory()
+            if self._warmup is not None:
+                self._state = "warming_up"
+                self._warmup(model)
+            self._model = model
+            self._state = "ready"
+        except Exception as e:
+            traceback.print_exc()
+            self._error = f"{type(e).__name__}: {e}"
+            self._state = "failed"
+        finally:
+            self._done.set()
+
+
+class LazySegmenter(Segmenter):
+    def __init__(self, model: LazyModel[Segmenter]) -> None:
+        self._model = model
+
+    @property
+    def batched(self) -> bool:
+        return self._model.get().batched
+
+    def __call__(
+        self, image: Image.Image, label: str
+    ) -> Tuple[List[float], List[Mask]]:
+        return self._model.get()(image, label)
+
+    def batch(
+        self, images: List[Image.Image], labels: List[str]
+    ) -> List[Tuple[List[float], List[Mask]]]:
+        return self._model.get().batch(images, labels)
+
+    def precompute(self, image: Image.Image) -> None:
+        # Precomputing is optional, never wait for the model to load for it.
+        if self._model.is_ready():
+            self._model.get().precompute(image)
+
+
+class LazyInpainter(Inpainter):
+    def __init__(self, model: LazyModel[Inpainter]) -> None:
+        self._model = model
+
+    @property
+    def batched(self) -> bool:
+        return self._model.get().batched
+
+    def __call__(self, image: Image.Image, mask: Mask) -> Image.Image:
+        return self._model.get()(image, mask)
+
+    def batch(self, images: List[Image.Image], masks: List[Mask]) -> List[Image.Image]:
+        return self._model.get().batch(images, masks)
+
+
+def create_segmenter_warmup(image_size: int) -> Callable[[Segmenter], None]:
+    def warmup(segmenter: Segmenter) -> None:
+        segmenter(Image.new("RGB", (image_size, image_size)), WARMUP_LABEL)
+
+    return warmup
+
+
+def create_inpainter_warmup(image_size: int) -> Callable[[Inpainter], None]:
+    def warmup(inpainter: Inpainter) -> None:
+        mask = np.zeros((image_size, image_size), dtype=np.uint8)
+        mask[image_size // 4 : image_size // 2, image_size // 4 : image_size // 2] = 1
+        inpainter(Image.new("RGB", (image_size, image_size)), Mask.from_array(mask))
+
+    return warmup
+
+
+def get_model_states(models: List[LazyModel]) -> Dict[str, Dict[str, Optional[str]]]:
+    return {
+        model.name: {"state": model.get_state(), "error": model.get_error()}
+        for model in models
+    }
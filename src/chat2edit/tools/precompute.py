@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+from PIL import Image
+
+from chat2edit.tools.toolkit import Toolkit
+from chat2edit.utils.metrics import submit_in_context
+
+
+IDLE_TIMEOUT = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+class Precomputer:
+    """
+    Runs the toolkit's precomputation for uploaded images in the background, so
+    the first detect on an image finds its embedding ready. Work queued for a chat
+    that has been idle (no new message) for `idle_timeout` seconds is dropped
+    before it starts, and the activity of idle chats is forgotten.
+    """
+
+    def __init__(
+        self, toolkit: Toolkit, idle_timeout: float = IDLE_TIMEOUT, workers: int = 1
+    ) -> None:
+        self._toolkit = toolkit
+        self._idle_timeout = idle_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="precompute"
+        )
+        self._last_activity: Dict[str, float] = {}
+        self._last_expiry = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, chat_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._last_activity[chat_id] = now
+            if now - self._last_expiry > self._idle_timeout:
+                self._expire(now)
+
+    def is_idle(self, chat_id: str) -> bool:
+        with self._lock:
+            last_activity = self._last_activity.get(chat_id)
+        return (
+            last_activity is None
+            or time.monotonic() - last_activity > self._idle_timeout
+        )
+
+    def submit(
+        self, chat_id: str, get_image: Callable[[], Image.Image]
+    ) -> Future[bool]:
+        """
+        Queue the precomputation, `get_image` runs on the worker so decoding the
+        upload stays off the request thread. The future tells whether it ran. The
+        spans it records while the request runs show up in the request's trace.
+        """
+        self.touch(chat_id)
+        return submit_in_context(self._executor, self._run, chat_id, get_image)
+
+    def _run(self, chat_id: str, get_image: Callable[[], Image.Image]) -> bool:
+        if self.is_idle(chat_id):
+            self._forget(chat_id)
+            return False
+
+        try:
+            self._toolkit.precompute_segmentation(get_image())
+        except Exception:
+            # Detect computes the same thing again and reports the error itself.
+            logger.exception("Precomputing for chat %s failed", chat_id)
+            return False
+
+        return True
+
+    def _forget(self, chat_id: str) -> None:
+        with self._lock:
+            self._last_activity.pop(chat_id, None)
+
+    def _expire(self, now: float) -> None:
+        # Idle chats are treated like unknown ones, at most once per idle_timeout
+        # so touch stays cheap. Hold the lock.
+        self._last_activity = {
+            chat_id: last_activity
+            for chat_id, last_activity in self._last_activity.items()
+            if now - last_activity <= self._idle_timeout
+        }
+        self._last_expiry = now
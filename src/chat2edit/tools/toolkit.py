@@ -1,16 +1,56 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from PIL.Image import Image
-from numpy import ndarray
 from chat2edit.tools.base import Inpainter, Segmenter
+from chat2edit.tools.batching import DEFAULT_MAX_WAIT_MS, MicroBatcher
+from chat2edit.utils.mask import Mask
 
 
 class Toolkit:
-    def __init__(self, segmenter: Segmenter, inpainter: Inpainter) -> None:
+    """
+    args:
+        max_batch_size: above 1, concurrent calls (e.g. from a bulk edit) to a
+            tool with a batched forward pass (`batched`) are micro-batched into
+            its batch method. Other tools are called directly, a batch would
+            only queue their calls.
+        max_wait_ms: how long a batch waits for more calls
+    """
+
+    def __init__(
+        self,
+        segmenter: Segmenter,
+        inpainter: Inpainter,
+        max_batch_size: int = 1,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ) -> None:
         self._segmenter = segmenter
         self._inpainter = inpainter
+        self._segment_batcher: Optional[MicroBatcher] = None
+        self._inpaint_batcher: Optional[MicroBatcher] = None
+        if max_batch_size > 1:
+            self._segment_batcher = MicroBatcher(
+                "segment",
+                lambda items: segmenter.batch(*map(list, zip(*items))),
+                max_batch_size,
+                max_wait_ms,
+            )
+            self._inpaint_batcher = MicroBatcher(
+                "inpaint",
+                lambda items: inpainter.batch(*map(list, zip(*items))),
+                max_batch_size,
+                max_wait_ms,
+            )
+
+    def segment(self, image: Image, label: str) -> Tuple[List[float], List[Mask]]:
+        if self._segment_batcher and self._segmenter.batched:
+            return self._segment_batcher((image, label))
 
-    def segment(self, image: Image, label: str) -> Tuple[List[float], List[ndarray]]:
         return self._segmenter(image, label)
 
-    def inpaint(self, image: Image, mask: ndarray) -> Image:
+    def precompute_segmentation(self, image: Image) -> None:
+        self._segmenter.precompute(image)
+
+    def inpaint(self, image: Image, mask: Mask) -> Image:
+        if self._inpaint_batcher and self._inpainter.batched:
+            return self._inpaint_batcher((image, mask))
+
         return self._inpainter(image, mask)
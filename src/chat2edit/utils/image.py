@@ -1,4 +1,6 @@
 from base64 import b64encode, b64decode
+from dataclasses import dataclass
+from functools import lru_cache
 from io import BytesIO
 from PIL import Image
 import cv2
@@ -6,18 +8,29 @@ import numpy as np
 
 from io import BytesIO
 from PIL import Image
-from typing import Tuple, Literal
+from typing import Any, Dict, Optional, Tuple, Literal
 from cv2 import (
     BORDER_DEFAULT,
     MORPH_ELLIPSE,
     MORPH_OPEN,
+    THRESH_BINARY,
     GaussianBlur,
     getStructuringElement,
     morphologyEx,
+    threshold,
 )
 
+from chat2edit.utils.metrics import span
+
 
 KERNEL = getStructuringElement(MORPH_ELLIPSE, (3, 3))
+DILATE_KERNEL = np.ones((3, 3), np.uint8)
+# Opening reaches 1 pixel and the 5x5 blur 2 pixels past the mask, keep a margin of
+# zeros around the region so the border handling matches the full-frame version.
+POST_PROCESS_PADDING = 4
+DECODED_DATA_URL_CACHE_SIZE = 4
+# Side of the tiles refine_mask_boundary filters, bounds its float buffers
+REFINE_TILE_SIZE = 256
 
 
 def post_process_mask(mask: np.ndarray) -> np.ndarray:
@@ -40,6 +53,165 @@ def expand_mask(mask: np.ndarray, iterations: int) -> np.ndarray:
     return dilated_mask
 
 
+def get_mask_box(
+    mask: np.ndarray, padding: int = 0
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Bounding box (xmin, ymin, xmax, ymax) of the nonzero pixels grown by `padding`
+    and clipped to the mask, or None for an empty mask.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+
+    cols = np.flatnonzero(mask.any(axis=0))
+    height, width = mask.shape[:2]
+    xmin = max(0, cols[0] - padding)
+    ymin = max(0, rows[0] - padding)
+    xmax = min(width, cols[-1] + 1 + padding)
+    ymax = min(height, rows[-1] + 1 + padding)
+    return int(xmin), int(ymin), int(xmax), int(ymax)
+
+
+def _prepare_mask_output(
+    mask: np.ndarray, out: Optional[np.ndarray], box: Tuple[int, int, int, int]
+) -> np.ndarray:
+    if out is None:
+        return np.zeros(mask.shape[:2], dtype=np.uint8)
+
+    if out.shape != mask.shape[:2] or out.dtype != np.uint8:
+        raise ValueError("The output must be a uint8 array with the mask shape")
+
+    # Only clear what lies outside the region, the region itself is overwritten.
+    if out is not mask:
+        xmin, ymin, xmax, ymax = box
+        out[:ymin] = 0
+        out[ymax:] = 0
+        out[ymin:ymax, :xmin] = 0
+        out[ymin:ymax, xmax:] = 0
+    return out
+
+
+def expand_mask_region(
+    mask: np.ndarray, iterations: int, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Same result as expand_mask, but the dilation only runs inside the mask bounding
+    box padded by `iterations`.
+    args:
+        mask: uint8 or bool mask
+        out: optional preallocated uint8 output, may be `mask` itself
+    """
+    if mask.dtype == bool:
+        mask = mask.view(np.uint8)
+
+    box = get_mask_box(mask, iterations)
+    if box is None:
+        return _prepare_mask_output(mask, out, (0, 0, 0, 0))
+
+    out = _prepare_mask_output(mask, out, box)
+    xmin, ymin, xmax, ymax = box
+    cv2.dilate(
+        mask[ymin:ymax, xmin:xmax],
+        DILATE_KERNEL,
+        dst=out[ymin:ymax, xmin:xmax],
+        iterations=iterations,
+    )
+    return out
+
+
+def post_process_mask_region(
+    mask: np.ndarray, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Same result as post_process_mask, computed only inside the padded mask bounding
+    box and without the int64 intermediate of np.where.
+    args:
+        mask: uint8 mask with values 0/255
+        out: optional preallocated uint8 output, may be `mask` itself
+    """
+    box = get_mask_box(mask, POST_PROCESS_PADDING)
+    if box is None:
+        return _prepare_mask_output(mask, out, (0, 0, 0, 0))
+
+    out = _prepare_mask_output(mask, out, box)
+    xmin, ymin, xmax, ymax = box
+    region = morphologyEx(mask[ymin:ymax, xmin:xmax], MORPH_OPEN, KERNEL)
+    region = GaussianBlur(region, (5, 5), sigmaX=2, sigmaY=2, borderType=BORDER_DEFAULT)
+    threshold(region, 126, 255, THRESH_BINARY, dst=out[ymin:ymax, xmin:xmax])
+    return out
+
+
+def guided_filter(
+    guide: np.ndarray, src: np.ndarray, radius: int, eps: float
+) -> np.ndarray:
+    """
+    Edge-preserving smoothing of src following the edges of guide (He et al., Guided
+    Image Filtering). Both are float32 and 0-1, the guide is grayscale.
+    """
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def mean(array: np.ndarray) -> np.ndarray:
+        return cv2.boxFilter(array, -1, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_guide = mean(guide)
+    mean_src = mean(src)
+    variance = mean(guide * guide) - mean_guide * mean_guide
+    covariance = mean(guide * src) - mean_guide * mean_src
+    a = covariance / (variance + eps)
+    b = mean_src - a * mean_guide
+    return mean(a) * guide + mean(b)
+
+
+def refine_mask_boundary(
+    probabilities: np.ndarray, guide: np.ndarray, band_radius: int, eps: float
+) -> np.ndarray:
+    """
+    Threshold an upsampled mask with its boundary snapped to the edges of the full
+    resolution pixels. Only pixels within band_radius of the thresholded boundary
+    can change, they take the guided filter of the probabilities, which runs tile
+    by tile on the tiles the band crosses only.
+    args:
+        probabilities: uint8 mask probabilities (0-255), thresholded at 127
+        guide: uint8 grayscale pixels of the same region
+    returns: uint8 mask with values 0/255
+    """
+    mask = (probabilities > 127).astype(np.uint8)
+    kernel = getStructuringElement(
+        MORPH_ELLIPSE, (2 * band_radius + 1, 2 * band_radius + 1)
+    )
+    band = cv2.dilate(mask, kernel) != cv2.erode(mask, kernel)
+    mask *= 255
+
+    # The filtered value of a pixel depends on the pixels up to two radii away.
+    margin = 2 * band_radius
+    height, width = mask.shape
+    for ymin in range(0, height, REFINE_TILE_SIZE):
+        for xmin in range(0, width, REFINE_TILE_SIZE):
+            ymax = min(height, ymin + REFINE_TILE_SIZE)
+            xmax = min(width, xmin + REFINE_TILE_SIZE)
+            tile_band = band[ymin:ymax, xmin:xmax]
+            if not tile_band.any():
+                continue
+
+            pymin, pxmin = max(0, ymin - margin), max(0, xmin - margin)
+            pymax, pxmax = min(height, ymax + margin), min(width, xmax + margin)
+            filtered = guided_filter(
+                guide[pymin:pymax, pxmin:pxmax].astype(np.float32) / 255,
+                probabilities[pymin:pymax, pxmin:pxmax].astype(np.float32) / 255,
+                band_radius,
+                eps,
+            )
+            filtered = filtered[
+                ymin - pymin : ymax - pymin, xmin - pxmin : xmax - pxmin
+            ]
+            mask[ymin:ymax, xmin:xmax][tile_band] = np.where(
+                filtered[tile_band] > 0.5, 255, 0
+            )
+
+    return mask
+
+
 def expand_box(
     box: Tuple[int, int, int, int], image_size: Tuple[int, int], factor: float
 ) -> Tuple[int, int, int, int]:
@@ -85,28 +257,177 @@ def image_to_mask(image: Image.Image) -> np.ndarray:
     return mask
 
 
-def iou(box1: Tuple[int, int, int, int], box2: Tuple[int, int, int, int]) -> float:
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    x2 = min(box1[2], box2[2])
-    y2 = min(box1[3], box2[3])
-    intersection_area = max(0, x2 - x1 + 1) * max(0, y2 - y1 + 1)
-    area_box1 = (box1[2] - box1[0] + 1) * (box1[3] - box1[1] + 1)
-    area_box2 = (box2[2] - box2[0] + 1) * (box2[3] - box2[1] + 1)
-    union_area = area_box1 + area_box2 - intersection_area
-    iou = intersection_area / union_area if union_area > 0 else 0
-    return iou
+def image_to_mask_region(
+    image: Image.Image, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Same result as image_to_mask as uint8, thresholding only inside the bounding box
+    of the alpha channel (the last band, like image_to_mask, for images without one).
+    args:
+        out: optional preallocated uint8 output of shape (height, width)
+    """
+    alpha_channel = image.getchannel(image.getbands()[-1])
+    width, height = image.size
+    if out is None:
+        out = np.zeros((height, width), dtype=np.uint8)
+    elif out.shape != (height, width) or out.dtype != np.uint8:
+        raise ValueError("The output must be a uint8 array with the image shape")
+    else:
+        out.fill(0)
+
+    box = alpha_channel.getbbox()
+    if box is None:
+        return out
+
+    xmin, ymin, xmax, ymax = box
+    alpha = np.asarray(alpha_channel.crop(box))
+    threshold(alpha, 0, 255, THRESH_BINARY, dst=out[ymin:ymax, xmin:xmax])
+    return out
+
+
+def _box_intersections(boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Inclusive pixel coordinates, a box side spans max - min + 1 pixels.
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y1 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x2 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y2 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    intersections = np.clip(x2 - x1 + 1, 0, None) * np.clip(y2 - y1 + 1, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    return intersections, areas
+
+
+def iou_matrix(boxes: np.ndarray) -> np.ndarray:
+    """Pairwise iou of N boxes (xmin, ymin, xmax, ymax) as an NxN matrix."""
+    intersections, areas = _box_intersections(boxes)
+    unions = areas[:, None] + areas[None, :] - intersections
+    return np.divide(
+        intersections, unions, out=np.zeros_like(intersections), where=unions > 0
+    )
+
+
+def containment_matrix(boxes: np.ndarray) -> np.ndarray:
+    """Entry [i, j] is the fraction of box i that lies inside box j."""
+    intersections, areas = _box_intersections(boxes)
+    areas = areas[:, None]
+    return np.divide(
+        intersections, areas, out=np.zeros_like(intersections), where=areas > 0
+    )
+
+
+def nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float,
+    containment_threshold: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Greedy non-maximum suppression. Going from the highest score down, a box is
+    dropped when its iou with a kept box exceeds `iou_threshold`, or when at least
+    `containment_threshold` of it lies inside a kept box.
+    Returns the indices of the kept boxes, highest score first.
+    """
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(-scores, kind="stable")
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[order]
+    suppressing = iou_matrix(boxes) > iou_threshold
+    if containment_threshold is not None:
+        # [i, j] is True when box j lies inside box i.
+        suppressing |= containment_matrix(boxes).T >= containment_threshold
+
+    removed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if removed[i]:
+            continue
+        keep.append(i)
+        removed[i + 1 :] |= suppressing[i, i + 1 :]
+
+    return order[keep]
+
+
+@dataclass(frozen=True)
+class ImageEncoding:
+    """
+    How an image is encoded into a data URL.
+    args:
+        format: PNG and lossless WEBP keep every pixel, JPEG is always lossy
+        lossless: only used by WEBP
+        quality: JPEG and lossy WEBP quality, 0-100
+        compress_level: PNG zlib level 0-9, or WEBP effort 0-6
+    """
+
+    format: Literal["PNG", "WEBP", "JPEG"] = "PNG"
+    lossless: bool = True
+    quality: int = 90
+    compress_level: int = 6
+
+    def __post_init__(self) -> None:
+        if self.format not in ("PNG", "WEBP", "JPEG"):
+            raise ValueError(f"Unsupported image encoding format '{self.format}'")
+
+    def supports_alpha(self) -> bool:
+        return self.format != "JPEG"
 
+    def is_lossless(self) -> bool:
+        return self.format == "PNG" or (self.format == "WEBP" and self.lossless)
 
-def pil_image_to_data_url(image: Image.Image) -> str:
+    def get_save_params(self) -> Dict[str, Any]:
+        if self.format == "PNG":
+            return {"compress_level": self.compress_level}
+        if self.format == "WEBP":
+            return {
+                "lossless": self.lossless,
+                "quality": self.quality,
+                "method": min(self.compress_level, 6),
+            }
+        return {"quality": self.quality}
+
+
+def pil_image_to_data_url(
+    image: Image.Image, encoding: Optional[ImageEncoding] = None
+) -> str:
     image_bytes = BytesIO()
-    image.save(image_bytes, image.format)
-    mimetype = f"image/{image.format.lower()}"
-    base64 = b64encode(image_bytes.getvalue()).decode("utf-8")
+    with span("image_encode", width=image.width, height=image.height):
+        if encoding is None:
+            image_format = image.format or "PNG"
+            image.save(image_bytes, image_format)
+        else:
+            image_format = encoding.format
+            if not encoding.supports_alpha() and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(image_bytes, image_format, **encoding.get_save_params())
+        mimetype = f"image/{image_format.lower()}"
+        base64 = b64encode(image_bytes.getvalue()).decode("utf-8")
     return f"data:{mimetype};base64,{base64}"
 
 
+def is_same_src(src1: str, src2: str) -> bool:
+    """
+    Whether two image srcs are equal. Shared strings are the same object, fresh
+    ones of different lengths differ at once, only equal lengths are compared
+    character by character (a memcmp, far cheaper than hashing both).
+    """
+    return src1 is src2 or src1 == src2
+
+
 def data_url_to_pil_image(data_url: str) -> Image.Image:
-    base64 = data_url[data_url.index(",") + 1 :]
-    image_bytes = BytesIO(b64decode(base64))
-    return Image.open(image_bytes)
+    with span("image_decode", bytes=len(data_url)):
+        base64 = data_url[data_url.index(",") + 1 :]
+        image_bytes = BytesIO(b64decode(base64))
+        image = Image.open(image_bytes)
+        # Decode now rather than on first pixel access, so the span covers it.
+        image.load()
+    return image
+
+
+@lru_cache(maxsize=DECODED_DATA_URL_CACHE_SIZE)
+def decode_data_url_cached(data_url: str) -> Image.Image:
+    """
+    Decoded and loaded image shared between callers, which must not modify it. Every
+    object detected in the same image decodes it only once this way.
+    """
+    return data_url_to_pil_image(data_url)
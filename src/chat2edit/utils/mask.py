@@ -0,0 +1,158 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+EMPTY_BOX = (0, 0, 0, 0)
+
+
+class Mask:
+    """
+    Binary mask stored as a tight bounding box plus the bit-packed pixels inside it.
+    A full-frame uint8 mask of a 12 MP photo takes 12 MB, while a Mask of a typical
+    object takes a few hundred KB at most.
+    args:
+        size: (width, height) of the frame the mask belongs to
+        box: (xmin, ymin, xmax, ymax) of the set pixels, exclusive max
+        bits: np.packbits of the boolean pixels inside the box
+    """
+
+    def __init__(
+        self, size: Tuple[int, int], box: Tuple[int, int, int, int], bits: np.ndarray
+    ) -> None:
+        self.size = size
+        self.box = box
+        self.bits = bits
+
+    @classmethod
+    def empty(cls, size: Tuple[int, int]) -> "Mask":
+        return cls(size, EMPTY_BOX, np.zeros(0, dtype=np.uint8))
+
+    @classmethod
+    def from_array(
+        cls,
+        array: np.ndarray,
+        offset: Tuple[int, int] = (0, 0),
+        size: Optional[Tuple[int, int]] = None,
+    ) -> "Mask":
+        """
+        Build a mask from a 2D array where every nonzero pixel is set. The array is
+        placed at `offset` inside a frame of `size` (defaults to the array size) and
+        clipped to the frame.
+        """
+        if size is None:
+            size = array.shape[1], array.shape[0]
+
+        width, height = size
+        x_offset, y_offset = offset
+        xmin, ymin = max(0, x_offset), max(0, y_offset)
+        xmax = min(width, x_offset + array.shape[1])
+        ymax = min(height, y_offset + array.shape[0])
+        if xmin >= xmax or ymin >= ymax:
+            return cls.empty(size)
+
+        array = array[
+            ymin - y_offset : ymax - y_offset, xmin - x_offset : xmax - x_offset
+        ]
+        return cls._from_crop(size, (xmin, ymin), array != 0)
+
+    @classmethod
+    def _from_crop(
+        cls, size: Tuple[int, int], offset: Tuple[int, int], crop: np.ndarray
+    ) -> "Mask":
+        rows = np.flatnonzero(crop.any(axis=1))
+        if len(rows) == 0:
+            return cls.empty(size)
+
+        cols = np.flatnonzero(crop.any(axis=0))
+        ymin, ymax = rows[0], rows[-1] + 1
+        xmin, xmax = cols[0], cols[-1] + 1
+        crop = crop[ymin:ymax, xmin:xmax]
+        x_offset, y_offset = offset
+        box = (
+            int(x_offset + xmin),
+            int(y_offset + ymin),
+            int(x_offset + xmax),
+            int(y_offset + ymax),
+        )
+        return cls(size, box, np.packbits(crop, axis=None))
+
+    def is_empty(self) -> bool:
+        return self.box == EMPTY_BOX
+
+    def get_box(self) -> Tuple[int, int, int, int]:
+        return self.box
+
+    def get_box_size(self) -> Tuple[int, int]:
+        xmin, ymin, xmax, ymax = self.box
+        return xmax - xmin, ymax - ymin
+
+    def area(self) -> int:
+        return int(np.unpackbits(self.bits).sum())
+
+    def crop(self) -> np.ndarray:
+        """Boolean pixels inside the bounding box."""
+        width, height = self.get_box_size()
+        return (
+            np.unpackbits(self.bits, count=width * height)
+            .reshape(height, width)
+            .astype(bool)
+        )
+
+    def to_array(self, value: int = 255) -> np.ndarray:
+        """Full-frame uint8 mask, only materialize this when a model needs it."""
+        width, height = self.size
+        array = np.zeros((height, width), dtype=np.uint8)
+        return self.paste(array, value)
+
+    def to_pil_image(self) -> Image.Image:
+        """Mode 'L' image of the bounding box region."""
+        return Image.fromarray(self.crop().astype(np.uint8) * 255)
+
+    def paste(self, array: np.ndarray, value: int = 255) -> np.ndarray:
+        """Set the mask pixels to `value` in a full-frame array, in place."""
+        if self.is_empty():
+            return array
+
+        xmin, ymin, xmax, ymax = self.box
+        array[ymin:ymax, xmin:xmax][self.crop()] = value
+        return array
+
+    def union(self, other: "Mask") -> "Mask":
+        if other.is_empty():
+            return self
+        if self.is_empty():
+            return other
+
+        xmin = min(self.box[0], other.box[0])
+        ymin = min(self.box[1], other.box[1])
+        xmax = max(self.box[2], other.box[2])
+        ymax = max(self.box[3], other.box[3])
+        crop = np.zeros((ymax - ymin, xmax - xmin), dtype=bool)
+        for mask in (self, other):
+            mxmin, mymin, mxmax, mymax = mask.box
+            crop[
+                mymin - ymin : mymax - ymin, mxmin - xmin : mxmax - xmin
+            ] |= mask.crop()
+
+        return Mask._from_crop(self.size, (xmin, ymin), crop)
+
+    def dilate(self, iterations: int) -> "Mask":
+        """
+        Same result as a 3x3 cv2.dilate over the full frame, computed only inside the
+        bounding box padded by `iterations` pixels.
+        """
+        if self.is_empty() or iterations <= 0:
+            return self
+
+        width, height = self.size
+        xmin, ymin, xmax, ymax = self.box
+        pxmin, pymin = max(0, xmin - iterations), max(0, ymin - iterations)
+        pxmax, pymax = min(width, xmax + iterations), min(height, ymax + iterations)
+        padded = np.zeros((pymax - pymin, pxmax - pxmin), dtype=np.uint8)
+        padded[ymin - pymin : ymax - pymin, xmin - pxmin : xmax - pxmin] = self.crop()
+        kernel = np.ones((3, 3), np.uint8)
+        dilated = cv2.dilate(padded, kernel, iterations=iterations)
+        return Mask._from_crop(self.size, (pxmin, pymin), dilated != 0)
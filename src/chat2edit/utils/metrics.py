@@ -0,0 +1,172 @@
+import json
+import logging
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+logger = logging.getLogger("chat2edit.trace")
+
+STAGE_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+stage_seconds = None
+# Counters by the name `increment` takes
+counters: Dict[str, Any] = {}
+if prometheus_client is not None:
+    stage_seconds = prometheus_client.Histogram(
+        "chat2edit_stage_seconds",
+        "Duration of each pipeline stage",
+        ["stage"],
+        buckets=STAGE_BUCKETS,
+    )
+    counters["llm_tokens"] = prometheus_client.Counter(
+        "chat2edit_llm_tokens", "Tokens used by LLM calls", ["kind"]
+    )
+    counters["context_reclaimed_bytes"] = prometheus_client.Counter(
+        "chat2edit_context_reclaimed_bytes", "Bytes collected from chat contexts"
+    )
+
+
+@dataclass
+class Trace:
+    name: str
+    attrs: Dict[str, Any]
+    start: float = field(default_factory=time.perf_counter)
+    spans: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace": self.name,
+            **self.attrs,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar(
+    "chat2edit_trace", default=None
+)
+
+
+@contextmanager
+def trace(name: str, **attrs: Any) -> Iterator[Trace]:
+    """
+    Collect the spans of one request and log them as one JSON line at the end.
+    Work the request hands to other threads reports its spans here as long as it
+    is submitted with submit_in_context, or runs in a batch under share_spans.
+    """
+    curr_trace = Trace(name, attrs)
+    token = _current_trace.set(curr_trace)
+    try:
+        yield curr_trace
+    finally:
+        _current_trace.reset(token)
+        logger.info(json.dumps(curr_trace.to_dict(), default=str))
+
+
+def get_current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def submit_in_context(executor: Executor, func: Callable, *args: Any) -> Future:
+    """executor.submit running func in a copy of the caller's context (and trace)."""
+    return executor.submit(copy_context().run, func, *args)
+
+
+@contextmanager
+def share_spans(traces: Iterable[Optional[Trace]], **attrs: Any) -> Iterator[None]:
+    """
+    Add the spans recorded inside the block to each of the traces, for work done
+    on behalf of several requests at once (a batch) on a thread of its own. The
+    spans get `attrs` as well.
+    """
+    shared_trace = Trace("shared", {})
+    token = _current_trace.set(shared_trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+        unique_traces = {id(curr_trace): curr_trace for curr_trace in traces}
+        for curr_trace in unique_traces.values():
+            if curr_trace is None:
+                continue
+
+            offset_ms = (shared_trace.start - curr_trace.start) * 1000
+            curr_trace.spans.extend(
+                {
+                    **shared_span,
+                    "offset_ms": round(shared_span["offset_ms"] + offset_ms, 3),
+                    **attrs,
+                }
+                for shared_span in shared_trace.spans
+            )
+
+
+@contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """Time a pipeline stage. Attributes can be added to the yielded dict."""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        _record_span(stage, start, time.perf_counter() - start, attrs)
+
+
+def _record_span(
+    stage: str, start: float, seconds: float, attrs: Dict[str, Any]
+) -> None:
+    if stage_seconds is not None:
+        stage_seconds.labels(stage=stage).observe(seconds)
+
+    curr_trace = _current_trace.get()
+    if curr_trace is not None:
+        curr_trace.spans.append(
+            {
+                "stage": stage,
+                "offset_ms": round((start - curr_trace.start) * 1000, 3),
+                "duration_ms": round(seconds * 1000, 3),
+                **attrs,
+            }
+        )
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    counter = counters.get(name)
+    if counter is not None:
+        (counter.labels(**labels) if labels else counter).inc(value)
+
+    curr_trace = _current_trace.get()
+    if curr_trace is not None:
+        key = "_".join([name, *labels.values()])
+        curr_trace.attrs[key] = curr_trace.attrs.get(key, 0) + value
+
+
+def get_metrics_text() -> Tuple[bytes, str]:
+    if prometheus_client is None:
+        raise RuntimeError("Metrics need the prometheus_client package")
+
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,149 @@
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+SAMPLE_INTERVAL = 0.001
+MAX_ARTIFACTS_PER_KEY = 20
+ARTIFACT_NAME_PATTERN = re.compile(r"^[0-9TZ-]+\.(html|pstats|json)$")
+UNSAFE_KEY_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class RequestProfiler:
+    """
+    Profiles single requests on demand and stores the results under
+    `directory/<key>/`: a pyinstrument flamegraph (html) when pyinstrument is
+    installed, a cProfile dump (pstats) otherwise, and a json summary with wall
+    and cpu time and the tracemalloc peak. Nothing is set up for requests that
+    are not profiled.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_artifacts_per_key: int = MAX_ARTIFACTS_PER_KEY,
+        sample_interval: float = SAMPLE_INTERVAL,
+    ) -> None:
+        self.directory = directory
+        self.max_artifacts_per_key = max_artifacts_per_key
+        self.sample_interval = sample_interval
+        # tracemalloc is process wide, only one request tracks memory at a time.
+        self._memory_lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, key: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Profile the block, the yielded summary is filled in when it exits."""
+        summary: Dict[str, Any] = {"key": key, **attrs}
+        track_memory = self._memory_lock.acquire(blocking=False)
+        if track_memory:
+            tracemalloc.start()
+
+        profiler = self._start_profiler()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield summary
+        finally:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            elif profiler is not None:
+                profiler.stop()
+            summary["wall_ms"] = round((time.perf_counter() - wall_start) * 1000, 3)
+            summary["cpu_ms"] = round((time.thread_time() - cpu_start) * 1000, 3)
+            summary["tracemalloc_peak_bytes"] = None
+            if track_memory:
+                summary["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self._memory_lock.release()
+            if resource is not None:
+                # Kilobytes on Linux
+                summary["max_rss_kb"] = resource.getrusage(
+                    resource.RUSAGE_SELF
+                ).ru_maxrss
+
+            summary["artifacts"] = self._save(key, profiler, summary)
+
+    def list_artifacts(self, key: str) -> List[str]:
+        key_directory = self._get_key_directory(key)
+        if not os.path.isdir(key_directory):
+            return []
+
+        return sorted(
+            name
+            for name in os.listdir(key_directory)
+            if ARTIFACT_NAME_PATTERN.match(name)
+        )
+
+    def get_artifact_path(self, key: str, name: str) -> Optional[str]:
+        if not ARTIFACT_NAME_PATTERN.match(name):
+            return None
+
+        path = os.path.join(self._get_key_directory(key), name)
+        return path if os.path.isfile(path) else None
+
+    def _start_profiler(self) -> Any:
+        try:
+            if pyinstrument is not None:
+                profiler = pyinstrument.Profiler(interval=self.sample_interval)
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except (RuntimeError, ValueError):
+            # Python 3.12+ allows one cProfile per process, a request profiled
+            # concurrently with another one only gets its summary.
+            return None
+
+        return profiler
+
+    def _get_key_directory(self, key: str) -> str:
+        return os.path.join(self.directory, UNSAFE_KEY_CHARS.sub("_", key))
+
+    def _save(self, key: str, profiler: Any, summary: Dict[str, Any]) -> List[str]:
+        key_directory = self._get_key_directory(key)
+        os.makedirs(key_directory, exist_ok=True)
+        stem = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S-%fZ")
+
+        artifacts = []
+        if isinstance(profiler, cProfile.Profile):
+            artifacts.append(f"{stem}.pstats")
+            profiler.dump_stats(os.path.join(key_directory, artifacts[-1]))
+        elif profiler is not None:
+            artifacts.append(f"{stem}.html")
+            with open(os.path.join(key_directory, artifacts[-1]), "w") as f:
+                f.write(profiler.output_html())
+
+        summary_name = f"{stem}.json"
+        artifacts.append(summary_name)
+        with open(os.path.join(key_directory, summary_name), "w") as f:
+            json.dump({**summary, "artifacts": artifacts}, f, default=str)
+
+        self._prune(key)
+        return artifacts
+
+    def _prune(self, key: str) -> None:
+        stems = sorted({name.split(".")[0] for name in self.list_artifacts(key)})
+        key_directory = self._get_key_directory(key)
+        for stem in stems[: max(len(stems) - self.max_artifacts_per_key, 0)]:
+            for extension in ("html", "pstats", "json"):
+                path = os.path.join(key_directory, f"{stem}.{extension}")
+                if os.path.exists(path):
+                    os.remove(path)
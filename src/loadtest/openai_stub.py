@@ -0,0 +1,120 @@
+"""
+OpenAI compatible chat completions server for load tests. It answers with scripted
+action blocks after a configurable latency. The script step is the number of
+actions since the last user message in the prompt, so every chat walks through the
+script on every turn without the stub keeping any state. Steps past the end of the
+script repeat the last one. Run from the src directory:
+
+    python -m loadtest.openai_stub --port 8001 --latency-ms 800 --jitter-ms 200
+
+and point the app at it with openai.base_url: http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import uvicorn
+import yaml
+from fastapi import FastAPI
+
+from chat2edit.chat2edit import USER_MESSAGE_OBSERVATION
+
+
+# One entry per step, each a block of commands (one per line)
+DEFAULT_SCRIPT = [
+    "objects = detect(image0, 'cat')",
+    "if objects: remove(objects[0], image0)\nresponse('Đã xoá con mèo', [image0])",
+]
+ACTION_TEMPLATE = (
+    "<thinking>\n    Step {step}.\n</thinking>\n<action>\n{commands}\n</action>"
+)
+CHARS_PER_TOKEN = 4
+
+
+def load_script(path: Optional[str]) -> List[str]:
+    if path is None:
+        return DEFAULT_SCRIPT
+
+    with open(path, "r") as f:
+        script = yaml.safe_load(f)
+    if not isinstance(script, list) or not script:
+        raise ValueError(f"The script at {path} must be a non-empty list of actions")
+
+    return [str(action) for action in script]
+
+
+def get_script_step(prompt: str) -> int:
+    turn_start = max(prompt.rfind(USER_MESSAGE_OBSERVATION), 0)
+    return prompt.count("<action>", turn_start)
+
+
+def create_app(
+    script: List[str], latency_ms: float, jitter_ms: float, seed: Optional[int] = None
+) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+
+    @app.get("/health")
+    def health() -> dict:
+        return {"status": "ok"}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Dict[str, Any]) -> dict:
+        messages = request["messages"]
+        step = get_script_step(messages[-1]["content"])
+        commands = script[min(step, len(script) - 1)]
+        content = ACTION_TEMPLATE.format(
+            step=step,
+            commands="\n".join(f"    {command}" for command in commands.split("\n")),
+        )
+        await asyncio.sleep(max(0.0, rng.gauss(latency_ms, jitter_ms)) / 1000)
+
+        prompt_tokens = sum(len(message["content"]) for message in messages)
+        prompt_tokens //= CHARS_PER_TOKEN
+        completion_tokens = len(content) // CHARS_PER_TOKEN
+        return {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--script", help="YAML list of action blocks")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(
+        load_script(args.script), args.latency_ms, args.jitter_ms, args.seed
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Load test one instance of the app with multi-turn chats. Every chat sends its
+turns one after another, carrying the canvases of each response into the next
+request like the frontend does, and `concurrency` chats run at the same time. The
+sweep covers every combination of --concurrency, --sizes and --turns and reports
+throughput, latency percentiles and error rates. Run from the src directory:
+
+    # Against a running app (pointed at loadtest.openai_stub or the real API)
+    python -m loadtest.run --url http://127.0.0.1:8000 --concurrency 1 4 16
+
+    # Start the OpenAI stub and the app with in-process Redis, then run the sweep
+    python -m loadtest.run --launch --config config/my_config.yaml --fake-redis \
+        --latency-ms 800 --concurrency 1 4 16 --sizes 512 2048 --turns 1 3
+
+The app still loads the models of its config, that is the capacity under test.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import uuid4
+
+import httpx
+import numpy as np
+import yaml
+from PIL import Image
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app resolves the relative paths of its config (checkpoints, caches, traces)
+# against the repository root, like when it is started from there.
+ROOT_DIR = os.path.dirname(SRC_DIR)
+INSTRUCTIONS = [
+    "Xoá con mèo",
+    "Di chuyển con chó sang trái",
+    "Tăng độ sáng của ảnh",
+]
+ASPECT_RATIO = 4 / 3
+REQUEST_TIMEOUT = 300.0
+READY_TIMEOUT = 600.0
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class ScenarioResult:
+    concurrency: int
+    size: int
+    turns: int
+    chats: int
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: Dict[str, int] = field(default_factory=dict)
+    duration_s: float = 0.0
+    request_bytes: int = 0
+
+    def add_error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        requests = len(self.latencies_ms)
+        error_count = sum(self.errors.values())
+        latencies = np.array(self.latencies_ms or [0.0])
+        return {
+            "concurrency": self.concurrency,
+            "size": self.size,
+            "turns": self.turns,
+            "chats": self.chats,
+            "requests": requests,
+            "errors": error_count,
+            "error_rate": error_count / requests if requests else 0.0,
+            "error_kinds": self.errors,
+            "duration_s": round(self.duration_s, 3),
+            "throughput_rps": requests / self.duration_s if self.duration_s else 0.0,
+            "mean_ms": float(latencies.mean()),
+            **{
+                f"p{percentile}_ms": float(np.percentile(latencies, percentile))
+                for percentile in PERCENTILES
+            },
+            "max_ms": float(latencies.max()),
+            "mean_request_kb": self.request_bytes / max(requests, 1) / 1024,
+        }
+
+
+def create_image_src(size: int, image_path: Optional[str], seed: int) -> str:
+    width, height = size, int(size / ASPECT_RATIO)
+    if image_path is not None:
+        image = Image.open(image_path).convert("RGB").resize((width, height))
+    else:
+        # Gradient plus noise, compresses about like a photo
+        rng = np.random.default_rng(seed)
+        xs = np.linspace(0, 255, width, dtype=np.float32)
+        ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        pixels = np.stack([xs + 0 * ys, ys + 0 * xs, (xs + ys) / 2], axis=-1)
+        pixels += rng.normal(0, 8, pixels.shape).astype(np.float32)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    image_bytes = BytesIO()
+    image.save(image_bytes, "PNG")
+    return "data:image/png;base64," + b64encode(image_bytes.getvalue()).decode()
+
+
+def create_canvas(src: str, size: int) -> Dict[str, Any]:
+    return {
+        "id": uuid4().hex,
+        "objects": [],
+        "backgroundImage": {
+            "type": "image",
+            "width": size,
+            "height": int(size / ASPECT_RATIO),
+            "src": src,
+            "filename": "image.png",
+        },
+    }
+
+
+async def run_chat(
+    client: httpx.AsyncClient,
+    url: str,
+    src: str,
+    result: ScenarioResult,
+    think_ms: float,
+) -> None:
+    chat_id = uuid4().hex
+    canvases = [create_canvas(src, result.size)]
+    for turn in range(result.turns):
+        body = json.dumps(
+            {
+                "chat_id": chat_id,
+                "instruction": INSTRUCTIONS[turn % len(INSTRUCTIONS)],
+                "canvases": canvases,
+            }
+        )
+        result.request_bytes += len(body)
+        start = time.perf_counter()
+        try:
+            response = await client.post(
+                f"{url}/edit",
+                content=body,
+                headers={"Content-Type": "application/json"},
+            )
+        except httpx.HTTPError as e:
+            result.latencies_ms.append((time.perf_counter() - start) * 1000)
+            result.add_error(type(e).__name__)
+            return
+
+        result.latencies_ms.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            result.add_error(f"http_{response.status_code}")
+            return
+
+        response_body = response.json()
+        if response_body["status"] != "success":
+            result.add_error("fail")
+        elif response_body["canvases"]:
+            canvases = response_body["canvases"]
+        if think_ms > 0:
+            await asyncio.sleep(think_ms / 1000)
+
+
+async def run_scenario(
+    url: str, src: str, result: ScenarioResult, think_ms: float
+) -> ScenarioResult:
+    semaphore = asyncio.Semaphore(result.concurrency)
+    limits = httpx.Limits(max_connections=result.concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits) as client:
+
+        async def run_limited_chat() -> None:
+            async with semaphore:
+                await run_chat(client, url, src, result, think_ms)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_limited_chat() for _ in range(result.chats)))
+        result.duration_s = time.perf_counter() - start
+
+    return result
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=5.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(1.0)
+
+    raise TimeoutError(f"{url} was not ready after {timeout:.0f}s")
+
+
+@contextmanager
+def launch(args: argparse.Namespace) -> Iterator[str]:
+    """Start the OpenAI stub and the app on a copy of the config pointed at it."""
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    config["openai"].update(
+        {"api_key": "stub", "base_url": f"{stub_url}/v1", "cache": {"mode": "off"}}
+    )
+    if args.fake_redis:
+        config["redis"] = {"url": "fake"}
+
+    config_file = tempfile.NamedTemporaryFile(
+        "w", suffix=".yaml", prefix="loadtest-", delete=False
+    )
+    with config_file:
+        yaml.safe_dump(config, config_file)
+
+    stub_command = [sys.executable, "-m", "loadtest.openai_stub"]
+    stub_command += ["--port", str(args.stub_port)]
+    stub_command += ["--latency-ms", str(args.latency_ms)]
+    stub_command += ["--jitter-ms", str(args.jitter_ms)]
+    if args.script:
+        stub_command += ["--script", args.script]
+    app_command = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", SRC_DIR]
+    app_command += ["--port", str(args.port), "--log-level", "warning"]
+
+    processes = []
+    try:
+        processes.append(subprocess.Popen(stub_command, cwd=SRC_DIR))
+        wait_until_ready(f"{stub_url}/health", processes[-1], READY_TIMEOUT)
+        processes.append(
+            subprocess.Popen(
+                app_command,
+                cwd=ROOT_DIR,
+                env={**os.environ, "CHAT2EDIT_CONFIG": config_file.name},
+            )
+        )
+        app_url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(f"{app_url}/ready", processes[-1], READY_TIMEOUT)
+        yield app_url
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        os.remove(config_file.name)
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['concurrency']:>5}{result['size']:>6}{result['turns']:>6}"
+        f"{result['requests']:>6}{result['throughput_rps']:>8.2f}"
+        f"{result['p50_ms']:>9.0f}{result['p90_ms']:>9.0f}{result['p99_ms']:>9.0f}"
+        f"{result['max_ms']:>9.0f}{result['error_rate']:>8.1%}"
+        f"  {result['error_kinds'] or ''}"
+    )
+
+
+def run_sweep(url: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    print(
+        f"{'conc':>5}{'size':>6}{'turns':>6}{'reqs':>6}{'req/s':>8}"
+        f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}"
+    )
+    results = []
+    for size in args.sizes:
+        src = create_image_src(size, args.image, args.seed)
+        for turns in args.turns:
+            for concurrency in args.concurrency:
+                scenario = ScenarioResult(
+                    concurrency=concurrency,
+                    size=size,
+                    turns=turns,
+                    chats=args.chats or 2 * concurrency,
+                )
+                asyncio.run(run_scenario(url, src, scenario, args.think_ms))
+                results.append(scenario.to_dict())
+                print_result(results[-1])
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024])
+    parser.add_argument("--turns", type=int, nargs="+", default=[3])
+    parser.add_argument(
+        "--chats", type=int, help="Chats per scenario, twice the concurrency if unset"
+    )
+    parser.add_argument("--think-ms", type=float, default=0.0)
+    parser.add_argument("--image", help="Photo to send instead of a synthetic image")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--launch", action="store_true")
+    parser.add_argument("--config", default="config/my_config.yaml")
+    parser.add_argument("--fake-redis", action="store_true")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--script", help="YAML list of action blocks for the stub")
+    args = parser.parse_args()
+
+    if args.launch:
+        with launch(args) as url:
+            results = run_sweep(url, args)
+    else:
+        results = run_sweep(args.url, args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
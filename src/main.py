@@ -1,26 +1,69 @@
-from typing import List, Literal
-from fastapi import FastAPI
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Literal, Optional
+from uuid import uuid4
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import yaml
 import redis
 import pickle
 from chat2edit.chat2edit import Chat2Edit
 from chat2edit.core.chat_state import ChatState
-from chat2edit.core.message import UserMessage
+from chat2edit.core.context_gc import ContextGCPolicy, RedisColdStorage
+from chat2edit.core.exec_limits import ExecLimits
+from chat2edit.core.executor import Executor
+from chat2edit.core.llm_cache import FileLLMCache, RedisLLMCache
+from chat2edit.core.message import SysMessage, UserMessage
+from chat2edit.core.trace_log import TraceLog, TurnRecord, record_turn
+from chat2edit.fabric.fabric_diff import diff_canvas, snapshot_canvas
+from chat2edit.fabric.fabric_history import CanvasHistory
 from chat2edit.fabric.fabric_method_provider import FabricMethodProvider
 from chat2edit.fabric.fabric_models import FabricCanvas
-from chat2edit.core.open_ai_llm import OpenAILLM
-from chat2edit.tools.grounded_sam import GroundedSAM
-from chat2edit.tools.lama_inpainter import LaMaInpainter
+from chat2edit.fabric.fabric_renderer import CanvasRenderer
+from chat2edit.tools.lazy import (
+    LazyInpainter,
+    LazyModel,
+    LazySegmenter,
+    create_inpainter_warmup,
+    create_segmenter_warmup,
+    get_model_states,
+)
+from chat2edit.tools.precompute import Precomputer
 from chat2edit.tools.toolkit import Toolkit
+from chat2edit.utils.image import ImageEncoding
+from chat2edit.utils.metrics import get_current_trace, get_metrics_text, span, trace
+from chat2edit.utils.profiling import RequestProfiler
+
+CONFIG_PATH = os.environ.get("CHAT2EDIT_CONFIG", "src/config/my_config.yaml")
 
-with open("src/config/my_config.yaml", "r") as f:
+with open(CONFIG_PATH, "r") as f:
     config = yaml.safe_load(f)
 
 
+logging.basicConfig(
+    level=config.get("logging", {}).get("level", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
 app = FastAPI()
-rd = redis.Redis()
+
+
+def create_redis() -> redis.Redis:
+    redis_url = config.get("redis", {}).get("url")
+    if redis_url == "fake":
+        # In-process stand-in for load tests and local runs without a server
+        import fakeredis
+
+        return fakeredis.FakeRedis()
+    if redis_url:
+        return redis.Redis.from_url(redis_url)
+    return redis.Redis()
+
+
+rd = create_redis()
 
 
 frontend_origin = config["frontend"]["origin"]
@@ -29,32 +72,145 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=[frontend_origin],
     allow_credentials=True,
-    allow_methods=["POST"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
-grounded_sam = GroundedSAM(
-    gdino_checkpoint=config["tools"]["groundingdino"]["checkpoint"],
-    gdino_config=config["tools"]["groundingdino"]["config"],
-    gdino_device=config["tools"]["groundingdino"]["device"],
-    sam_checkpoint=config["tools"]["sam"]["checkpoint"],
-    sam_model_type=config["tools"]["sam"]["model_type"],
-    sam_device=config["tools"]["sam"]["device"],
+
+threads_config = config["tools"].get("threads", {})
+
+
+def configure_tool_threads():
+    from chat2edit.tools.backends import configure_threads
+
+    configure_threads(threads_config.get("intra_op"), threads_config.get("inter_op"))
+
+
+def create_grounded_sam():
+    from chat2edit.tools.grounded_sam import (
+        CONTAINMENT_THRESHOLD,
+        NMS_IOU_THRESHOLD,
+        GroundedSAM,
+    )
+
+    gdino_config = config["tools"]["groundingdino"]
+    configure_tool_threads()
+    return GroundedSAM(
+        gdino_checkpoint=config["tools"]["groundingdino"]["checkpoint"],
+        gdino_config=config["tools"]["groundingdino"]["config"],
+        gdino_device=config["tools"]["groundingdino"]["device"],
+        sam_checkpoint=config["tools"]["sam"]["checkpoint"],
+        sam_model_type=config["tools"]["sam"]["model_type"],
+        sam_device=config["tools"]["sam"]["device"],
+        gdino_backend=config["tools"]["groundingdino"].get("backend", "eager"),
+        sam_backend=config["tools"]["sam"].get("backend", "eager"),
+        sam_onnx_path=config["tools"]["sam"].get("onnx_path"),
+        intra_op_threads=threads_config.get("intra_op"),
+        inter_op_threads=threads_config.get("inter_op"),
+        proxy_max_size=config["tools"]["sam"].get("proxy_max_size"),
+        # Only an explicit null disables the suppression
+        nms_iou_threshold=gdino_config.get("nms_iou_threshold", NMS_IOU_THRESHOLD),
+        containment_threshold=gdino_config.get(
+            "containment_threshold", CONTAINMENT_THRESHOLD
+        ),
+        embedding_cache_size=config["tools"]["sam"].get("embedding_cache_size", 4),
+    )
+
+
+def create_lama_inpainter():
+    from chat2edit.tools.lama_inpainter import LaMaInpainter
+
+    configure_tool_threads()
+    return LaMaInpainter(
+        checkpoint=config["tools"]["lama"]["checkpoint"],
+        device=config["tools"]["lama"]["device"],
+        backend=config["tools"]["lama"].get("backend", "eager"),
+    )
+
+
+warmup_config = config["tools"].get("warmup", {})
+warmup_enabled = warmup_config.get("enabled", False)
+warmup_image_size = warmup_config.get("image_size", 512)
+load_timeout = config["tools"].get("load_timeout")
+grounded_sam = LazyModel(
+    "grounded_sam",
+    create_grounded_sam,
+    warmup=create_segmenter_warmup(warmup_image_size) if warmup_enabled else None,
+    load_timeout=load_timeout,
+)
+lama_inpainter = LazyModel(
+    "lama_inpainter",
+    create_lama_inpainter,
+    warmup=create_inpainter_warmup(warmup_image_size) if warmup_enabled else None,
+    load_timeout=load_timeout,
 )
+models = [grounded_sam, lama_inpainter]
+for model in models:
+    model.start()
 
-lama_inpainter = LaMaInpainter(
-    checkpoint=config["tools"]["lama"]["checkpoint"],
-    device=config["tools"]["lama"]["device"],
+llm_cache_config = config["openai"].get("cache", {})
+llm_cache_mode = llm_cache_config.get("mode", "off")
+llm_cache = None
+if llm_cache_mode != "off":
+    if llm_cache_config.get("backend", "file") == "redis":
+        llm_cache = RedisLLMCache(rd)
+    else:
+        llm_cache = FileLLMCache(llm_cache_config["directory"])
+
+encoding_config = config.get("encoding", {})
+encoding_policy = {
+    role: ImageEncoding(**params)
+    for role, params in encoding_config.get("roles", {}).items()
+}
+
+context_gc_config = config.get("context_gc", {})
+context_gc_policy = None
+context_cold_storage = None
+if context_gc_config.get("enabled", False):
+    context_gc_policy = ContextGCPolicy(
+        window_turns=context_gc_config.get("window_turns", 3),
+        action=context_gc_config.get("action", "spill"),
+    )
+    context_cold_storage = RedisColdStorage(rd, ttl=context_gc_config.get("spill_ttl"))
+
+batching_config = config["tools"].get("batching", {})
+toolkit = Toolkit(
+    segmenter=LazySegmenter(grounded_sam),
+    inpainter=LazyInpainter(lama_inpainter),
+    max_batch_size=batching_config.get("max_batch_size", 1),
+    max_wait_ms=batching_config.get("max_wait_ms", 5.0),
 )
+precompute_config = config["tools"].get("precompute", {})
+precomputer = None
+if precompute_config.get("enabled", False):
+    precomputer = Precomputer(
+        toolkit,
+        idle_timeout=precompute_config.get("idle_timeout", 30.0),
+        workers=precompute_config.get("workers", 1),
+    )
 
-toolkit = Toolkit(segmenter=grounded_sam, inpainter=lama_inpainter)
-method_provider = FabricMethodProvider(toolkit=toolkit)
-llm = OpenAILLM(api_key=config["openai"]["api_key"], model=config["openai"]["model"])
+method_provider = FabricMethodProvider(
+    toolkit=toolkit,
+    encoding_policy=encoding_policy,
+    encoding_workers=encoding_config.get("workers", 4),
+    precomputer=precomputer,
+)
+executor_config = config.get("executor", {})
+exec_limits = ExecLimits(
+    timeout=executor_config.get("command_timeout"),
+    max_memory_mb=executor_config.get("max_memory_mb"),
+)
 chat2edit = Chat2Edit(
     method_provider=method_provider,
     api_key=config["openai"]["api_key"],
     model=config["openai"]["model"],
     prompt_limit=3,
+    llm_cache=llm_cache,
+    llm_cache_mode=llm_cache_mode,
+    context_gc_policy=context_gc_policy,
+    context_cold_storage=context_cold_storage,
+    base_url=config["openai"].get("base_url"),
+    exec_limits=exec_limits,
 )
 
 
@@ -62,35 +218,412 @@ class EditingRequest(BaseModel):
     chat_id: str
     instruction: str
     canvases: List[FabricCanvas]
+    delta: bool = False
 
 
 class EditingResponse(BaseModel):
     response: str
     status: Literal["success", "fail"]
     canvases: List[FabricCanvas]
+    # Only set for delta requests: canvas id -> patches against the sent canvas.
+    # Canvases the client did not send are still returned in full in `canvases`.
+    patches: Dict[str, List[Dict[str, Any]]] = Field(default_factory=dict)
 
 
-@app.post("/edit")
-def edit(request: EditingRequest) -> EditingResponse:
-    pickled_chat_state = rd.get(request.chat_id)
-    chat_state = None
-    if not pickled_chat_state:
-        chat_state = ChatState()
-    else:
-        chat_state = pickle.loads(pickled_chat_state)
+class BulkEditingRequest(BaseModel):
+    instruction: str
+    canvases: List[FabricCanvas]
+    # The canvas the edit is planned on, the plan is then replayed on the others
+    sample_index: int = 0
+
+
+class BulkEditingEvent(BaseModel):
+    event: Literal["plan", "item", "done", "error"]
+    status: Literal["success", "fail"]
+    response: str = ""
+    index: Optional[int] = None
+    completed: int = 0
+    total: int = 0
+    canvases: List[FabricCanvas] = Field(default_factory=list)
+    commands: List[str] = Field(default_factory=list)
+
+
+class RestoreRequest(BaseModel):
+    turn: int
+
+
+class RenderRequest(BaseModel):
+    canvas: FabricCanvas
+    # Longest side of a thumbnail, the canvas renders at full size if unset
+    max_size: Optional[int] = Field(None, gt=0)
+    format: Literal["PNG", "WEBP", "JPEG"] = "PNG"
+    quality: int = Field(90, ge=0, le=100)
+
+
+history_config = config.get("history", {})
+
+render_config = config.get("render", {})
+canvas_renderer = CanvasRenderer(cache_size=render_config.get("cache_size", 64))
+
+trace_log_config = config.get("trace_log", {})
+trace_log = None
+if trace_log_config.get("enabled", False):
+    trace_log = TraceLog(
+        trace_log_config.get("directory", "traces"),
+        store_images=trace_log_config.get("store_images", False),
+        flush_records=trace_log_config.get("flush_records", 50),
+    )
+
+profiling_config = config.get("profiling", {})
+request_profiler = RequestProfiler(
+    profiling_config.get("directory", "profiles"),
+    max_artifacts_per_key=profiling_config.get("max_artifacts_per_chat", 20),
+)
+
+
+def should_profile(x_profile: Optional[str]) -> bool:
+    if profiling_config.get("enabled", False):
+        return True
+
+    return (
+        profiling_config.get("allow_header", False)
+        and x_profile is not None
+        and x_profile.lower() in ("1", "true", "yes")
+    )
+
+
+def load_chat_state(chat_id: str) -> ChatState:
+    with span("redis_load") as attrs:
+        pickled_chat_state = rd.get(chat_id)
+        if not pickled_chat_state:
+            return ChatState()
+
+        attrs["bytes"] = len(pickled_chat_state)
+        return pickle.loads(pickled_chat_state)
+
+
+def save_chat_state(chat_id: str, chat_state: ChatState) -> None:
+    with span("redis_save") as attrs:
+        pickled_chat_state = pickle.dumps(chat_state)
+        attrs["bytes"] = len(pickled_chat_state)
+        rd.set(chat_id, pickled_chat_state)
+
+
+def record_history(
+    chat_state: ChatState, canvases: List[FabricCanvas], baseline: bool = False
+) -> None:
+    if not history_config.get("enabled", False):
+        return
+
+    if chat_state.history is None:
+        chat_state.history = CanvasHistory(history_config.get("max_versions"))
+    if baseline:
+        chat_state.history.record_baseline(canvases)
+        return
+
+    # The attachments are usually the very canvases the request sent.
+    chat_state.history.record({canvas.id: canvas for canvas in canvases}.values())
+
+
+def get_history(chat_id: str) -> CanvasHistory:
+    history = load_chat_state(chat_id).history
+    if history is None:
+        raise HTTPException(status_code=404, detail="The chat has no history")
+
+    return history
+
+
+bulk_config = config.get("bulk", {})
+bulk_executor = ThreadPoolExecutor(
+    max_workers=bulk_config.get("workers", 4), thread_name_prefix="bulk-edit"
+)
+
+
+def replay_edit(commands: List[str], name: str, canvas: FabricCanvas) -> Dict[str, Any]:
+    executor = Executor(method_provider.fork(), exec_limits)
+    exec_message = executor.replay(commands, {name: canvas})
+    if exec_message is not None and exec_message.status == "error":
+        return {"status": "fail", "response": exec_message.text, "canvases": []}
+
+    if exec_message is not None and exec_message.sys_message:
+        sys_message = exec_message.sys_message
+        return {
+            "status": sys_message.status,
+            "response": sys_message.text,
+            "canvases": sys_message.attachments or [canvas],
+        }
+
+    return {"status": "success", "response": "", "canvases": [canvas]}
+
+
+def stream_bulk_edit(request: BulkEditingRequest) -> Iterator[str]:
+    total = len(request.canvases)
+    sample = request.canvases[request.sample_index]
+    chat_state = ChatState()
     user_message = UserMessage(
-        chat_id=request.chat_id, text=request.instruction, attachments=request.canvases
+        chat_id=f"bulk-{uuid4()}", text=request.instruction, attachments=[sample]
     )
     sys_message = chat2edit(chat_state, user_message)
+    commands = chat_state.curr_commands
+    plan_event = BulkEditingEvent(
+        event="plan",
+        status=sys_message.status,
+        response=sys_message.text,
+        commands=commands,
+        total=total,
+    )
+    yield plan_event.model_dump_json() + "\n"
+    if sys_message.status != "success":
+        return
+
+    sample_event = BulkEditingEvent(
+        event="item",
+        status="success",
+        response=sys_message.text,
+        index=request.sample_index,
+        completed=1,
+        total=total,
+        canvases=sys_message.attachments or [sample],
+    )
+    yield sample_event.model_dump_json() + "\n"
+
+    # The plan addresses the sample through the variable it was attached as.
+    name = next(
+        (name for name, value in chat_state.context.items() if value is sample), None
+    )
+    if name is None:
+        # The plan rebound the variable, or it was collected
+        error_event = BulkEditingEvent(
+            event="error",
+            status="fail",
+            response="The plan no longer refers to the sample canvas by a variable, "
+            "it can not be replayed on the other canvases",
+            completed=1,
+            total=total,
+        )
+        yield error_event.model_dump_json() + "\n"
+        return
+
+    futures = {
+        bulk_executor.submit(replay_edit, commands, name, canvas): index
+        for index, canvas in enumerate(request.canvases)
+        if index != request.sample_index
+    }
+    succeeded = 1
+    for completed, future in enumerate(as_completed(futures), 2):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"status": "fail", "response": str(e), "canvases": []}
+        succeeded += result["status"] == "success"
+        item_event = BulkEditingEvent(
+            event="item",
+            index=futures[future],
+            completed=completed,
+            total=total,
+            **result,
+        )
+        yield item_event.model_dump_json() + "\n"
+
+    done_event = BulkEditingEvent(
+        event="done",
+        status="success" if succeeded == total else "fail",
+        response=f"{succeeded} of {total} canvases edited",
+        completed=total,
+        total=total,
+    )
+    yield done_event.model_dump_json() + "\n"
+
+
+def record_turn_result(
+    turn_record: TurnRecord, chat_state: ChatState, sys_message: SysMessage
+) -> None:
+    turn_record.stop_timer()
+    turn_record.data["final"] = turn_record.get_prompt_delta(chat_state.curr_prompt)
+    turn_record.data["status"] = sys_message.status
+    turn_record.data["response"] = sys_message.text
+    turn_record.data["output_canvases"] = trace_log.dump_canvases(
+        sys_message.attachments
+    )
+    curr_trace = get_current_trace()
+    if curr_trace is not None:
+        turn_record.data["spans"] = list(curr_trace.spans)
+
+
+def create_editing_response(**fields: Any) -> Response:
+    # Serialize straight to JSON, FastAPI would dump the canvases to dicts, validate
+    # those into new models and serialize the copies.
+    with span("response_serialize") as attrs:
+        response = EditingResponse(**fields)
+        content = response.model_dump_json()
+        attrs["bytes"] = len(content)
+    return Response(content=content, media_type="application/json")
+
+
+@app.get("/health")
+def health() -> dict:
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready() -> JSONResponse:
+    models_ready = all(model.is_ready() for model in models)
+    require_models = config["server"].get("require_models_for_readiness", False)
+    status_code = 503 if require_models and not models_ready else 200
+    return JSONResponse(
+        status_code=status_code,
+        content={"ready": models_ready, "models": get_model_states(models)},
+    )
+
 
-    pickled_chat_state = pickle.dumps(chat_state)
-    rd.set(request.chat_id, pickled_chat_state)
+@app.get("/metrics")
+def metrics() -> Response:
+    try:
+        content, content_type = get_metrics_text()
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
 
-    return EditingResponse(
+    return Response(content=content, media_type=content_type)
+
+
+@app.post("/edit", response_model=EditingResponse)
+def edit(request: EditingRequest, x_profile: Optional[str] = Header(None)) -> Response:
+    with trace("edit", chat_id=request.chat_id, canvases=len(request.canvases)):
+        if not should_profile(x_profile):
+            return run_edit(request)
+
+        with request_profiler.profile(request.chat_id, route="edit") as summary:
+            response = run_edit(request)
+        response.headers["X-Profile-Artifacts"] = ",".join(summary["artifacts"])
+        return response
+
+
+def run_edit(request: EditingRequest) -> Response:
+    chat_state = load_chat_state(request.chat_id)
+    request_snapshots = {}
+    if request.delta:
+        request_snapshots = {
+            canvas.id: snapshot_canvas(canvas) for canvas in request.canvases
+        }
+    # chat2edit edits the request canvases in place, the first turn of a chat
+    # records them as they were sent first.
+    record_history(chat_state, request.canvases, baseline=True)
+    user_message = UserMessage(
+        chat_id=request.chat_id, text=request.instruction, attachments=request.canvases
+    )
+    with record_turn(
+        trace_log,
+        request.chat_id,
+        request.instruction,
+        request.canvases,
+        chat_state.curr_prompt,
+    ) as turn_record:
+        sys_message = chat2edit(chat_state, user_message)
+        if turn_record is not None:
+            record_turn_result(turn_record, chat_state, sys_message)
+    record_history(chat_state, request.canvases + sys_message.attachments)
+    save_chat_state(request.chat_id, chat_state)
+
+    if not request.delta:
+        return create_editing_response(
+            response=sys_message.text,
+            status=sys_message.status,
+            canvases=sys_message.attachments,
+        )
+
+    canvases = []
+    patches = {}
+    for canvas in sys_message.attachments:
+        if canvas.id in request_snapshots:
+            patches[canvas.id] = diff_canvas(request_snapshots[canvas.id], canvas)
+        else:
+            canvases.append(canvas)
+
+    return create_editing_response(
         response=sys_message.text,
         status=sys_message.status,
-        canvases=sys_message.attachments,
+        canvases=canvases,
+        patches=patches,
+    )
+
+
+@app.post("/bulk-edit")
+def bulk_edit(request: BulkEditingRequest) -> StreamingResponse:
+    if not 0 <= request.sample_index < len(request.canvases):
+        raise HTTPException(status_code=422, detail="sample_index is out of range")
+
+    return StreamingResponse(
+        stream_bulk_edit(request), media_type="application/x-ndjson"
+    )
+
+
+@app.post("/render")
+def render(request: RenderRequest) -> Response:
+    encoding = ImageEncoding(
+        format=request.format, lossless=False, quality=request.quality
     )
+    with trace("render", canvas=request.canvas.id, max_size=request.max_size):
+        content = canvas_renderer.render_encoded(
+            request.canvas, request.max_size, encoding
+        )
+    return Response(content=content, media_type=f"image/{request.format.lower()}")
+
+
+@app.get("/history/{chat_id}")
+def history(chat_id: str) -> dict:
+    versions = get_history(chat_id)
+    return {
+        "turns": [
+            {"turn": turn, "canvases": list(versions.get_version(turn))}
+            for turn in versions.get_turns()
+        ]
+    }
+
+
+@app.get("/history/{chat_id}/diff")
+def diff_history(chat_id: str, from_turn: int, to_turn: int) -> dict:
+    versions = get_history(chat_id)
+    try:
+        return {"patches": versions.diff(from_turn, to_turn)}
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@app.post("/history/{chat_id}/restore", response_model=EditingResponse)
+def restore_history(chat_id: str, request: RestoreRequest) -> Response:
+    chat_state = load_chat_state(chat_id)
+    if chat_state.history is None:
+        raise HTTPException(status_code=404, detail="The chat has no history")
+
+    try:
+        canvases = chat_state.history.restore(request.turn)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+    # Variables holding a restored canvas now point at its restored copy, the
+    # restore itself becomes the latest turn so it can be undone as well.
+    id_to_canvas = {canvas.id: canvas for canvas in canvases}
+    for name, value in chat_state.context.items():
+        if isinstance(value, FabricCanvas) and value.id in id_to_canvas:
+            chat_state.context[name] = id_to_canvas[value.id]
+    chat_state.history.record(canvases)
+    save_chat_state(chat_id, chat_state)
+
+    return create_editing_response(response="", status="success", canvases=canvases)
+
+
+@app.get("/profiles/{chat_id}")
+def profiles(chat_id: str) -> dict:
+    return {"artifacts": request_profiler.list_artifacts(chat_id)}
+
+
+@app.get("/profiles/{chat_id}/{name}")
+def profile_artifact(chat_id: str, name: str) -> FileResponse:
+    path = request_profiler.get_artifact_path(chat_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(path, filename=name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+from typing import Dict, Optional
+
+from PIL import Image
+
+from chat2edit.chat2edit import _estimate_context_value_size, _iter_context_references
+from chat2edit.core.context_gc import ColdStorage, ContextCollector, ContextGCPolicy
+from chat2edit.fabric.fabric_models import FabricCanvas, FabricImage, FabricImageObject
+
+
+class MemoryColdStorage(ColdStorage):
+    def __init__(self) -> None:
+        self.values: Dict[str, bytes] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.values[key] = value
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+
+class Unpicklable:
+    def __reduce__(self):
+        raise AssertionError("evicting must not pickle")
+
+
+def create_context() -> dict:
+    shared = [1, 2, 3]
+    return {"kept": {"items": shared}, "shared": shared, "old": "x" * 1000}
+
+
+def test_evict_keeps_reachable_values_and_estimates_sizes():
+    collector = ContextCollector(ContextGCPolicy(action="evict"))
+    context = create_context()
+    context["unpicklable"] = Unpicklable()
+
+    stats = collector.collect("chat", context, {}, {"kept"})
+    assert sorted(context) == ["kept", "shared"]
+    assert sorted(stats.collected) == ["old", "unpicklable"]
+    assert stats.spilled == []
+    assert stats.reclaimed_bytes > 1000
+
+
+def test_spill_and_restore():
+    storage = MemoryColdStorage()
+    collector = ContextCollector(ContextGCPolicy(), storage)
+    context = create_context()
+    spilled = {}
+
+    stats = collector.collect("chat", context, spilled, {"kept"})
+    assert stats.spilled == ["old"]
+    assert "old" not in context
+    assert list(storage.values) == ["chat:old"]
+
+    assert collector.restore(context, spilled, ["old", "missing"]) == ["old"]
+    assert context["old"] == "x" * 1000
+    assert spilled == {} and storage.values == {}
+
+
+def test_pending_images_are_estimated_without_encoding():
+    image = FabricImage(type="image", width=20, height=10, src="")
+    image.set_pil_image(Image.new("RGBA", (20, 10)))
+    collector = ContextCollector(
+        ContextGCPolicy(action="evict"),
+        get_references=_iter_context_references,
+        get_size=_estimate_context_value_size,
+    )
+
+    stats = collector.collect("chat", {"image": image}, {}, set())
+    assert stats.reclaimed_bytes == 20 * 10 * 4
+    assert image.has_pending_image()
+
+
+def create_canvas() -> FabricCanvas:
+    return FabricCanvas(
+        id="canvas",
+        objects=[
+            FabricImageObject(
+                id="cat",
+                type="image",
+                width=10,
+                height=10,
+                src="data:image/png;base64,",
+                labelToScore={"cat": 0.5},
+            )
+        ],
+        backgroundImage={
+            "type": "image",
+            "width": 100,
+            "height": 100,
+            "src": "data:image/png;base64,",
+            "filename": "image.png",
+        },
+    )
+
+
+def test_values_reaching_live_objects_are_not_spilled():
+    collector = ContextCollector(
+        ContextGCPolicy(), MemoryColdStorage(), _iter_context_references
+    )
+    canvas = create_canvas()
+    context = {"image0": canvas, "cats": [canvas.objects[0]], "count": 1}
+
+    stats = collector.collect("chat", context, {}, {"image0"})
+    assert stats.spilled == ["count"]
+    assert context["cats"][0] is canvas.objects[0]
+
+
+def test_values_sharing_objects_are_restored_together():
+    collector = ContextCollector(
+        ContextGCPolicy(), MemoryColdStorage(), _iter_context_references
+    )
+    canvas = create_canvas()
+    context = {"image0": canvas, "cat0": canvas.objects[0], "other": [1]}
+    spilled = {}
+
+    stats = collector.collect("chat", context, spilled, set())
+    assert sorted(stats.spilled) == ["cat0", "image0", "other"]
+    assert spilled["cat0"] == spilled["image0"] != spilled["other"]
+
+    assert sorted(collector.restore(context, spilled, ["cat0"])) == ["cat0", "image0"]
+    assert spilled == {"other": "chat:other"}
+    context["cat0"].left = 5
+    assert context["image0"].objects[0] is context["cat0"]
+    assert context["image0"].objects[0].left == 5
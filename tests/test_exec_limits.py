@@ -0,0 +1,92 @@
+import sys
+import time
+
+import pytest
+
+from chat2edit.core.exec_limits import (
+    ExecLimitExceeded,
+    ExecLimits,
+    get_rss_bytes,
+    guard_method,
+    limit_command,
+)
+
+
+def run_command(code: str, limits: ExecLimits, context: dict) -> None:
+    with limit_command(limits):
+        exec(compile(code, "<string>", "exec"), context)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "while True: pass",
+        "while True:\n    x = 1",
+        "items = [i for i in range(10**9)]",
+        "def spin():\n    while True: pass\nspin()",
+    ],
+)
+def test_timeout_stops_loops(code):
+    start = time.monotonic()
+    with pytest.raises(ExecLimitExceeded):
+        run_command(code, ExecLimits(timeout=0.1), {})
+
+    assert time.monotonic() - start < 2
+
+
+def test_called_methods_finish_before_the_command_stops():
+    calls = []
+
+    def edit():
+        time.sleep(0.3)
+        calls.append("done")
+
+    context = {"edit": guard_method(edit)}
+    with pytest.raises(ExecLimitExceeded, match="0.1 seconds"):
+        run_command("edit()\nwhile True: pass", ExecLimits(timeout=0.1), context)
+
+    assert calls == ["done"]
+
+
+def test_methods_called_in_a_loop_are_never_interrupted():
+    calls = []
+
+    def edit():
+        calls.append("start")
+        sum(range(1000))
+        calls.append("end")
+
+    context = {"edit": guard_method(edit)}
+    with pytest.raises(ExecLimitExceeded):
+        run_command("while True: edit()", ExecLimits(timeout=0.1), context)
+
+    assert calls[-1] == "end"
+    assert calls.count("start") == calls.count("end")
+
+
+def test_commands_within_the_limits_run():
+    context = {}
+    run_command("total = sum(i for i in range(1000))", ExecLimits(timeout=5), context)
+    assert context["total"] == 499500
+
+    # The watchdog of a finished command leaves later code alone
+    code = "count = 100\nwhile count: count -= 1"
+    run_command(code, ExecLimits(timeout=0.1), context)
+    time.sleep(0.3)
+    assert context["count"] == 0
+
+
+@pytest.mark.skipif(get_rss_bytes() is None, reason="needs /proc")
+def test_memory_growth_stops_the_command():
+    limits = ExecLimits(max_memory_mb=16, memory_check_interval=0.01)
+    context = {"sleep": time.sleep}
+    with pytest.raises(ExecLimitExceeded, match="16 MB"):
+        code = "blocks = []\nwhile True: blocks.append(b'x' * 2**20); sleep(0.001)"
+        run_command(code, limits, context)
+
+    assert 16 <= len(context["blocks"]) < 200
+
+
+def test_commands_run_untraced():
+    with limit_command(ExecLimits(timeout=5)):
+        assert sys.gettrace() is None
@@ -0,0 +1,74 @@
+from chat2edit.fabric.fabric_diff import diff_canvas, snapshot_canvas
+from chat2edit.fabric.fabric_models import FabricCanvas, FabricImageObject
+
+
+def create_object(obj_id: str, left: int = 0) -> FabricImageObject:
+    return FabricImageObject(
+        id=obj_id,
+        type="image",
+        left=left,
+        width=10,
+        height=10,
+        src="data:image/png;base64,",
+        labelToScore={"cat": 0.5},
+    )
+
+
+def create_canvas() -> FabricCanvas:
+    return FabricCanvas(
+        id="canvas",
+        objects=[create_object("a"), create_object("b")],
+        backgroundImage={
+            "type": "image",
+            "width": 100,
+            "height": 100,
+            "src": "data:image/png;base64,",
+            "filename": "image.png",
+        },
+    )
+
+
+def test_unchanged_canvas_has_no_patches():
+    canvas = create_canvas()
+
+    assert diff_canvas(snapshot_canvas(canvas), canvas) == []
+
+
+def test_changed_fields_are_replaced_by_id():
+    canvas = create_canvas()
+    snapshot = snapshot_canvas(canvas)
+    canvas.objects[1].left = 25
+    canvas.backgroundImage.filters.append({"type": "grayscale"})
+
+    assert diff_canvas(snapshot, canvas) == [
+        {
+            "op": "replace",
+            "path": "/backgroundImage/filters",
+            "value": [{"type": "grayscale"}],
+        },
+        {"op": "replace", "path": "/objects/b/left", "value": 25},
+    ]
+
+
+def test_added_and_removed_objects():
+    canvas = create_canvas()
+    snapshot = snapshot_canvas(canvas)
+    canvas.remove(canvas.objects[0])
+    canvas.add(create_object("c", 5))
+
+    patches = diff_canvas(snapshot, canvas)
+    assert patches[0] == {"op": "remove", "path": "/objects/a"}
+    assert patches[1]["op"] == "add"
+    assert patches[1]["path"] == "/objects/c"
+    assert patches[1]["value"]["left"] == 5
+    assert len(patches) == 2
+
+
+def test_reordered_objects():
+    canvas = create_canvas()
+    snapshot = snapshot_canvas(canvas)
+    canvas.objects.reverse()
+
+    assert diff_canvas(snapshot, canvas) == [
+        {"op": "replace", "path": "/objectOrder", "value": ["b", "a"]}
+    ]
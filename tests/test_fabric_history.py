@@ -0,0 +1,63 @@
+from chat2edit.fabric.fabric_history import CanvasHistory
+from chat2edit.fabric.fabric_models import FabricCanvas
+
+SRC = "data:image/png;base64," + "A" * 1000
+
+
+def create_canvas(left: int = 0, src: str = SRC) -> FabricCanvas:
+    # Built from JSON like a request, so every call gives fresh strings.
+    return FabricCanvas.model_validate_json(f"""{{
+            "id": "canvas",
+            "objects": [{{
+                "id": "cat", "type": "image", "left": {left}, "width": 10,
+                "height": 10, "src": "{src}", "labelToScore": {{"cat": 0.5}}
+            }}],
+            "backgroundImage": {{
+                "id": "background", "type": "image", "width": 100, "height": 100, "src": "{src}",
+                "filename": "image.png"
+            }}
+        }}""")
+
+
+def test_unchanged_request_canvases_share_the_snapshot():
+    history = CanvasHistory()
+    first = history.record([create_canvas()])
+    second = history.record([create_canvas()])
+
+    assert history.get_version(second)["canvas"] is history.get_version(first)["canvas"]
+    assert history.diff(first, second) == {}
+
+
+def test_changes_make_new_snapshots():
+    history = CanvasHistory(max_versions=2)
+    history.record([create_canvas()])
+    moved = history.record([create_canvas(left=5)])
+    edited = history.record([create_canvas(left=5, src=SRC[:-1] + "B")])
+
+    assert history.get_turns() == [1, 2]
+    old, new = history.get_version(moved), history.get_version(edited)
+    assert old["canvas"].objects[0] is not new["canvas"].objects[0]
+    patches = history.diff(moved, edited)["canvas"]
+    assert [patch["path"] for patch in patches] == [
+        "/backgroundImage/src",
+        "/objects/cat/src",
+    ]
+
+    restored = history.restore(moved)[0]
+    assert restored.objects[0].left == 5
+    assert restored is not old["canvas"]
+
+
+def test_first_turn_restores_the_canvases_as_sent():
+    history = CanvasHistory()
+    canvas = create_canvas()
+    history.record_baseline([canvas])
+    # The turn edits the request canvas in place
+    canvas.objects[0].left = 5
+    edited = history.record([canvas])
+    history.record_baseline([canvas])
+
+    assert history.get_turns() == [0, 1]
+    assert history.restore(0)[0].objects[0].left == 0
+    patches = history.diff(0, edited)["canvas"]
+    assert [patch["path"] for patch in patches] == ["/objects/cat/left"]
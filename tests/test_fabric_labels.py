@@ -0,0 +1,127 @@
+import unicodedata
+
+import pytest
+
+from chat2edit.fabric.fabric_labels import (
+    FILTER_NAMES,
+    LABEL_STOPWORDS,
+    LABEL_SYNONYMS,
+    get_filter_type,
+    normalize_label,
+    singularize,
+)
+from chat2edit.fabric.fabric_models import FabricCanvas, FabricImageObject
+
+
+@pytest.mark.parametrize(
+    "label, key",
+    [
+        ("Con mèo", "cat"),
+        ("cats", "cat"),
+        ("kitten", "cat"),
+        ("Mèo đen", "black cat"),
+        ("black cats", "black cat"),
+        ("kính", "glasses"),
+        ("xe máy", "motorbike"),
+        ("ô tô", "car"),
+        ("con trai", "boy"),
+        ("dog's", "dog"),
+        # NFD input, as some keyboards send it
+        (unicodedata.normalize("NFD", "con chó"), "dog"),
+        # Words that only differ from a synonym by their diacritics
+        ("con chó lớn", "dog lon"),
+        ("bạn", "ban"),
+        ("cô", "co"),
+        ("ở", "o"),
+        ("tao", "tao"),
+        ("song", "song"),
+        ("category", "category"),
+    ],
+)
+def test_normalize_label(label, key):
+    assert normalize_label(label) == key
+
+
+@pytest.mark.parametrize(
+    "word, singular",
+    [
+        ("cats", "cat"),
+        ("boxes", "box"),
+        ("dishes", "dish"),
+        ("cities", "city"),
+        ("buses", "bus"),
+        ("knives", "knife"),
+        ("series", "series"),
+        ("news", "news"),
+        ("lens", "lens"),
+        ("bus", "bus"),
+        ("analysis", "analysis"),
+        ("canvas", "canvas"),
+        ("atlas", "atlas"),
+        ("dress", "dress"),
+        ("glasses", "glasses"),
+        ("sunglasses", "sunglasses"),
+        ("tomatoes", "tomato"),
+    ],
+)
+def test_singularize(word, singular):
+    assert singularize(word) == singular
+
+
+def test_tables_are_nfc():
+    for word in [*LABEL_STOPWORDS, *LABEL_SYNONYMS, *FILTER_NAMES]:
+        assert unicodedata.normalize("NFC", word) == word
+
+
+@pytest.mark.parametrize(
+    "name, filter_type",
+    [
+        ("blur filter", "blur"),
+        ("tăng độ sáng", "brightness"),
+        ("black and white", "grayscale"),
+        ("đen trắng", "grayscale"),
+        ("blurred", "blur"),
+        ("blurring", "blur"),
+        ("inverted", "invert"),
+        ("brighter", "brightness"),
+        ("pixelation", "pixelate"),
+        ("noisy", "noise"),
+        ("greyed out", "grayscale"),
+        ("blur and invert", None),
+        ("blurred and inverted", None),
+        ("sepia", None),
+    ],
+)
+def test_get_filter_type(name, filter_type):
+    assert get_filter_type(name) == filter_type
+
+
+def test_labels_match_whole_words_only():
+    objects = [
+        FabricImageObject(
+            id=label,
+            type="image",
+            width=10,
+            height=10,
+            src="data:image/png;base64,",
+            labelToScore={label: 0.5},
+        )
+        for label in ("category", "cat", "mèo đen")
+    ]
+    canvas = FabricCanvas(
+        id="canvas",
+        objects=objects,
+        backgroundImage={
+            "type": "image",
+            "width": 100,
+            "height": 100,
+            "src": "data:image/png;base64,",
+            "filename": "image.png",
+        },
+    )
+
+    assert [obj.id for obj in canvas.get_objects_by_label("con mèo")] == ["cat"]
+    assert [obj.id for obj in canvas.get_objects_by_label("black cat")] == ["mèo đen"]
+    assert [obj.id for obj in canvas.get_objects_by_label("đen")] == ["mèo đen"]
+    assert [obj.id for obj in canvas.get_objects_by_label("categories")] == ["category"]
+    assert canvas.get_objects_by_label("cate") == []
@@ -0,0 +1,91 @@
+import copy
+import pickle
+
+import pytest
+
+from chat2edit.fabric.fabric_models import FabricCanvas, FabricImageObject
+
+
+def test_serialization_schema_keeps_image_fields():
+    schema = FabricCanvas.model_json_schema(mode="serialization")
+
+    for name in ("FabricImageObject", "FabricUploadedImage"):
+        properties = schema["$defs"][name]["properties"]
+        assert {"src", "left", "filters"} <= set(properties)
+    assert "labelToScore" in schema["$defs"]["FabricImageObject"]["properties"]
+
+
+def create_object(obj_id: str, label: str = "cat") -> FabricImageObject:
+    return FabricImageObject(
+        id=obj_id,
+        type="image",
+        width=10,
+        height=10,
+        src="data:image/png;base64,",
+        labelToScore={label: 0.5},
+    )
+
+
+def create_canvas(*objects: FabricImageObject) -> FabricCanvas:
+    return FabricCanvas(
+        id="canvas",
+        objects=list(objects),
+        backgroundImage={
+            "type": "image",
+            "width": 100,
+            "height": 100,
+            "src": "data:image/png;base64,",
+            "filename": "image.png",
+        },
+    )
+
+
+def get_ids(objects) -> list:
+    return [obj.id for obj in objects]
+
+
+def test_index_follows_add_and_remove():
+    canvas = create_canvas(create_object("a"), create_object("b", "dog"))
+    canvas.add(create_object("c", "black cat"))
+
+    assert canvas.contains(create_object("c"))
+    assert get_ids(canvas.get_objects_by_label("cat")) == ["a"]
+    assert get_ids(canvas.get_objects_by_label("black")) == ["c"]
+
+    canvas.remove(canvas.objects[0])
+    assert get_ids(canvas.objects) == ["b", "c"]
+    assert not canvas.contains(create_object("a"))
+    # No "cat" left, the black one is found by its words
+    assert get_ids(canvas.get_objects_by_label("cat")) == ["c"]
+    assert canvas.get_object("c") is canvas.objects[1]
+    with pytest.raises(ValueError):
+        canvas.remove(create_object("a"))
+
+
+def test_index_follows_changes_behind_its_back():
+    canvas = create_canvas(create_object("a"), create_object("b", "dog"))
+    assert canvas.contains(create_object("a"))
+
+    canvas.objects[0] = create_object("c", "bird")
+    assert not canvas.contains(create_object("a"))
+    assert get_ids(canvas.get_objects_by_label("bird")) == ["c"]
+    assert canvas.get_objects_by_label("cat") == []
+
+    canvas.objects.reverse()
+    assert canvas.get_object("c") is canvas.objects[1]
+    canvas.remove(canvas.objects[0])
+    assert get_ids(canvas.objects) == ["c"]
+
+    canvas.objects = [create_object("d")]
+    assert get_ids(canvas.get_objects_by_label("cat")) == ["d"]
+
+
+def test_index_survives_pickle_and_copy():
+    canvas = create_canvas(create_object("a"), create_object("b", "dog"))
+    canvas.contains(create_object("a"))
+
+    for copied in (pickle.loads(pickle.dumps(canvas)), copy.deepcopy(canvas)):
+        copied.remove(copied.objects[0])
+        assert get_ids(copied.get_objects_by_label("dog")) == ["b"]
+        assert not copied.contains(create_object("a"))
+    assert get_ids(canvas.objects) == ["a", "b"]
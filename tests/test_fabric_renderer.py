@@ -0,0 +1,85 @@
+import numpy as np
+from PIL import Image
+
+from chat2edit.fabric.fabric_models import FabricCanvas
+from chat2edit.fabric.fabric_renderer import CanvasRenderer
+from chat2edit.utils.image import pil_image_to_data_url
+
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+
+
+def create_canvas(pixels: np.ndarray, size: int = 8, **attrs) -> FabricCanvas:
+    background = Image.new("RGB", (size, size), WHITE)
+    image = Image.fromarray(pixels.astype(np.uint8), "RGB")
+    return FabricCanvas.model_validate(
+        {
+            "id": "canvas",
+            "objects": [
+                {
+                    "type": "image",
+                    "width": image.width,
+                    "height": image.height,
+                    "src": pil_image_to_data_url(image),
+                    "labelToScore": {"object": 1.0},
+                    **attrs,
+                }
+            ],
+            "backgroundImage": {
+                "type": "image",
+                "width": size,
+                "height": size,
+                "src": pil_image_to_data_url(background),
+                "filename": "background.png",
+            },
+        }
+    )
+
+
+def render(canvas: FabricCanvas) -> np.ndarray:
+    return np.asarray(CanvasRenderer().render(canvas), dtype=int)
+
+
+def create_gradient(width: int, height: int) -> np.ndarray:
+    # Every pixel a different color
+    xs, ys = np.meshgrid(np.arange(width), np.arange(height))
+    return np.stack([xs * 40, ys * 40, np.full_like(xs, 200)], axis=-1)
+
+
+def test_flip_mirrors_the_pixels_in_place():
+    pixels = create_gradient(4, 3)
+    rendered = render(create_canvas(pixels, left=2, top=1, flipX=True, flipY=True))
+
+    assert np.array_equal(rendered[1:4, 2:6], pixels[::-1, ::-1])
+    assert np.all(rendered[:, :2] == WHITE)
+
+
+def test_rotation_lands_on_whole_pixels():
+    # 90 degrees clockwise around the origin, left moves it back into view
+    pixels = create_gradient(4, 3)
+    rendered = render(create_canvas(pixels, left=5, top=1, angle=90))
+
+    assert np.array_equal(rendered[1:5, 2:5], np.rot90(pixels, k=-1))
+    assert np.all(rendered[:, 5:] == WHITE)
+    assert np.all(rendered[0] == WHITE)
+
+
+def test_scale_keeps_the_image_centered():
+    pixels = np.array([[RED, RED, BLUE, BLUE]] * 4)
+    rendered = render(create_canvas(pixels, scaleX=2, scaleY=2))
+
+    # The red/blue edge sits in the middle, blended the same on both sides
+    row = rendered[4]
+    assert np.array_equal(row[1:3], [RED, RED])
+    assert np.array_equal(row[5:7], [BLUE, BLUE])
+    assert np.allclose(row[3], row[4][::-1], atol=1)
+    assert row[3][0] > row[3][2]
+
+
+def test_opacity_blends_over_the_background():
+    pixels = np.array([[RED] * 2] * 2)
+    rendered = render(create_canvas(pixels, left=1, top=1, opacity=0.5))
+
+    assert np.allclose(rendered[1:3, 1:3], (255, 128, 128), atol=1)
+    assert np.all(rendered[0] == WHITE)
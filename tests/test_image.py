@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from chat2edit.utils.image import (
+    expand_mask,
+    expand_mask_region,
+    image_to_mask,
+    image_to_mask_region,
+    iou_matrix,
+    is_same_src,
+    nms,
+    post_process_mask,
+    post_process_mask_region,
+    refine_mask_boundary,
+)
+
+
+def create_mask() -> np.ndarray:
+    mask = np.zeros((60, 80), np.uint8)
+    mask[10:40, 20:50] = 255
+    mask[15, 60] = 255
+    return mask
+
+
+def test_expand_mask_region_matches_expand_mask():
+    mask = create_mask()
+    expected = expand_mask(mask, 5)
+
+    assert np.array_equal(expand_mask_region(mask, 5), expected)
+    assert np.array_equal(expand_mask_region(mask != 0, 5), expected != 0)
+    out = np.full_like(mask, 7)
+    assert expand_mask_region(mask, 5, out) is out
+    assert np.array_equal(out, expected)
+
+
+def test_post_process_mask_region_matches_post_process_mask():
+    mask = create_mask()
+
+    assert np.array_equal(post_process_mask_region(mask), post_process_mask(mask))
+    assert not post_process_mask_region(np.zeros_like(mask)).any()
+
+
+def test_image_to_mask_region_matches_image_to_mask():
+    alpha = np.zeros((30, 40), np.uint8)
+    alpha[5:20, 10:30] = np.arange(20, dtype=np.uint8)
+    image = Image.fromarray(np.dstack([np.full((30, 40, 3), 90, np.uint8), alpha]))
+
+    assert np.array_equal(image_to_mask_region(image), image_to_mask(image))
+    rgb_image = image.convert("RGB")
+    assert np.array_equal(image_to_mask_region(rgb_image), image_to_mask(rgb_image))
+    gray_image = image.convert("L")
+    assert np.array_equal(image_to_mask_region(gray_image), image_to_mask(gray_image))
+    with pytest.raises(ValueError):
+        image_to_mask_region(image, np.zeros((30, 40), np.int32))
+
+
+def test_iou_matrix():
+    boxes = np.array([[0, 0, 9, 9], [0, 0, 9, 4], [20, 20, 29, 29]])
+    ious = iou_matrix(boxes)
+
+    assert ious[0, 0] == 1.0
+    assert ious[0, 1] == pytest.approx(0.5)
+    assert ious[0, 2] == 0.0
+    assert np.array_equal(ious, ious.T)
+
+
+def test_nms_keeps_best_of_overlapping_boxes():
+    boxes = np.array([[0, 0, 9, 9], [1, 1, 10, 10], [50, 50, 60, 60]])
+    scores = np.array([0.6, 0.9, 0.5])
+
+    assert nms(boxes, scores, 0.5).tolist() == [1, 2]
+    assert nms(boxes, scores, 0.95).tolist() == [1, 0, 2]
+
+
+def test_nms_containment():
+    boxes = np.array([[0, 0, 99, 99], [10, 10, 29, 29]])
+    scores = np.array([0.9, 0.8])
+
+    assert nms(boxes, scores, 0.5).tolist() == [0, 1]
+    assert nms(boxes, scores, 0.5, containment_threshold=0.9).tolist() == [0]
+
+
+def test_nms_empty():
+    assert nms(np.zeros((0, 4)), np.zeros(0), 0.5).tolist() == []
+
+
+def test_refine_mask_boundary_snaps_to_edges():
+    # A wobbly shape whose coarse mask comes from a 4x smaller proxy
+    height, width = 300, 400
+    ys, xs = np.mgrid[:height, :width]
+    angles = np.arctan2(ys - 150, xs - 200)
+    truth = np.hypot(ys - 150, xs - 200) < 100 + 8 * np.sin(angles * 11)
+    noise = np.random.default_rng(0).normal(0, 10, truth.shape)
+    guide = np.clip(np.where(truth, 170, 80) + noise, 0, 255).astype(np.uint8)
+    coarse = cv2.resize(
+        truth.astype(np.float32), (100, 75), interpolation=cv2.INTER_AREA
+    )
+    probabilities = (255 / (1 + np.exp(-(coarse - 0.5) * 20))).astype(np.uint8)
+    probabilities = cv2.resize(probabilities, (width, height))
+
+    refined = refine_mask_boundary(probabilities, guide, 8, 1e-3)
+    upsampled = probabilities > 127
+    assert (upsampled != truth).sum() > 300
+    assert ((refined != 0) != truth).sum() < 20
+    # Far from the boundary nothing changes
+    far = cv2.erode(upsampled.astype(np.uint8), np.ones((41, 41))) != 0
+    assert (refined[far] == 255).all()
+    assert not refine_mask_boundary(np.zeros_like(guide), guide, 8, 1e-3).any()
+
+
+def test_is_same_src_compares_contents():
+    src = "data:image/png;base64," + "A" * 1000
+    assert is_same_src(src, src)
+    assert is_same_src(src, "".join(list(src)))
+    assert not is_same_src(src, src[:-1] + "B")
+    assert not is_same_src(src, src[:-1])
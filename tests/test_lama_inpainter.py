@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("iopaint")
+
+from benchmarks.suite import StubSegmenter, create_image, create_stub_lama
+
+
+class PointwiseModel(torch.nn.Module):
+    # Every output pixel depends on its input pixel only, so padding never
+    # changes a result and batched outputs must equal the single ones.
+    def __init__(self) -> None:
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 3, 1)
+
+    def forward(self, image: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        return torch.sigmoid(self.conv(torch.cat([image, mask], dim=1)))
+
+
+@pytest.fixture
+def inpainter():
+    inpainter = create_stub_lama()
+    torch.manual_seed(0)
+    inpainter.model = PointwiseModel().eval()
+    return inpainter
+
+
+def create_inputs(sizes, mode="RGB"):
+    rng = np.random.default_rng(0)
+    images = [create_image(size, rng).convert(mode) for size in sizes]
+    masks = [StubSegmenter()(image, "object")[1][0] for image in images]
+    return images, masks
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_batch_matches_single_calls(inpainter, mode):
+    # Sizes sharing a bucket, one alone in its bucket and one above the resize
+    # limit, which is cropped back and resized to its original size.
+    images, masks = create_inputs([200, 210, 330, 1500], mode)
+    expected = [
+        np.asarray(inpainter(image, mask)) for image, mask in zip(images, masks)
+    ]
+
+    results = inpainter.batch(images, masks)
+    assert [result.size for result in results] == [image.size for image in images]
+    for result, single in zip(results, expected):
+        assert np.abs(np.asarray(result, np.int16) - single).max() <= 1
+
+
+def test_batch_keeps_unmasked_pixels(inpainter):
+    images, masks = create_inputs([256, 256])
+    results = inpainter.batch(images, masks)
+
+    for image, mask, result in zip(images, masks, results):
+        unmasked = mask.dilate(10).to_array() == 0
+        assert np.array_equal(np.asarray(result)[unmasked], np.asarray(image)[unmasked])
@@ -0,0 +1,91 @@
+import pytest
+
+from chat2edit.core.llm_cache import (
+    FileLLMCache,
+    LLMCacheMiss,
+    RedisLLMCache,
+    create_llm_cache_key,
+)
+from chat2edit.core.open_ai_llm import OpenAILLM
+
+MESSAGES = ["Xoá con mèo"]
+
+
+class StubLLM(OpenAILLM):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(api_key="test", model="gpt-4o", **kwargs)
+        self.completions = []
+
+    def _create_completion(self, messages, stop_word) -> str:
+        self.completions.append(messages)
+        return f"response {len(self.completions)}"
+
+
+def test_record_stores_and_replay_reads(tmp_path):
+    cache = FileLLMCache(str(tmp_path))
+    recorder = StubLLM(cache=cache, cache_mode="record")
+
+    assert recorder(MESSAGES, stop_word="</action>") == "response 1"
+    # Record always asks the LLM, and overwrites what it recorded before
+    assert recorder(MESSAGES, stop_word="</action>") == "response 2"
+
+    replayer = StubLLM(cache=FileLLMCache(str(tmp_path)), cache_mode="replay")
+    assert replayer(MESSAGES, stop_word="</action>") == "response 2"
+    assert replayer.completions == []
+
+
+def test_replay_miss_raises_without_calling_the_llm(tmp_path):
+    replayer = StubLLM(cache=FileLLMCache(str(tmp_path)), cache_mode="replay")
+    StubLLM(cache=replayer.cache, cache_mode="record")(MESSAGES)
+
+    with pytest.raises(LLMCacheMiss):
+        replayer(["Xoá con chó"])
+    with pytest.raises(LLMCacheMiss):
+        replayer(MESSAGES, system_message="other")
+    assert replayer.completions == []
+
+
+class DictRedis:
+    def __init__(self) -> None:
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+def test_redis_cache_round_trips_unicode():
+    client = DictRedis()
+    StubLLM(cache=RedisLLMCache(client), cache_mode="record")(MESSAGES)
+
+    (key,) = client.values
+    assert key.startswith("llm_cache:")
+    replayer = StubLLM(cache=RedisLLMCache(client), cache_mode="replay")
+    assert replayer(MESSAGES) == "response 1"
+
+
+def test_off_never_touches_the_cache(tmp_path):
+    llm = StubLLM()
+    assert llm(MESSAGES) == "response 1"
+    assert llm(MESSAGES) == "response 2"
+
+    with pytest.raises(ValueError):
+        StubLLM(cache_mode="replay")
+
+
+def test_cache_key_is_stable():
+    messages = [{"role": "user", "content": "Xoá con mèo"}]
+    key = create_llm_cache_key("gpt-4o", messages, "</action>")
+
+    # Recorded caches stay valid across runs and versions
+    assert key == "caa7f5a69cf963bd7d1023349719770792f7b046c12ea1da3e0c7d562086b1e1"
+    assert key == create_llm_cache_key(
+        "gpt-4o", [{"content": "Xoá con mèo", "role": "user"}], "</action>"
+    )
+    assert key != create_llm_cache_key("gpt-4o", messages, None)
+    assert key != create_llm_cache_key("gpt-4o-mini", messages, "</action>")
+    assert key != create_llm_cache_key(
+        "gpt-4o", messages + [{"role": "assistant", "content": ""}], "</action>"
+    )
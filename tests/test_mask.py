@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+from chat2edit.utils.mask import EMPTY_BOX, Mask
+
+
+def create_array(seed: int = 0, size=(40, 30)) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    array = np.zeros(size[::-1], np.uint8)
+    array[5:20, 8:25] = rng.integers(0, 2, (15, 17))
+    return array
+
+
+def test_from_array_round_trip():
+    array = create_array()
+    mask = Mask.from_array(array)
+
+    assert mask.size == (40, 30)
+    assert mask.box == Mask._from_crop((40, 30), (0, 0), array != 0).box
+    assert np.array_equal(mask.to_array(1), array)
+    assert mask.area() == int(array.sum())
+
+
+def test_from_array_offset_is_clipped_to_frame():
+    array = np.ones((10, 10), np.uint8)
+    mask = Mask.from_array(array, offset=(-3, 25), size=(20, 30))
+
+    assert mask.box == (0, 25, 7, 30)
+    expected = np.zeros((30, 20), np.uint8)
+    expected[25:30, 0:7] = 255
+    assert np.array_equal(mask.to_array(), expected)
+
+
+def test_empty_mask():
+    mask = Mask.from_array(np.zeros((10, 12), np.uint8))
+
+    assert mask.is_empty()
+    assert mask.box == EMPTY_BOX
+    assert mask.area() == 0
+    assert not mask.to_array().any()
+    assert Mask.from_array(np.ones((5, 5)), offset=(50, 50), size=(10, 10)).is_empty()
+
+
+def test_union_matches_full_frame_or():
+    array1 = create_array(1)
+    array2 = np.zeros_like(array1)
+    array2[22:28, 30:38] = 1
+    union = Mask.from_array(array1).union(Mask.from_array(array2))
+
+    assert np.array_equal(union.to_array(1), array1 | array2)
+    assert Mask.empty((40, 30)).union(union) is union
+
+
+def test_dilate_matches_full_frame_dilate():
+    array = create_array(2)
+    array[0, 0] = 1
+    expected = cv2.dilate(array, np.ones((3, 3), np.uint8), iterations=4)
+
+    assert np.array_equal(Mask.from_array(array).dilate(4).to_array(1), expected)
+
+
+def test_to_pil_image_is_box_region():
+    array = create_array(3)
+    mask = Mask.from_array(array)
+    xmin, ymin, xmax, ymax = mask.box
+
+    image = np.asarray(mask.to_pil_image())
+    assert image.shape == (ymax - ymin, xmax - xmin)
+    assert np.array_equal(image != 0, array[ymin:ymax, xmin:xmax] != 0)
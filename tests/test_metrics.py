@@ -0,0 +1,45 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chat2edit.tools.batching import MicroBatcher
+from chat2edit.utils.metrics import span, submit_in_context, trace
+
+
+def get_stages(curr_trace):
+    return [curr_trace_span["stage"] for curr_trace_span in curr_trace.spans]
+
+
+def test_pool_spans_reach_the_submitting_trace():
+    def encode():
+        with span("encode"):
+            pass
+
+    with ThreadPoolExecutor(max_workers=1) as executor, trace("request") as curr_trace:
+        submit_in_context(executor, encode).result()
+        executor.submit(encode).result()
+
+    assert get_stages(curr_trace) == ["encode"]
+
+
+def test_batch_spans_reach_every_submitting_trace():
+    def run_model(items):
+        with span("model"):
+            return [item * 2 for item in items]
+
+    batcher = MicroBatcher("model", run_model, max_batch_size=2, max_wait_ms=1000)
+    traces = {}
+    barrier = threading.Barrier(2)
+
+    def request(item):
+        with trace("request") as curr_trace:
+            barrier.wait()
+            traces[item] = curr_trace
+            return batcher.submit(item).result()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(request, [1, 2])) == [2, 4]
+
+    for curr_trace in traces.values():
+        assert get_stages(curr_trace) == ["model"]
+        assert curr_trace.spans[0]["batch_size"] == 2
+        assert curr_trace.spans[0]["offset_ms"] >= 0
@@ -0,0 +1,71 @@
+import logging
+import time
+
+from chat2edit.chat2edit import _is_same_attachment
+from chat2edit.fabric.fabric_models import FabricCanvas
+from chat2edit.tools.precompute import Precomputer
+
+
+class StubToolkit:
+    def __init__(self, error: bool = False) -> None:
+        self.error = error
+        self.images = []
+
+    def precompute_segmentation(self, image) -> None:
+        if self.error:
+            raise RuntimeError("no model")
+        self.images.append(image)
+
+
+def test_runs_for_active_chats():
+    toolkit = StubToolkit()
+    precomputer = Precomputer(toolkit, idle_timeout=10)
+
+    assert precomputer.submit("chat", lambda: "image").result() is True
+    assert toolkit.images == ["image"]
+
+
+def test_idle_chats_are_dropped_and_forgotten():
+    precomputer = Precomputer(StubToolkit(), idle_timeout=0.05)
+    for i in range(100):
+        precomputer.touch(f"chat{i}")
+    time.sleep(0.1)
+    assert precomputer.is_idle("chat0")
+
+    precomputer.touch("new")
+    assert list(precomputer._last_activity) == ["new"]
+
+
+def test_errors_are_logged(caplog):
+    precomputer = Precomputer(StubToolkit(error=True), idle_timeout=10)
+
+    with caplog.at_level(logging.ERROR, "chat2edit.tools.precompute"):
+        assert precomputer.submit("chat", lambda: "image").result() is False
+    assert "chat" in caplog.records[0].getMessage()
+    assert caplog.records[0].exc_info is not None
+
+
+def create_canvas(src: str) -> FabricCanvas:
+    return FabricCanvas.model_validate(
+        {
+            "id": "canvas",
+            "objects": [],
+            "backgroundImage": {
+                "type": "image",
+                "width": 10,
+                "height": 10,
+                "src": src,
+                "filename": "image.png",
+            },
+        }
+    )
+
+
+def test_attachments_compare_by_image():
+    # Each request validates new canvases with new src strings.
+    canvas = create_canvas("data:image/png;base64," + "A" * 100)
+    same = create_canvas("data:image/png;base64," + "A" * 100)
+
+    assert _is_same_attachment(canvas, same)
+    assert not _is_same_attachment(canvas, create_canvas("data:image/png;base64,B"))
+    assert not _is_same_attachment(None, canvas)
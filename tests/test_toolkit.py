@@ -0,0 +1,43 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chat2edit.tools.base import Inpainter, Segmenter
+from chat2edit.tools.toolkit import Toolkit
+
+
+class RecordingSegmenter(Segmenter):
+    def __init__(self) -> None:
+        self.threads = []
+
+    def __call__(self, image, label):
+        self.threads.append(threading.current_thread())
+        return [1.0], [label]
+
+
+class BatchedInpainter(Inpainter):
+    batched = True
+
+    def __init__(self) -> None:
+        self.batch_sizes = []
+
+    def __call__(self, image, mask):
+        return self.batch([image], [mask])[0]
+
+    def batch(self, images, masks):
+        self.batch_sizes.append(len(images))
+        return [f"{image}-{mask}" for image, mask in zip(images, masks)]
+
+
+def test_only_batched_tools_are_batched():
+    segmenter = RecordingSegmenter()
+    inpainter = BatchedInpainter()
+    toolkit = Toolkit(segmenter, inpainter, max_batch_size=4, max_wait_ms=200)
+
+    assert toolkit.segment("image", "cat") == ([1.0], ["cat"])
+    assert segmenter.threads == [threading.current_thread()]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(toolkit.inpaint, range(4), "abcd"))
+    assert results == ["0-a", "1-b", "2-c", "3-d"]
+    assert sum(inpainter.batch_sizes) == 4
+    assert len(inpainter.batch_sizes) < 4
@@ -0,0 +1,81 @@
+import glob
+import os
+
+from chat2edit.core.trace_log import (
+    TraceLog,
+    TurnRecord,
+    hash_src,
+    iter_trace_records,
+    load_src,
+    record_step,
+    record_turn,
+    replace_srcs,
+)
+
+
+def rebuild_prompts(prompt: str, steps):
+    # How replays read the chain: every prompt extends the previous one.
+    prompts = []
+    for step in steps:
+        prompt = prompt[: step["prompt_base"]] + step["prompt"]
+        prompts.append(prompt)
+    return prompts
+
+
+def test_prompt_delta_chain_rebuilds_prompts():
+    start = "system\nturn 1\n..."
+    prompts = [
+        "system\nturn 1\nturn 2 step 1\n...",
+        "system\nturn 1\nturn 2 step 1\nstep 2\n...",
+        "another prompt after a reset\n...",
+        "another prompt after a reset\nstep 4",
+    ]
+    record = TurnRecord("chat", "instruction", start)
+    for prompt in prompts:
+        record.add_step(prompt, commands=[])
+
+    assert record.steps[0]["prompt_base"] == len("system\nturn 1\n")
+    assert record.steps[2]["prompt_base"] == 0
+    assert rebuild_prompts(start, record.steps) == prompts
+
+
+def test_replace_srcs_only_replaces_non_empty_srcs():
+    value = {"src": "data", "objects": [{"src": ""}, {"src": "other", "left": 1}]}
+
+    assert replace_srcs(value, hash_src) == {
+        "src": hash_src("data"),
+        "objects": [{"src": ""}, {"src": hash_src("other"), "left": 1}],
+    }
+    assert value["src"] == "data"
+
+
+def test_trace_log_round_trip(tmp_path):
+    trace_log = TraceLog(str(tmp_path), store_images=True, flush_records=2)
+    for turn in range(3):
+        with record_turn(trace_log, "chat", f"turn {turn}", [], "...") as record:
+            record_step("prompt\n...", response="ok")
+            record.data["status"] = "success"
+    # Two records were flushed as one gzip member, the third is still buffered.
+    paths = glob.glob(os.path.join(str(tmp_path), "*.jsonl.gz"))
+    assert [r["instruction"] for r in iter_trace_records(paths)] == [
+        "turn 0",
+        "turn 1",
+    ]
+
+    trace_log.flush()
+    records = list(iter_trace_records(paths))
+    assert [r["instruction"] for r in records] == ["turn 0", "turn 1", "turn 2"]
+    assert records[2]["steps"] == [
+        {"prompt_base": 0, "prompt": "prompt\n...", "response": "ok"}
+    ]
+    assert records[2]["status"] == "success"
+
+
+def test_stored_images_load_by_hash(tmp_path):
+    trace_log = TraceLog(str(tmp_path), store_images=True)
+    src_hash = trace_log._store_src("data:image/png;base64,AAAA")
+
+    assert src_hash == hash_src("data:image/png;base64,AAAA")
+    image_directory = trace_log.get_image_directory()
+    assert load_src(image_directory, src_hash) == "data:image/png;base64,AAAA"
+    assert load_src(image_directory, hash_src("missing")) is None